@@ -0,0 +1,230 @@
+# bench/fakes.py
+"""Các đối tượng Discord giả (Context, Interaction, kênh, voice client) cho benchmark offline.
+
+Chỉ cài đúng những thuộc tính/phương thức mà các cog đang dùng. Mỗi lời gọi "API Discord"
+(gửi/sửa tin nhắn) chờ `discord_latency` giây để mô phỏng độ trễ mạng thật.
+"""
+import asyncio
+import itertools
+import threading
+import discord
+
+_ids = itertools.count(10_000)
+discord_latency = 0.0
+
+
+async def _api_call():
+    if discord_latency: await asyncio.sleep(discord_latency)
+    else: await asyncio.sleep(0)
+
+
+class FakeMessage:
+    def __init__(self, channel, content=None, embed=None, view=None):
+        self.id = next(_ids)
+        self.channel = channel
+        self.content = content
+        self.embeds = [embed] if embed else []
+        self.view = view
+
+    async def edit(self, content=None, embed=None, view=None, **kwargs):
+        await _api_call()
+        self.channel.edits += 1
+        if content is not None: self.content = content
+        if embed is not None: self.embeds = [embed]
+        if view is not None: self.view = view
+        return self
+
+
+class FakeTextChannel:
+    def __init__(self, guild=None):
+        self.id = next(_ids)
+        self.guild = guild
+        self.sent = 0
+        self.edits = 0
+        self.last_message = None
+
+    async def send(self, content=None, embed=None, view=None, **kwargs):
+        await _api_call()
+        self.sent += 1
+        self.last_message = FakeMessage(self, content, embed, view)
+        return self.last_message
+
+
+class FakeAudioSource(discord.AudioSource):
+    """Thay cho FFmpegOpusAudio: không chạy FFmpeg, chỉ đọc hết ống (pipe=True) như FFmpeg sẽ làm."""
+    def __init__(self, source, *, pipe=False, **kwargs):
+        self.source = source
+        if pipe: threading.Thread(target=self._drain, daemon=True).start()
+
+    def _drain(self):
+        while self.source.read(64 * 1024): pass
+
+    def read(self):
+        return b''
+
+    def is_opus(self):
+        return True
+
+
+class FakeVoiceClient:
+    """Voice client giả: mỗi nguồn "phát" trong `track_seconds` giây rồi gọi callback `after`."""
+    track_seconds = 600.0
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.guild = channel.guild
+        self._playing = False
+        self._after = None
+        self._timer = None
+        self._connected = True
+        self.started = asyncio.Event() # Được set khi nguồn đầu tiên bắt đầu phát
+
+    def is_connected(self):
+        return self._connected
+
+    def is_playing(self):
+        return self._playing
+
+    def is_paused(self):
+        return False
+
+    def play(self, source, *, after=None):
+        self._playing = True
+        self._after = after
+        self.started.set()
+        self._timer = asyncio.get_running_loop().call_later(self.track_seconds, self._finish)
+
+    def _finish(self):
+        if not self._playing: return
+        self._playing = False
+        if self._timer: self._timer.cancel()
+        after, self._after = self._after, None
+        if after: after(None)
+
+    def stop(self):
+        self._finish()
+
+    async def move_to(self, channel):
+        await _api_call()
+        self.channel = channel
+
+    async def disconnect(self, force=False):
+        self._finish()
+        self._connected = False
+        self.guild.voice_client = None
+
+
+class FakeVoiceChannel:
+    def __init__(self, guild):
+        self.id = next(_ids)
+        self.guild = guild
+
+    async def connect(self, **kwargs):
+        await _api_call()
+        self.guild.voice_client = FakeVoiceClient(self)
+        return self.guild.voice_client
+
+
+class FakeGuild:
+    def __init__(self):
+        self.id = next(_ids)
+        self.voice_client = None
+        self.text_channel = FakeTextChannel(self)
+        self.voice_channel = FakeVoiceChannel(self)
+
+    def get_channel(self, channel_id):
+        for channel in (self.text_channel, self.voice_channel):
+            if channel.id == channel_id: return channel
+        return None
+
+
+class FakeVoiceState:
+    def __init__(self, channel):
+        self.channel = channel
+
+
+class FakeUser:
+    def __init__(self):
+        self.id = next(_ids)
+
+
+class FakeMember:
+    def __init__(self, guild, in_voice=True):
+        self.id = next(_ids)
+        self.name = f"user{self.id}"
+        self.guild = guild
+        self.voice = FakeVoiceState(guild.voice_channel) if in_voice else None
+
+
+class FakeCommand:
+    def __init__(self, name):
+        self.name = name
+
+
+class FakeContext:
+    """Đủ cho các hybrid command: defer, send, author, guild, channel."""
+    def __init__(self, guild, author, command_name=''):
+        self.guild = guild
+        self.author = author
+        self.channel = guild.text_channel
+        self.command = FakeCommand(command_name)
+        self.interaction = None # Như lệnh gọi bằng prefix: defer/send đi thẳng tới kênh
+
+    async def defer(self, ephemeral=False):
+        await _api_call()
+
+    async def send(self, content=None, **kwargs):
+        return await self.channel.send(content, **kwargs)
+
+
+class FakeResponse:
+    def __init__(self, interaction):
+        self.interaction = interaction
+
+    async def defer(self, **kwargs):
+        await _api_call()
+
+    async def send_message(self, content=None, **kwargs):
+        self.interaction.message = await self.interaction.channel.send(content, **kwargs)
+
+    async def edit_message(self, **kwargs):
+        await self.interaction.message.edit(**kwargs)
+
+
+class FakeFollowup:
+    def __init__(self, interaction):
+        self.interaction = interaction
+
+    async def send(self, content=None, **kwargs):
+        self.interaction.message = await self.interaction.channel.send(content, **kwargs)
+        return self.interaction.message
+
+
+class FakeInteraction:
+    def __init__(self, guild, user, message=None):
+        self.guild = guild
+        self.user = user
+        self.channel = guild.text_channel
+        self.message = message
+        self.response = FakeResponse(self)
+        self.followup = FakeFollowup(self)
+
+    async def edit_original_response(self, **kwargs):
+        await self.message.edit(**kwargs)
+
+
+class FakeBot:
+    """Những gì các cog dùng từ commands.Bot: loop, http_session, user, get_guild."""
+    def __init__(self, http_session):
+        self.loop = asyncio.get_running_loop()
+        self.http_session = http_session
+        self.user = FakeUser()
+        self.guilds = {}
+
+    def get_guild(self, guild_id):
+        return self.guilds.get(guild_id)
+
+    def new_guild(self):
+        guild = FakeGuild()
+        self.guilds[guild.id] = guild
+        return guild
@@ -0,0 +1,293 @@
+# bench/run.py
+"""Benchmark end-to-end chạy hoàn toàn offline.
+
+Gọi thẳng `ChatCog.chat`, `MusicCog.play` (YouTube và playlist Spotify) và các nút Blackjack bằng
+Context/Interaction giả (bench/fakes.py). OpenRouter, ElevenLabs và Spotify Web API được thay bằng
+server cục bộ (bench/servers.py), yt-dlp được thay bằng StubYoutubeDL (bench/stubs.py).
+Mỗi kịch bản chạy ở các mức đồng thời tăng dần và in ra p50/p95/p99, throughput, độ trễ event loop
+và độ sâu hàng đợi lớn nhất của từng executor.
+
+Cần cài đủ thư viện của bot (discord.py, aiohttp, spotipy, elevenlabs, yt-dlp). Chạy từ thư mục gốc:
+
+    python -m bench.run --scenarios chat,music --concurrency 1,4,16,64 --requests 32
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path: sys.path.insert(0, ROOT)
+
+from bench import fakes
+from bench.fakes import FakeBot, FakeContext, FakeInteraction, FakeMember, FakeAudioSource
+from bench.servers import StandInConfig, StandInServer
+from bench.stubs import StubYoutubeDL
+
+SCENARIOS = ('chat', 'chat_voice', 'music', 'spotify', 'blackjack')
+LAG_SAMPLE_INTERVAL = 0.01 # Giây giữa hai lần đo độ trễ event loop
+PLAYBACK_TIMEOUT = 60 # Giây chờ tối đa một bài bắt đầu phát
+
+
+# --- CHUẨN BỊ MÔI TRƯỜNG ---
+def prepare_environment(workdir: str):
+    """Đặt biến môi trường giả và chuyển sang thư mục tạm (DB, cache, template) trước khi import cog."""
+    for key in ('OPENROUTER_API_KEY', 'ELEVENLABS_API_KEY', 'SPOTIPY_CLIENT_ID', 'SPOTIPY_CLIENT_SECRET'):
+        os.environ[key] = 'bench'
+    os.environ.setdefault('AUDIO_CACHE', '0')
+    templates = os.path.join(ROOT, 'templates')
+    if os.path.isdir(templates): shutil.copytree(templates, os.path.join(workdir, 'templates'))
+    os.chdir(workdir)
+
+
+def patch_services(base_url: str):
+    """Nối các cog vào server cục bộ và yt-dlp giả. Trả về (chat_cog, music_cog, blackjack_cog)."""
+    import discord
+    import spotipy
+    import yt_dlp
+    from elevenlabs.client import ElevenLabs
+    from cogs import chat_cog, music_cog, blackjack_cog
+
+    discord.FFmpegOpusAudio = FakeAudioSource
+    # YTDLPool import yt_dlp ở lần dùng đầu tiên nên sẽ nhận lớp giả này
+    yt_dlp.YoutubeDL = StubYoutubeDL
+    chat_cog.OPENROUTER_API_URL = f"{base_url}/api/v1/chat/completions"
+    chat_cog.eleven_client = ElevenLabs(api_key='bench', base_url=base_url)
+    spotify = spotipy.Spotify(auth='bench', retries=0)
+    spotify.prefix = f"{base_url}/v1/"
+    music_cog.spotify_ingest.client = spotify
+    return chat_cog, music_cog, blackjack_cog
+
+
+# --- ĐO ĐẠC ---
+class LoadMonitor:
+    """Đo độ trễ event loop (thời gian một lần sleep bị trễ so với dự kiến) và độ sâu hàng đợi executor."""
+    def __init__(self, executor_stats):
+        self.executor_stats = executor_stats
+        self.lags = []
+        self.max_queued = {}
+        self._task = None
+
+    def start(self):
+        self.lags, self.max_queued = [], {}
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        try: await self._task
+        except asyncio.CancelledError: pass
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + LAG_SAMPLE_INTERVAL
+            await asyncio.sleep(LAG_SAMPLE_INTERVAL)
+            self.lags.append(max(0.0, loop.time() - expected))
+            for name, stats in self.executor_stats().items():
+                self.max_queued[name] = max(self.max_queued.get(name, 0), stats['queued'])
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values: return 0.0
+    index = max(0, math.ceil(fraction * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+
+# --- CÁC KỊCH BẢN ---
+class Bench:
+    def __init__(self, bot, chat, music, blackjack, args):
+        self.bot = bot
+        self.chat = chat
+        self.music = music
+        self.blackjack = blackjack
+        self.args = args
+
+    async def run_chat(self, index, voice=False):
+        guild = self.bot.new_guild()
+        ctx = FakeContext(guild, FakeMember(guild, in_voice=voice), 'chat')
+        await self.chat.chat.callback(self.chat, ctx, f"benchmark message {index}", voice)
+
+    async def run_chat_voice(self, index):
+        await self.run_chat(index, voice=True)
+
+    async def _play(self, query):
+        guild = self.bot.new_guild()
+        member = FakeMember(guild)
+        await self.music.play.callback(self.music, FakeContext(guild, member, 'play'), query=query)
+        return guild, member
+
+    async def _leave(self, guild, member):
+        await self.music.leave.callback(self.music, FakeContext(guild, member, 'leave'))
+
+    async def run_music(self, index):
+        """Tính tới lúc bài bắt đầu phát (tìm kiếm + lấy link stream), không chỉ lúc lệnh trả lời."""
+        guild, member = await self._play(f"bench song {index % self.args.distinct}")
+        try:
+            await asyncio.wait_for(guild.voice_client.started.wait(), PLAYBACK_TIMEOUT)
+        finally:
+            await self._leave(guild, member)
+
+    async def run_spotify(self, index):
+        """Tính tới lúc cả playlist đã được thêm xong vào hàng đợi."""
+        guild, member = await self._play(f"https://open.spotify.com/playlist/bench{index % self.args.distinct}")
+        try:
+            for task in list(self.music.ingest_tasks.get(guild.id, ())): await task
+        finally:
+            await self._leave(guild, member)
+
+    async def run_blackjack(self, index):
+        """Một ván trọn vẹn: /blackjack start rồi bấm Hit tới khi đạt 17 điểm, sau đó Stand."""
+        guild = self.bot.new_guild()
+        member = FakeMember(guild, in_voice=False)
+        interaction = FakeInteraction(guild, member)
+        await self.blackjack.start_blackjack.callback(self.blackjack, interaction)
+        view = interaction.message.view
+        try:
+            while member.id in self.blackjack.active_games:
+                game = self.blackjack.active_games[member.id]
+                button = view.hit_button if game.player_score < 17 else view.stand_button
+                await button.callback(FakeInteraction(guild, member, interaction.message))
+        finally:
+            view.stop()
+
+    async def run_level(self, scenario, concurrency):
+        run_one = getattr(self, f"run_{scenario}")
+        semaphore = asyncio.Semaphore(concurrency)
+        latencies, errors = [], 0
+
+        async def timed(index):
+            nonlocal errors
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    await run_one(index)
+                except Exception as e:
+                    errors += 1
+                    print(f"[{scenario}] Lỗi ở request {index}: {e!r}")
+                    return
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(timed(index) for index in range(self.args.requests)))
+        return latencies, errors, time.perf_counter() - started
+
+
+def summarize(scenario, concurrency, latencies, errors, elapsed, monitor):
+    latencies = sorted(latencies)
+    lags = sorted(monitor.lags)
+    return {
+        'scenario': scenario,
+        'concurrency': concurrency,
+        'requests': len(latencies) + errors,
+        'errors': errors,
+        'throughput_rps': len(latencies) / elapsed if elapsed else 0.0,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p95_ms': percentile(latencies, 0.95) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'loop_lag_p99_ms': percentile(lags, 0.99) * 1000,
+        'loop_lag_max_ms': (lags[-1] if lags else 0.0) * 1000,
+        'executor_max_queued': dict(monitor.max_queued),
+    }
+
+
+def print_result(result):
+    queued = ' '.join(f"{name}={depth}" for name, depth in sorted(result['executor_max_queued'].items()) if depth)
+    print(f"{result['scenario']:<11} c={result['concurrency']:<4} n={result['requests']:<5} err={result['errors']:<3} "
+          f"{result['throughput_rps']:8.2f} req/s  p50={result['p50_ms']:8.1f}ms  p95={result['p95_ms']:8.1f}ms  "
+          f"p99={result['p99_ms']:8.1f}ms  lag p99/max={result['loop_lag_p99_ms']:.1f}/{result['loop_lag_max_ms']:.1f}ms  "
+          f"queued: {queued or '-'}")
+
+
+async def run(args):
+    config = StandInConfig(llm_latency=args.llm_latency, llm_first_token=args.llm_first_token, llm_tokens=args.llm_tokens,
+                           spotify_latency=args.spotify_latency, playlist_tracks=args.playlist_tracks)
+    server = await StandInServer(config).start()
+    fakes.discord_latency = args.discord_latency
+    fakes.FakeVoiceClient.track_seconds = args.track_seconds
+    StubYoutubeDL.search_latency = args.search_latency
+    StubYoutubeDL.stream_latency = args.stream_latency
+    chat_cog, music_cog, blackjack_cog = patch_services(server.base_url)
+    from utils.http_client import create_http_session
+    from utils.executors import executor_stats, shutdown_executors
+
+    session = create_http_session()
+    bot = FakeBot(session)
+    chat = chat_cog.ChatCog(bot)
+    music = music_cog.MusicCog(bot)
+    blackjack = blackjack_cog.BlackjackCog(bot)
+    # Benchmark đường gọi ElevenLabs thật sự: luôn bỏ qua cache TTS
+    def skip_tts_cache(*args): return None
+    chat.tts_cache.lookup = skip_tts_cache
+    chat.tts_cache.store = skip_tts_cache
+    cogs = (chat, music, blackjack)
+    for cog in cogs: await cog.cog_load()
+
+    bench = Bench(bot, chat, music, blackjack, args)
+    monitor = LoadMonitor(executor_stats)
+    results = []
+    try:
+        for scenario in args.scenarios:
+            for concurrency in args.concurrency:
+                monitor.start()
+                latencies, errors, elapsed = await bench.run_level(scenario, concurrency)
+                await monitor.stop()
+                result = summarize(scenario, concurrency, latencies, errors, elapsed, monitor)
+                print_result(result)
+                results.append(result)
+    finally:
+        for cog in cogs: await cog.cog_unload()
+        await session.close()
+        await server.stop()
+        shutdown_executors(wait=False)
+    print(f"Số request tới server giả: {server.requests}")
+    return results
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark offline cho bot (không cần Discord, OpenRouter, ElevenLabs, YouTube, Spotify).")
+    parser.add_argument('--scenarios', default='chat,music,spotify,blackjack', help=f"Danh sách kịch bản, chọn trong: {', '.join(SCENARIOS)}")
+    parser.add_argument('--concurrency', default='1,4,16,64', help="Các mức đồng thời, tăng dần")
+    parser.add_argument('--requests', type=int, default=32, help="Số request ở mỗi mức đồng thời")
+    parser.add_argument('--distinct', type=int, default=None, help="Số bài/playlist khác nhau (nhỏ hơn --requests để đo cache hit)")
+    parser.add_argument('--llm-latency', type=float, default=0.3)
+    parser.add_argument('--llm-first-token', type=float, default=0.1)
+    parser.add_argument('--llm-tokens', type=int, default=60)
+    parser.add_argument('--search-latency', type=float, default=0.3, help="Giây cho một lần tìm kiếm yt-dlp giả")
+    parser.add_argument('--stream-latency', type=float, default=0.5, help="Giây cho một lần lấy link stream yt-dlp giả")
+    parser.add_argument('--spotify-latency', type=float, default=0.05)
+    parser.add_argument('--playlist-tracks', type=int, default=25)
+    parser.add_argument('--discord-latency', type=float, default=0.05, help="Giây cho mỗi lần gửi/sửa tin nhắn Discord giả")
+    parser.add_argument('--track-seconds', type=float, default=600.0, help="Thời lượng \"phát\" của mỗi bài")
+    parser.add_argument('--json', dest='json_path', help="Ghi kết quả ra file JSON")
+    args = parser.parse_args(argv)
+    args.scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = [name for name in args.scenarios if name not in SCENARIOS]
+    if unknown: parser.error(f"Kịch bản không hợp lệ: {', '.join(unknown)}")
+    args.concurrency = sorted(int(level) for level in args.concurrency.split(','))
+    args.distinct = args.distinct or args.requests
+    if args.json_path: args.json_path = os.path.abspath(args.json_path)
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    workdir = tempfile.mkdtemp(prefix='bot-bench-')
+    prepare_environment(workdir)
+    try:
+        results = asyncio.run(run(args))
+    finally:
+        os.chdir(ROOT)
+        shutil.rmtree(workdir, ignore_errors=True)
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"Đã ghi kết quả vào {args.json_path}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+# bench/servers.py
+"""Server aiohttp cục bộ đóng vai OpenRouter, ElevenLabs và Spotify Web API.
+
+Mọi độ trễ đều cấu hình được qua `StandInConfig` để so sánh các kịch bản tải khác nhau.
+"""
+import asyncio
+import json
+import os
+from dataclasses import dataclass
+from aiohttp import web
+
+
+@dataclass
+class StandInConfig:
+    llm_latency: float = 0.3 # Tổng thời gian sinh một câu trả lời
+    llm_first_token: float = 0.1 # Thời gian tới token đầu tiên khi stream
+    llm_tokens: int = 60 # Số token mỗi câu trả lời
+    tts_chunks: int = 20 # Số chunk audio mỗi câu TTS
+    tts_chunk_interval: float = 0.02
+    tts_chunk_size: int = 4096
+    spotify_latency: float = 0.05 # Độ trễ mỗi request Spotify
+    playlist_tracks: int = 300 # Số bài của mỗi playlist giả
+
+
+def spotify_track(collection_id: str, index: int):
+    return {'id': f'{collection_id}t{index}', 'name': f'Song {index}', 'duration_ms': 180_000,
+            'artists': [{'name': f'Artist {collection_id}'}]}
+
+
+class StandInServer:
+    def __init__(self, config: StandInConfig):
+        self.config = config
+        self.requests = {'openrouter': 0, 'elevenlabs': 0, 'spotify': 0}
+        self.runner = None
+        self.base_url = None
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post('/api/v1/chat/completions', self.chat_completions)
+        app.router.add_post('/v1/text-to-speech/{voice_id}/stream', self.text_to_speech)
+        app.router.add_get('/v1/playlists/{playlist_id}', self.playlist)
+        app.router.add_get('/v1/playlists/{playlist_id}/tracks', self.playlist_tracks)
+        app.router.add_get('/v1/albums/{album_id}/tracks', self.album_tracks)
+        app.router.add_get('/v1/albums/{album_id}/tracks/', self.album_tracks) # spotipy thêm dấu '/' cuối
+        app.router.add_get('/v1/artists/{artist_id}/top-tracks', self.artist_top_tracks)
+        app.router.add_get('/v1/tracks/{track_id}', self.track)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.base_url = f'http://127.0.0.1:{port}'
+        return self
+
+    async def stop(self):
+        if self.runner: await self.runner.cleanup()
+
+    # --- OPENROUTER ---
+    async def chat_completions(self, request):
+        self.requests['openrouter'] += 1
+        payload = await request.json()
+        tokens = [f"tok{i} " for i in range(self.config.llm_tokens)]
+        if not payload.get('stream'):
+            await asyncio.sleep(self.config.llm_latency)
+            return web.json_response({'choices': [{'message': {'role': 'assistant', 'content': ''.join(tokens)}}]})
+
+        response = web.StreamResponse(headers={'Content-Type': 'text/event-stream'})
+        await response.prepare(request)
+        await response.write(b': OPENROUTER PROCESSING\n\n')
+        await asyncio.sleep(self.config.llm_first_token)
+        interval = max(0.0, self.config.llm_latency - self.config.llm_first_token) / max(1, len(tokens))
+        for token in tokens:
+            chunk = {'choices': [{'delta': {'content': token}}]}
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode('utf-8'))
+            await asyncio.sleep(interval)
+        await response.write(b'data: [DONE]\n\n')
+        await response.write_eof()
+        return response
+
+    # --- ELEVENLABS ---
+    async def text_to_speech(self, request):
+        self.requests['elevenlabs'] += 1
+        await request.read()
+        response = web.StreamResponse(headers={'Content-Type': 'audio/mpeg'})
+        await response.prepare(request)
+        for _ in range(self.config.tts_chunks):
+            await asyncio.sleep(self.config.tts_chunk_interval)
+            await response.write(os.urandom(self.config.tts_chunk_size))
+        await response.write_eof()
+        return response
+
+    # --- SPOTIFY ---
+    async def _spotify_delay(self):
+        self.requests['spotify'] += 1
+        await asyncio.sleep(self.config.spotify_latency)
+
+    def _page(self, collection_id, offset, limit, wrap):
+        end = min(offset + limit, self.config.playlist_tracks)
+        tracks = [spotify_track(collection_id, index) for index in range(offset, end)]
+        items = [{'track': track} for track in tracks] if wrap else tracks
+        return {'items': items, 'total': self.config.playlist_tracks, 'offset': offset, 'limit': limit}
+
+    async def playlist(self, request):
+        await self._spotify_delay()
+        playlist_id = request.match_info['playlist_id']
+        return web.json_response({'snapshot_id': f'{playlist_id}-snapshot', 'tracks': self._page(playlist_id, 0, 100, wrap=True)})
+
+    async def playlist_tracks(self, request):
+        await self._spotify_delay()
+        offset, limit = int(request.query.get('offset', 0)), int(request.query.get('limit', 100))
+        return web.json_response(self._page(request.match_info['playlist_id'], offset, limit, wrap=True))
+
+    async def album_tracks(self, request):
+        await self._spotify_delay()
+        offset, limit = int(request.query.get('offset', 0)), int(request.query.get('limit', 50))
+        return web.json_response(self._page(request.match_info['album_id'], offset, limit, wrap=False))
+
+    async def artist_top_tracks(self, request):
+        await self._spotify_delay()
+        artist_id = request.match_info['artist_id']
+        return web.json_response({'tracks': [spotify_track(artist_id, index) for index in range(10)]})
+
+    async def track(self, request):
+        await self._spotify_delay()
+        track_id = request.match_info['track_id']
+        return web.json_response(spotify_track(track_id, 0) | {'id': track_id})
@@ -0,0 +1,28 @@
+# bench/stubs.py
+"""YoutubeDL giả: không truy cập mạng, chỉ ngủ một khoảng trễ cấu hình được rồi trả kết quả cố định."""
+import hashlib
+import time
+
+
+class StubYoutubeDL:
+    search_latency = 0.4 # Giây cho một lần "ytsearch:"
+    stream_latency = 0.6 # Giây cho một lần lấy link stream
+    duration = 210
+
+    def __init__(self, params=None):
+        self.params = params or {}
+        self.cookiejar = None
+
+    def extract_info(self, url, download=False, **kwargs):
+        if url.startswith('ytsearch:'):
+            time.sleep(self.search_latency)
+            query = url[len('ytsearch:'):]
+            video_id = hashlib.sha1(query.encode('utf-8')).hexdigest()[:11]
+            return {'entries': [{'webpage_url': f'https://www.youtube.com/watch?v={video_id}', 'title': query}]}
+        time.sleep(self.stream_latency)
+        expire = int(time.time()) + 6 * 3600
+        return {'url': f'https://bench.invalid/videoplayback?expire={expire}', 'title': url, 'webpage_url': url,
+                'duration': self.duration, 'acodec': 'opus'}
+
+    def close(self):
+        pass
@@ -4,6 +4,7 @@ from discord.ext import commands
 from discord import app_commands, ui, ButtonStyle
 import random
 import asyncio
+from utils.metrics import BLACKJACK_ACTIVE_GAMES
 
 # --- LOGIC CƠ BẢN CỦA TRÒ CHƠI BLACKJACK ---
 
@@ -178,6 +179,7 @@ class BlackjackCog(commands.Cog):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
         self.active_games = {} # Lưu các ván bài đang diễn ra theo user_id
+        BLACKJACK_ACTIVE_GAMES.set_function(self.active_games.__len__)
 
     def end_game(self, user_id: int):
         """Xóa ván bài khỏi danh sách đang hoạt động."""
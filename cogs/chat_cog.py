@@ -1,134 +1,116 @@
 # cogs/chat_cog.py
 import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
 from discord import app_commands, ui, ButtonStyle
 import os
-import aiohttp
-import sqlite3
 import asyncio
+import aiohttp
 import re
-import tempfile
-from elevenlabs.client import ElevenLabs
-from elevenlabs import Voice, VoiceSettings
+import json
+import threading
+import time
+from utils.storage import ChatStorage
+from utils.history_cache import HistoryCache
+from utils.persona_registry import PersonaRegistry
+from utils.streaming_reply import StreamingReply
+from utils.audio_pipe import AudioChunkPipe
+from utils.tts_cache import TTSCache
+from utils.executors import run_in
+from utils.prompt_builder import build_messages, build_summary_request, load_encoding, TIKTOKEN_ENABLED
+from utils.llm_scheduler import LLMScheduler, SchedulerBusy, RETRY_STATUSES, retry_delay
+from utils.metrics import OPENROUTER_SECONDS, TTS_FIRST_BYTE_SECONDS
 
 # --- CÀI ĐẶT BIẾN TOÀN CỤC ---
 OPENROUTER_API_KEY = os.getenv('OPENROUTER_API_KEY')
 ELEVENLABS_API_KEY = os.getenv('ELEVENLABS_API_KEY')
 DB_FILE = 'memory.db'
-MEMORY_LIMIT = 33
+MEMORY_LIMIT = 33 # Số lượt gần nhất được giữ nguyên văn, các lượt cũ hơn được gộp vào bản tóm tắt
+HISTORY_FLUSH_INTERVAL = 0.05 # Giây chờ tối đa trước khi ghi một lô lịch sử
+HISTORY_FLUSH_BATCH = 200 # Số dòng tối đa trong một lô
+HISTORY_WINDOW = MEMORY_LIMIT # Số lượt giữ trong cache; số lượt thực sự gửi đi do PROMPT_TOKEN_BUDGET quyết định
+HISTORY_CACHE_MAX_ENTRIES = 5000 # Số cặp (user, persona) tối đa giữ trong cache
+HISTORY_CACHE_MAX_BYTES = 32 * 1024 * 1024 # Dung lượng ước lượng tối đa của cache lịch sử
 ELEVENLABS_VOICE_ID = "Pt5YrLNyu6d2s3s4CVMg"
+ELEVENLABS_MODEL_ID = "eleven_flash_v2_5"
+TTS_MAX_BUFFERED_CHUNKS = 64 # Số chunk audio tối đa được đệm trước khi FFmpeg đọc
+TTS_CACHE_FOLDER = 'tts_cache'
+TTS_CACHE_MAX_BYTES = int(os.getenv('TTS_CACHE_MAX_BYTES', 256 * 1024 * 1024)) # Dung lượng tối đa của cache TTS
 PERSONA_FOLDER = 'templates'
 DEFAULT_PERSONA = 'kurisu_makise'
-
-if ELEVENLABS_API_KEY:
-    eleven_client = ElevenLabs(api_key=ELEVENLABS_API_KEY)
-else:
-    eleven_client = None
+PERSONA_REFRESH_SECONDS = 15 # Chu kỳ kiểm tra file persona bị sửa từ bên ngoài
+OPENROUTER_API_URL = "https://openrouter.ai/api/v1/chat/completions"
+OPENROUTER_MODEL = "deepseek/deepseek-chat-v3.1"
+CHAT_STREAMING = os.getenv('CHAT_STREAMING', '1') != '0' # Hiển thị câu trả lời dần dần khi AI đang sinh
+STREAM_EDIT_INTERVAL = 1.2 # Giây tối thiểu giữa hai lần sửa tin nhắn khi stream
+LLM_MAX_CONCURRENCY = int(os.getenv('LLM_MAX_CONCURRENCY', 8)) # Số request OpenRouter chạy cùng lúc
+LLM_MAX_QUEUE = int(os.getenv('LLM_MAX_QUEUE', 50)) # Số request chờ tối đa trước khi từ chối
+LLM_MAX_QUEUE_PER_USER = 2 # Số tin nhắn một user được xếp hàng chờ
+OPENROUTER_MAX_ATTEMPTS = 3 # Tổng số lần gửi request khi gặp 429/5xx
+PROMPT_TOKEN_BUDGET = int(os.getenv('PROMPT_TOKEN_BUDGET', 4000)) # Tổng token tối đa cho system prompt + tóm tắt + lịch sử
+SUMMARY_ENABLED = os.getenv('CHAT_SUMMARY', '1') != '0' # Tóm tắt các lượt cũ thay vì xóa hẳn
+SUMMARY_BATCH = 10 # Chỉ tóm tắt khi có ít nhất bấy nhiêu lượt nằm ngoài MEMORY_LIMIT
+SUMMARY_MAX_BACKLOG = 60 # Số lượt chưa tóm tắt tối đa trước khi bị xóa hẳn (khi API tóm tắt lỗi kéo dài)
+SUMMARY_MAX_WORDS = 200
+SUMMARY_MAX_TOKENS = 400
+
+eleven_client = None # Tạo ở lần đọc TTS đầu tiên, xem get_eleven_client()
+_eleven_client_lock = threading.Lock()
+if not ELEVENLABS_API_KEY:
     print("CẢNH BÁO: ELEVENLABS_API_KEY chưa được thiết lập. Tính năng voice sẽ không hoạt động.")
 
-# --- CÁC HÀM QUẢN LÝ DATABASE ---
-def setup_database():
-    """Khởi tạo hoặc cập nhật các bảng cần thiết trong database."""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    # Bảng lưu trữ lịch sử trò chuyện theo user và persona
-    cursor.execute('''CREATE TABLE IF NOT EXISTS conversations (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        user_id INTEGER NOT NULL,
-                        persona_name TEXT NOT NULL,
-                        role TEXT NOT NULL,
-                        content TEXT NOT NULL,
-                        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-                    )''')
-    # Bảng lưu trữ persona đang hoạt động cho mỗi kênh
-    cursor.execute('''CREATE TABLE IF NOT EXISTS channel_personalities (
-                        channel_id INTEGER PRIMARY KEY,
-                        persona_name TEXT NOT NULL
-                    )''')
-    conn.commit()
-    conn.close()
-
-def prune_history(user_id, persona_name):
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    cursor.execute("SELECT id FROM conversations WHERE user_id = ? AND persona_name = ? ORDER BY timestamp DESC LIMIT 1 OFFSET ?", (user_id, persona_name, MEMORY_LIMIT))
-    limit_id = cursor.fetchone()
-    if limit_id:
-        cursor.execute("DELETE FROM conversations WHERE user_id = ? AND persona_name = ? AND id <= ?", (user_id, persona_name, limit_id[0]))
-    conn.commit()
-    conn.close()
-
-def add_to_history(user_id, persona_name, role, content):
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    cursor.execute("INSERT INTO conversations (user_id, persona_name, role, content) VALUES (?, ?, ?, ?)", (user_id, persona_name, role, content))
-    conn.commit()
-    conn.close()
-    prune_history(user_id, persona_name)
-
-def get_history(user_id, persona_name):
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    cursor.execute("SELECT role, content FROM conversations WHERE user_id = ? AND persona_name = ? ORDER BY timestamp DESC LIMIT 10", (user_id, persona_name))
-    history = [{"role": row[0], "content": row[1]} for row in cursor.fetchall()][::-1]
-    conn.close()
-    return history
-
-def delete_user_persona_history(user_id, persona_name):
-    """Xóa toàn bộ lịch sử trò chuyện của một user với một persona cụ thể."""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM conversations WHERE user_id = ? AND persona_name = ?", (user_id, persona_name))
-    conn.commit()
-    deleted_rows = cursor.rowcount
-    conn.close()
-    return deleted_rows
-
-def set_channel_persona(channel_id, persona_name):
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    cursor.execute("INSERT OR REPLACE INTO channel_personalities (channel_id, persona_name) VALUES (?, ?)", (channel_id, persona_name))
-    conn.commit()
-    conn.close()
-
-def get_channel_persona(channel_id):
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    cursor.execute("SELECT persona_name FROM channel_personalities WHERE channel_id = ?", (channel_id,))
-    result = cursor.fetchone()
-    conn.close()
-    return result[0] if result else DEFAULT_PERSONA
-
-# --- CÁC HÀM QUẢN LÝ FILE PERSONA (GIỮ NGUYÊN) ---
-def load_persona(persona_name: str):
-    safe_persona_name = os.path.basename(persona_name)
-    filepath = os.path.join(PERSONA_FOLDER, f"{safe_persona_name}.txt")
+def get_eleven_client():
+    """Client ElevenLabs dùng chung, chỉ import SDK và tạo client ở lần dùng đầu tiên. Chạy trong executor."""
+    global eleven_client
+    if eleven_client is None:
+        with _eleven_client_lock:
+            if eleven_client is None:
+                from elevenlabs.client import ElevenLabs
+                eleven_client = ElevenLabs(api_key=ELEVENLABS_API_KEY)
+    return eleven_client
+
+# --- CÁC HÀM TTS ---
+def clean_tts_text(text: str):
+    """Bỏ các đoạn hành động (*...*), ký tự markdown và emoji trước khi đọc thành tiếng."""
+    text_plain = re.sub(r'\*[^*]+\*', '', text)
+    text_plain = re.sub(r'([_~`])', '', text_plain)
+    text_plain = re.sub(r'[^\w\s\.,!?\-\'"():;]', '', text_plain, flags=re.UNICODE)
+    return ' '.join(text_plain.split()).strip()
+
+def log_player_error(error):
+    if error: print(f'Player error: {error}')
+
+def pump_tts(pipe: AudioChunkPipe, text_plain: str):
+    """Chạy trong executor: đẩy từng chunk từ ElevenLabs vào ống cho tới khi hết hoặc bị hủy.
+
+    Trả về toàn bộ audio nếu đã nhận đủ (để lưu cache), hoặc None nếu bị hủy/lỗi giữa chừng.
+    """
+    audio = bytearray()
+    started = time.perf_counter()
     try:
-        with open(filepath, 'r', encoding='utf-8') as f: return f.read()
-    except FileNotFoundError: return None
-
-def save_persona(persona_name: str, content: str):
-    if not os.path.exists(PERSONA_FOLDER): os.makedirs(PERSONA_FOLDER)
-    safe_persona_name = os.path.basename(persona_name)
-    filepath = os.path.join(PERSONA_FOLDER, f"{safe_persona_name}.txt")
-    with open(filepath, 'w', encoding='utf-8') as f: f.write(content)
-
-def delete_persona_file(persona_name: str):
-    safe_persona_name = os.path.basename(persona_name)
-    filepath = os.path.join(PERSONA_FOLDER, f"{safe_persona_name}.txt")
-    if os.path.exists(filepath):
-        os.remove(filepath)
-        return True
-    return False
-
-def list_personas():
-    if not os.path.exists(PERSONA_FOLDER): return []
-    return [f.replace('.txt', '') for f in os.listdir(PERSONA_FOLDER) if f.endswith('.txt')]
+        audio_stream = get_eleven_client().text_to_speech.stream(voice_id=ELEVENLABS_VOICE_ID, text=text_plain, model_id=ELEVENLABS_MODEL_ID)
+        for chunk in audio_stream:
+            if not chunk: continue
+            if not audio: TTS_FIRST_BYTE_SECONDS.observe(time.perf_counter() - started)
+            if not pipe.write(chunk):
+                # Bị ngắt bởi câu trả lời mới hoặc bot rời kênh: đóng stream HTTP sớm
+                if hasattr(audio_stream, 'close'): audio_stream.close()
+                return None
+            audio += chunk
+        return bytes(audio)
+    except Exception as e:
+        print(f"Lỗi khi stream TTS: {e}")
+        return None
+    finally:
+        pipe.finish()
+
+async def aiter_once(text: str):
+    yield text
 
 # --- MODAL ĐỂ THÊM/SỬA PERSONA (GIỮ NGUYÊN) ---
 class PersonaModal(ui.Modal, title='Persona Editor'):
-    def __init__(self, persona_name: str, current_content: str = ""):
+    def __init__(self, registry: PersonaRegistry, persona_name: str, current_content: str = ""):
         super().__init__()
+        self.registry = registry
         self.persona_name = persona_name
         self.content = ui.TextInput(
             label=f"Nội dung cho '{persona_name}'", style=discord.TextStyle.paragraph,
@@ -137,83 +119,261 @@ class PersonaModal(ui.Modal, title='Persona Editor'):
         self.add_item(self.content)
 
     async def on_submit(self, interaction: discord.Interaction):
-        await self.bot.loop.run_in_executor(None, save_persona, self.persona_name, self.content.value)
+        await self.registry.save(self.persona_name, self.content.value)
         await interaction.response.send_message(f"✅ Đã lưu thành công persona **{self.persona_name}**.", ephemeral=True)
 
 # --- LỚP COG CHO CHATBOT ---
 class ChatCog(commands.Cog):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
-        setup_database()
+        # Khi bật tóm tắt, DB giữ thêm một khoảng đệm để các lượt cũ kịp được tóm tắt trước khi bị xóa
+        stored_limit = MEMORY_LIMIT + SUMMARY_MAX_BACKLOG if SUMMARY_ENABLED else MEMORY_LIMIT
+        self.storage = ChatStorage(DB_FILE, stored_limit, HISTORY_FLUSH_INTERVAL, HISTORY_FLUSH_BATCH)
+        self.history_cache = HistoryCache(HISTORY_WINDOW, HISTORY_CACHE_MAX_ENTRIES, HISTORY_CACHE_MAX_BYTES)
+        self.personas = PersonaRegistry(PERSONA_FOLDER, self.storage, DEFAULT_PERSONA)
+        self.scheduler = LLMScheduler(LLM_MAX_CONCURRENCY, LLM_MAX_QUEUE, LLM_MAX_QUEUE_PER_USER)
+        self._turns_since_compaction = {}  # (user_id, persona) -> số lượt mới kể từ lần kiểm tra tóm tắt trước
+        self._compacting = set()
+        self._background_tasks = set()
+        self._tts_pipes = {}  # guild_id -> AudioChunkPipe đang phát
+        self.tts_cache = TTSCache(TTS_CACHE_FOLDER, TTS_CACHE_MAX_BYTES)
         if not os.path.exists(PERSONA_FOLDER): os.makedirs(PERSONA_FOLDER)
 
-    async def ask_ai(self, user_id: int, channel_id: int):
-        active_persona_name = await self.bot.loop.run_in_executor(None, get_channel_persona, channel_id)
-        personality_prompt = await self.bot.loop.run_in_executor(None, load_persona, active_persona_name)
-        
-        if not personality_prompt:
-            personality_prompt = await self.bot.loop.run_in_executor(None, load_persona, DEFAULT_PERSONA) or "You are a helpful assistant."
-
-        history = await self.bot.loop.run_in_executor(None, get_history, user_id, active_persona_name)
-
-        api_url = "https://openrouter.ai/api/v1/chat/completions"
+    async def cog_load(self):
+        await self.storage.open()
+        await self.personas.load()
+        self.refresh_personas.start()
+        if TIKTOKEN_ENABLED:
+            # Nạp nền để không chặn lúc khởi động; trong lúc chờ, số token được ước lượng theo ký tự
+            task = self.bot.loop.create_task(run_in('files', load_encoding))
+            self._background_tasks.add(task)
+            task.add_done_callback(self._background_tasks.discard)
+
+    async def cog_unload(self):
+        self.refresh_personas.cancel()
+        for task in self._background_tasks: task.cancel()
+        for guild_id in list(self._tts_pipes): self.stop_speaking(guild_id)
+        await self.storage.close()
+
+    @tasks.loop(seconds=PERSONA_REFRESH_SECONDS)
+    async def refresh_personas(self):
+        try: await self.personas.refresh()
+        except Exception as e: print(f"Lỗi khi nạp lại persona: {e}")
+
+    async def persona_autocomplete(self, interaction: discord.Interaction, current: str):
+        return [app_commands.Choice(name=name, value=name) for name in self.personas.autocomplete(current)]
+
+    # --- LỊCH SỬ: CACHE TRONG BỘ NHỚ ĐỨNG TRƯỚC DATABASE ---
+    async def get_context(self, user_id: int, persona_name: str):
+        """Trả về (bản tóm tắt, các lượt gần nhất), ưu tiên đọc từ cache."""
+        key = (user_id, persona_name)
+        history = self.history_cache.get(key)
+        if history is not None: return self.history_cache.get_summary(key), history
+        self.history_cache.begin_load(key)
+        summary, history = "", None
+        try:
+            summary, history = await self.storage.get_context(user_id, persona_name, HISTORY_WINDOW)
+        finally:
+            self.history_cache.end_load(key, history, summary)
+        return summary, history
+
+    async def add_to_history(self, user_id: int, persona_name: str, role: str, content: str):
+        key = (user_id, persona_name)
+        self.history_cache.append(key, {"role": role, "content": content})
+        await self.storage.add_message(user_id, persona_name, role, content)
+        if SUMMARY_ENABLED:
+            self._turns_since_compaction[key] = self._turns_since_compaction.get(key, 0) + 1
+
+    async def delete_history(self, user_id: int, persona_name: str) -> int:
+        self.history_cache.invalidate((user_id, persona_name))
+        self._turns_since_compaction.pop((user_id, persona_name), None)
+        return await self.storage.delete_history(user_id, persona_name)
+
+    async def build_prompt(self, user_id: int, active_persona_name: str):
+        personality_prompt = self.personas.resolve_prompt(active_persona_name)
+        summary, history = await self.get_context(user_id, active_persona_name)
+        return build_messages(personality_prompt, summary, history, PROMPT_TOKEN_BUDGET)
+
+    # --- TÓM TẮT TĂNG DẦN CÁC LƯỢT CŨ ---
+    def schedule_compaction(self, user_id: int, persona_name: str):
+        """Chạy nền việc tóm tắt sau mỗi SUMMARY_BATCH lượt mới, không nằm trên đường trả lời người dùng."""
+        key = (user_id, persona_name)
+        if self._turns_since_compaction.get(key, 0) < SUMMARY_BATCH or key in self._compacting: return
+        del self._turns_since_compaction[key]
+        task = self.bot.loop.create_task(self.compact_history(user_id, persona_name))
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+
+    async def compact_history(self, user_id: int, persona_name: str):
+        key = (user_id, persona_name)
+        self._compacting.add(key)
+        try:
+            summary, overflow = await self.storage.get_overflow(user_id, persona_name, MEMORY_LIMIT)
+            if len(overflow) < SUMMARY_BATCH: return
+            # Dùng chung giới hạn đồng thời với chat, nhưng không chiếm lượt của chính user đó
+            async with self.scheduler.slot(('summary', user_id), None):
+                new_summary = await self.summarize(summary, overflow)
+            if not new_summary: return
+            if await self.storage.save_summary(user_id, persona_name, new_summary, overflow[-1]['id']):
+                self.history_cache.set_summary(key, new_summary)
+        except SchedulerBusy:
+            pass # Bot đang bận, lần kiểm tra sau sẽ tóm tắt
+        except Exception as e:
+            print(f"Lỗi khi tóm tắt lịch sử của user {user_id} với {persona_name}: {e}")
+        finally:
+            self._compacting.discard(key)
+
+    async def summarize(self, previous_summary: str, turns: list):
+        messages = build_summary_request(previous_summary, turns, SUMMARY_MAX_WORDS)
+        payload = {"model": OPENROUTER_MODEL, "messages": messages, "max_tokens": SUMMARY_MAX_TOKENS}
+        async with await self.post_openrouter(payload) as response:
+            if response.status != 200:
+                print(f"Tóm tắt thất bại: {response.status} {await response.text()}")
+                return None
+            data = await response.json()
+            return data['choices'][0]['message']['content'].strip()
+
+    async def post_openrouter(self, payload: dict):
+        """Gửi request tới OpenRouter, tự thử lại khi gặp 429/5xx hoặc lỗi kết nối.
+
+        Trả về response đang mở (dùng với `async with`). Chỉ thử lại trước khi nhận được
+        response thành công, nên một stream đã bắt đầu không bao giờ bị gửi lại.
+        """
         headers = {"Authorization": f"Bearer {OPENROUTER_API_KEY}"}
-        messages = [{"role": "system", "content": personality_prompt}] + history
-        payload = {"model": "deepseek/deepseek-chat-v3.1", "messages": messages}
+        with OPENROUTER_SECONDS.labels('stream' if payload.get('stream') else 'json').time():
+            for attempt in range(OPENROUTER_MAX_ATTEMPTS):
+                is_last_attempt = attempt == OPENROUTER_MAX_ATTEMPTS - 1
+                try:
+                    # Dùng session chung của bot để tái sử dụng kết nối TCP/TLS tới OpenRouter
+                    response = await self.bot.http_session.post(OPENROUTER_API_URL, headers=headers, json=payload)
+                except aiohttp.ClientConnectionError:
+                    if is_last_attempt: raise
+                    await asyncio.sleep(retry_delay(attempt))
+                    continue
+                if response.status not in RETRY_STATUSES or is_last_attempt:
+                    return response
+                delay = retry_delay(attempt, response.headers.get('Retry-After'))
+                if delay is None: return response
+                print(f"OpenRouter trả về {response.status}, thử lại sau {delay:.1f}s.")
+                response.release()
+                await asyncio.sleep(delay)
+
+    async def ask_ai(self, user_id: int, active_persona_name: str):
+        messages = await self.build_prompt(user_id, active_persona_name)
+        payload = {"model": OPENROUTER_MODEL, "messages": messages}
 
-        async with aiohttp.ClientSession() as session:
+        try:
+            async with await self.post_openrouter(payload) as response:
+                if response.status == 200:
+                    data = await response.json()
+                    return data['choices'][0]['message']['content']
+                else: return f"API Error: {await response.text()}"
+        except Exception as e: return f"An error occurred: {e}"
+
+    async def ask_ai_stream(self, user_id: int, active_persona_name: str):
+        """Giống ask_ai nhưng trả về từng đoạn văn bản ngay khi OpenRouter gửi về (server-sent events)."""
+        messages = await self.build_prompt(user_id, active_persona_name)
+        payload = {"model": OPENROUTER_MODEL, "messages": messages, "stream": True}
+
+        try:
+            async with await self.post_openrouter(payload) as response:
+                if response.status != 200:
+                    yield f"API Error: {await response.text()}"
+                    return
+                async for raw_line in response.content:
+                    line = raw_line.decode('utf-8').strip()
+                    # Bỏ qua dòng trống và comment keep-alive (": OPENROUTER PROCESSING")
+                    if not line.startswith('data:'): continue
+                    data = line[len('data:'):].strip()
+                    if data == '[DONE]': return
+                    chunk = json.loads(data)
+                    if 'error' in chunk:
+                        yield f"API Error: {chunk['error'].get('message', chunk['error'])}"
+                        return
+                    delta = chunk['choices'][0].get('delta', {}).get('content')
+                    if delta: yield delta
+        except Exception as e: yield f"An error occurred: {e}"
+
+    # --- TTS: PHÁT NGAY KHI CHUNK ĐẦU TIÊN VỀ TỚI ---
+    def stop_speaking(self, guild_id: int):
+        """Hủy luồng TTS đang phát (nếu có) để câu trả lời mới có thể chen vào."""
+        pipe = self._tts_pipes.pop(guild_id, None)
+        if pipe: pipe.cancel()
+
+    async def play_stream(self, voice_client: discord.VoiceClient, text: str):
+        if not ELEVENLABS_API_KEY: return
+        text_plain = clean_tts_text(text)
+        if not text_plain: return
+        guild_id = voice_client.guild.id
+        self.stop_speaking(guild_id)
+        if voice_client.is_playing(): voice_client.stop()
+
+        # Cache hit: phát thẳng file Opus đã lưu, không tốn quota ElevenLabs.
+        # Tra cache chạy trên 'files' để không phải xếp hàng sau các luồng stream TTS dài trên 'tts'
+        cache_key = TTSCache.make_key(ELEVENLABS_VOICE_ID, ELEVENLABS_MODEL_ID, text_plain)
+        cached_path = await run_in('files', self.tts_cache.lookup, cache_key)
+        if cached_path:
             try:
-                async with session.post(api_url, headers=headers, json=payload, timeout=60) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        return data['choices'][0]['message']['content']
-                    else: return f"API Error: {await response.text()}"
-            except Exception as e: return f"An error occurred: {e}"
-
-    def play_stream(self, voice_client: discord.VoiceClient, text: str):
-        # (Giữ nguyên logic của hàm play_stream)
+                source = discord.FFmpegOpusAudio(cached_path, codec='copy')
+                return voice_client.play(source, after=log_player_error)
+            except Exception as e:
+                print(f"Lỗi khi phát TTS từ cache: {e}")
+
+        pipe = AudioChunkPipe(TTS_MAX_BUFFERED_CHUNKS)
+        self._tts_pipes[guild_id] = pipe
         try:
-            if not eleven_client: return
-            text_plain = re.sub(r'\*[^*]+\*', '', text)
-            text_plain = re.sub(r'([_~`])', '', text_plain)
-            text_plain = re.sub(r'[^\w\s\.,!?\-\'"():;]', '', text_plain, flags=re.UNICODE)
-            text_plain = ' '.join(text_plain.split()).strip()
-            if not text_plain: return
-            with tempfile.NamedTemporaryFile(suffix='.mp3', delete=False) as temp_file:
-                temp_path = temp_file.name
-                audio_stream = eleven_client.text_to_speech.stream(voice_id=ELEVENLABS_VOICE_ID, text=text_plain, model_id="eleven_flash_v2_5")
-                for chunk in audio_stream:
-                    if chunk: temp_file.write(chunk)
-            source = discord.FFmpegPCMAudio(temp_path)
+            # FFmpeg đọc mp3 trực tiếp từ ống qua stdin và tự mã hóa sang Opus,
+            # discord.py chỉ việc gửi frame (không cần mã hóa PCM -> Opus trong tiến trình bot)
+            source = discord.FFmpegOpusAudio(pipe, pipe=True)
             def after_play(error):
-                if error: print(f'Player error: {error}')
-                try: os.remove(temp_path)
-                except: pass
+                log_player_error(error)
+                pipe.cancel()
             voice_client.play(source, after=after_play)
-        except Exception as e: print(f"Lỗi khi stream TTS: {e}")
+        except Exception as e:
+            pipe.cancel()
+            return print(f"Lỗi khi stream TTS: {e}")
+
+        audio = await run_in('tts', pump_tts, pipe, text_plain)
+        if self._tts_pipes.get(guild_id) is pipe: del self._tts_pipes[guild_id]
+        if audio:
+            # Mã hóa lại bằng FFmpeg có thể mất vài giây: chạy trên pool riêng để không chặn các tác vụ ngắn của 'files'
+            try: await run_in('tts_cache', self.tts_cache.store, cache_key, audio)
+            except Exception as e: print(f"Lỗi khi lưu cache TTS: {e}")
 
     @commands.hybrid_command(name="chat", description="Trò chuyện với trợ lý AI.")
     async def chat(self, ctx: commands.Context, message: str, voice: bool = False):
         await ctx.defer()
         user_id = ctx.author.id
         channel_id = ctx.channel.id
-        active_persona = await self.bot.loop.run_in_executor(None, get_channel_persona, channel_id)
+        active_persona = self.personas.channel_persona(channel_id)
+        guild_id = ctx.guild.id if ctx.guild else None
 
-        await self.bot.loop.run_in_executor(None, add_to_history, user_id, active_persona, "user", message)
-        ai_response = await self.ask_ai(user_id, channel_id)
-        await self.bot.loop.run_in_executor(None, add_to_history, user_id, active_persona, "assistant", ai_response)
-        
-        await ctx.send(ai_response)
+        try:
+            async with self.scheduler.slot(user_id, guild_id):
+                await self.add_to_history(user_id, active_persona, "user", message)
+                reply = StreamingReply(ctx.send, edit_interval=STREAM_EDIT_INTERVAL)
+                if CHAT_STREAMING:
+                    ai_response = await reply.consume(self.ask_ai_stream(user_id, active_persona))
+                else:
+                    ai_response = await self.ask_ai(user_id, active_persona)
+                    await reply.consume(aiter_once(ai_response))
+        except SchedulerBusy as e:
+            return await ctx.send(f"⏳ {e}")
+
+        if not ai_response.strip():
+            return await ctx.send("❌ AI không trả về nội dung nào.")
+        # Chỉ lưu vào lịch sử khi đã nhận đủ toàn bộ câu trả lời
+        await self.add_to_history(user_id, active_persona, "assistant", ai_response)
+        self.schedule_compaction(user_id, active_persona)
         
         if voice:
             # (Giữ nguyên logic voice)
-            if not eleven_client: return await ctx.channel.send("*Lỗi: Tính năng giọng nói chưa được cấu hình.*", delete_after=10)
+            if not ELEVENLABS_API_KEY: return await ctx.channel.send("*Lỗi: Tính năng giọng nói chưa được cấu hình.*", delete_after=10)
             if not ctx.author.voice: return await ctx.channel.send("*Lưu ý: Bạn không ở trong kênh thoại.*", delete_after=10)
             voice_client = ctx.guild.voice_client
             if not voice_client: voice_client = await ctx.author.voice.channel.connect()
             elif voice_client.channel != ctx.author.voice.channel: await voice_client.move_to(ctx.author.voice.channel)
-            if voice_client.is_playing(): voice_client.stop()
-            await self.bot.loop.run_in_executor(None, self.play_stream, voice_client, ai_response)
+            await self.play_stream(voice_client, ai_response)
 
     # --- CÁC LỆNH QUẢN LÝ PERSONA ---
     persona_group = app_commands.Group(name="persona", description="Quản lý các personality của AI")
@@ -221,8 +381,8 @@ class ChatCog(commands.Cog):
     @persona_group.command(name="view", description="Xem danh sách các personality có sẵn.")
     async def view_persona(self, interaction: discord.Interaction):
         # (Giữ nguyên logic)
-        all_personas = await self.bot.loop.run_in_executor(None, list_personas)
-        active_persona = await self.bot.loop.run_in_executor(None, get_channel_persona, interaction.channel.id)
+        all_personas = self.personas.names()
+        active_persona = self.personas.channel_persona(interaction.channel.id)
         if not all_personas: return await interaction.response.send_message("Không tìm thấy persona nào.", ephemeral=True)
         embed = discord.Embed(title="🎭 Danh sách Persona", color=discord.Color.gold())
         description = "".join([f"➡️ **{p}** (đang dùng)\n" if p == active_persona else f"• {p}\n" for p in all_personas])
@@ -232,31 +392,31 @@ class ChatCog(commands.Cog):
 
     @persona_group.command(name="switch", description="Chuyển đổi personality và xóa lịch sử cũ của bạn với persona đó.")
     @app_commands.describe(name="Tên của persona bạn muốn chuyển sang.")
+    @app_commands.autocomplete(name=persona_autocomplete)
     async def switch_persona(self, interaction: discord.Interaction, name: str):
-        all_personas = await self.bot.loop.run_in_executor(None, list_personas)
-        if name not in all_personas:
+        if not self.personas.exists(name):
             return await interaction.response.send_message(f"❌ Persona **{name}** không tồn tại.", ephemeral=True)
         
         # Lấy persona cũ và xóa lịch sử liên quan của user
         user_id = interaction.user.id
         channel_id = interaction.channel.id
-        old_persona = await self.bot.loop.run_in_executor(None, get_channel_persona, channel_id)
+        old_persona = self.personas.channel_persona(channel_id)
         
         # Chỉ xóa nếu persona cũ khác persona mới
         if old_persona != name:
-            await self.bot.loop.run_in_executor(None, delete_user_persona_history, user_id, old_persona)
+            await self.delete_history(user_id, old_persona)
 
         # Đặt persona mới cho kênh
-        await self.bot.loop.run_in_executor(None, set_channel_persona, channel_id, name)
+        await self.personas.set_channel_persona(channel_id, name)
         await interaction.response.send_message(f"✅ Đã chuyển sang persona **{name}**. Lịch sử trò chuyện của bạn với **{old_persona}** đã được xóa.", ephemeral=True)
 
     @persona_group.command(name="delete_memory", description="Xóa lịch sử trò chuyện của bạn với persona hiện tại.")
     async def delete_memory(self, interaction: discord.Interaction):
         user_id = interaction.user.id
         channel_id = interaction.channel.id
-        active_persona = await self.bot.loop.run_in_executor(None, get_channel_persona, channel_id)
+        active_persona = self.personas.channel_persona(channel_id)
 
-        deleted_count = await self.bot.loop.run_in_executor(None, delete_user_persona_history, user_id, active_persona)
+        deleted_count = await self.delete_history(user_id, active_persona)
         
         if deleted_count > 0:
             await interaction.response.send_message(f"🗑️ Đã xóa **{deleted_count}** tin nhắn trong cuộc trò chuyện của bạn với **{active_persona}**.", ephemeral=True)
@@ -266,22 +426,22 @@ class ChatCog(commands.Cog):
     @persona_group.command(name="add", description="Thêm một personality mới.")
     # (Giữ nguyên logic)
     async def add_persona(self, interaction: discord.Interaction, name: str):
-        modal = PersonaModal(persona_name=name); modal.bot = self.bot
+        modal = PersonaModal(self.personas, persona_name=name)
         await interaction.response.send_modal(modal)
 
     @persona_group.command(name="edit", description="Chỉnh sửa một personality đã có.")
-    # (Giữ nguyên logic)
+    @app_commands.autocomplete(name=persona_autocomplete)
     async def edit_persona(self, interaction: discord.Interaction, name: str):
-        content = await self.bot.loop.run_in_executor(None, load_persona, name)
+        content = self.personas.get_prompt(name)
         if content is None: return await interaction.response.send_message(f"❌ Persona **{name}** không tồn tại.", ephemeral=True)
-        modal = PersonaModal(persona_name=name, current_content=content); modal.bot = self.bot
+        modal = PersonaModal(self.personas, persona_name=name, current_content=content)
         await interaction.response.send_modal(modal)
 
     @persona_group.command(name="delete", description="Xóa một file personality.")
-    # (GiÃữ nguyên logic)
+    @app_commands.autocomplete(name=persona_autocomplete)
     async def delete_persona_file(self, interaction: discord.Interaction, name: str):
         if name == DEFAULT_PERSONA: return await interaction.response.send_message(f"❌ Không thể xóa persona mặc định (`{DEFAULT_PERSONA}`).", ephemeral=True)
-        was_deleted = await self.bot.loop.run_in_executor(None, delete_persona_file, name)
+        was_deleted = await self.personas.delete(name)
         if was_deleted: await interaction.response.send_message(f"🗑️ Đã xóa thành công file persona **{name}**.", ephemeral=True)
         else: await interaction.response.send_message(f"❌ File persona **{name}** không tồn tại.", ephemeral=True)
 
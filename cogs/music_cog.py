@@ -1,164 +1,536 @@
 # cogs/music_cog.py
 import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
 import os
-import yt_dlp
 import asyncio
-import spotipy
-from spotipy.oauth2 import SpotifyClientCredentials
-import random
-import json
 import re
-import threading
+import time
+from urllib.parse import urlparse, parse_qs
 from collections import deque
+from utils.executors import run_in
+from utils.song_store import SongStore, MISS
+from utils.ytdl_pool import YTDLPool, SharedCookieJar
+from utils.spotify_ingest import SpotifyIngest, track_query
+from utils.music_queue import Track, TrackQueue
+from utils.audio_cache import AudioCache
+from utils.metrics import SONG_CACHE_LOOKUPS, YTDL_SECONDS, MUSIC_QUEUED_TRACKS, MUSIC_LONGEST_QUEUE
 
 # --- CÀI ĐẶT BIẾN TOÀN CỤC CHO MUSIC ---
 SPOTIPY_CLIENT_ID = os.getenv('SPOTIPY_CLIENT_ID')
 SPOTIPY_CLIENT_SECRET = os.getenv('SPOTIPY_CLIENT_SECRET')
 
-spotify = spotipy.Spotify(auth_manager=SpotifyClientCredentials(client_id=SPOTIPY_CLIENT_ID, client_secret=SPOTIPY_CLIENT_SECRET))
 FFMPEG_OPTIONS = {'before_options': '-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5', 'options': '-vn -loglevel quiet'}
-CACHE_FILE = 'cache.json'
+LEGACY_CACHE_FILE = 'cache.json' # Cache cũ dạng JSON, được chuyển sang SQLite ở lần chạy đầu
+SONG_CACHE_DB = 'song_cache.db'
+SONG_CACHE_MAX_ENTRIES = 200_000
+SONG_CACHE_TTL = 30 * 24 * 3600 # Kết quả tìm kiếm được tin dùng trong 30 ngày
+SONG_CACHE_NEGATIVE_TTL = 24 * 3600 # Truy vấn không có kết quả được nhớ trong 1 ngày
+PREFETCH_LEAD_SECONDS = 20 # Lấy trước link stream của bài tiếp theo bao nhiêu giây trước khi bài hiện tại kết thúc
+STREAM_URL_SAFETY_MARGIN = 120 # Link stream phải còn hạn ít nhất (thời lượng bài + bấy nhiêu giây) mới được dùng lại
+STREAM_URL_DEFAULT_TTL = 1800 # Hạn dùng giả định khi link không có tham số 'expire'
+SPOTIFY_COLLECTION_TTL = 7 * 24 * 3600 # Danh sách bài của album được dùng lại trong 7 ngày (playlist so theo snapshot_id)
+PLAYLIST_MAX_IN_FLIGHT = int(os.getenv('PLAYLIST_MAX_IN_FLIGHT', 3)) # Số bài của playlist được tìm đồng thời cho mỗi guild
+PLAYLIST_PROGRESS_INTERVAL = 5 # Cập nhật tin nhắn tiến độ tối đa mỗi bấy nhiêu giây
+QUEUE_PAGE_SIZE = 10 # Số bài mỗi trang của /queue
+IDLE_DISCONNECT_SECONDS = 120 # Tự rời kênh thoại sau bấy nhiêu giây không có gì để phát
+AUDIO_CACHE_ENABLED = os.getenv('AUDIO_CACHE', '0') != '0' # Lưu bài được phát nhiều xuống đĩa
+AUDIO_CACHE_FOLDER = 'audio_cache'
+AUDIO_CACHE_MAX_BYTES = int(os.getenv('AUDIO_CACHE_MAX_BYTES', 5 * 1024 * 1024 * 1024)) # Dung lượng tối đa của cache audio
+AUDIO_CACHE_PLAY_THRESHOLD = int(os.getenv('AUDIO_CACHE_PLAY_THRESHOLD', 3)) # Tải về khi bài được phát tới lần thứ bấy nhiêu
+AUDIO_CACHE_MAX_DURATION = 15 * 60 # Không cache bài dài hơn 15 phút (mix, livestream...)
+MUSIC_SNAPSHOT_INTERVAL = int(os.getenv('MUSIC_SNAPSHOT_INTERVAL', 30)) # Chu kỳ lưu ảnh chụp hàng đợi (giây)
+MUSIC_SNAPSHOT_MAX_AGE = 24 * 3600 # Ảnh chụp cũ hơn thời gian này không được khôi phục
+YTDL_COOKIE_FILE = 'cookies.txt'
+YTDL_MAX_USES = int(os.getenv('YTDL_MAX_USES', 200)) # Tạo lại instance YoutubeDL sau bấy nhiêu lần dùng
+YTDL_MAX_AGE = int(os.getenv('YTDL_MAX_AGE', 1800)) # ... hoặc sau bấy nhiêu giây
+YDL_SEARCH_OPTS = {'format': 'bestaudio/best', 'quiet': True, 'extract_flat': 'generic', 'noplaylist': True, 'source_address': '0.0.0.0'}
+# Ưu tiên định dạng Opus (webm) để phát thẳng không cần mã hóa lại
+YDL_STREAM_OPTS = {'format': 'bestaudio[acodec=opus]/bestaudio/best', 'quiet': True, 'source_address': '0.0.0.0'}
+
+def create_spotify_client():
+    """Tạo client Spotify ở lần đầu có link Spotify thay vì lúc import cog (spotipy import khá chậm)."""
+    import spotipy
+    from spotipy.oauth2 import SpotifyClientCredentials
+    return spotipy.Spotify(auth_manager=SpotifyClientCredentials(client_id=SPOTIPY_CLIENT_ID, client_secret=SPOTIPY_CLIENT_SECRET))
 
 # --- LOGIC CACHE ---
-def load_cache():
-    try:
-        with open(CACHE_FILE, 'r', encoding='utf-8') as f: return json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError): return {}
-
-def save_cache(cache_data):
-    with open(CACHE_FILE, 'w', encoding='utf-8') as f: json.dump(cache_data, f, indent=4, ensure_ascii=False)
+song_cache = SongStore(SONG_CACHE_DB, SONG_CACHE_MAX_ENTRIES, SONG_CACHE_TTL, SONG_CACHE_NEGATIVE_TTL, legacy_json=LEGACY_CACHE_FILE)
+spotify_ingest = SpotifyIngest(create_spotify_client, song_cache, SPOTIFY_COLLECTION_TTL)
+audio_cache = AudioCache(AUDIO_CACHE_FOLDER, song_cache, AUDIO_CACHE_MAX_BYTES, AUDIO_CACHE_PLAY_THRESHOLD,
+                         AUDIO_CACHE_MAX_DURATION) if AUDIO_CACHE_ENABLED else None
 
-song_cache = load_cache()
-cache_lock = threading.Lock()
+# --- POOL YOUTUBEDL (mỗi thread của executor 'media' giữ một instance cho mỗi bộ tùy chọn) ---
+ytdl_cookies = SharedCookieJar(YTDL_COOKIE_FILE)
+search_pool = YTDLPool(YDL_SEARCH_OPTS, ytdl_cookies, YTDL_MAX_USES, YTDL_MAX_AGE)
+stream_pool = YTDLPool(YDL_STREAM_OPTS, ytdl_cookies, YTDL_MAX_USES, YTDL_MAX_AGE)
 
 # --- CÁC HÀM YOUTUBE ---
 def search_youtube(query):
-    with cache_lock:
-        if query in song_cache:
-            print(f"Cache HIT for query: {query}")
-            return song_cache[query]
+    cached = song_cache.get(query)
+    if cached is not MISS:
+        SONG_CACHE_LOOKUPS.labels('hit').inc()
+        print(f"Cache HIT for query: {query}")
+        return cached
 
+    SONG_CACHE_LOOKUPS.labels('miss').inc()
     print(f"Cache MISS. Searching YouTube for: {query}")
-    YDL_SEARCH_OPTS = {'format': 'bestaudio/best', 'quiet': True, 'extract_flat': 'generic', 'noplaylist': True, 'source_address': '0.0.0.0', 'cookiefile': 'cookies.txt'}
     try:
-        with yt_dlp.YoutubeDL(YDL_SEARCH_OPTS) as ydl:
-            info = ydl.extract_info(f"ytsearch:{query}", download=False)['entries'][0]
-            
-            # --- THAY ĐỔI LOGIC (GIỐNG SUISEI-BOT) ---
-            # Ưu tiên 'webpage_url' (link vĩnh viễn) và không lưu 'stream_url'
-            result = {'url': info.get('webpage_url', info.get('url')), 'title': info.get('title', 'Untitled')}
-            
-            with cache_lock:
-                song_cache[query] = result
-                save_cache(song_cache)
-            return result
+        with YTDL_SECONDS.labels('search').time():
+            entries = search_pool.extract_info(f"ytsearch:{query}", download=False).get('entries') or []
+        if not entries:
+            # Negative cache: không tìm lại truy vấn chắc chắn không có kết quả
+            song_cache.put(query, None)
+            return None
+        info = entries[0]
+        
+        # --- THAY ĐỔI LOGIC (GIỐNG SUISEI-BOT) ---
+        # Ưu tiên 'webpage_url' (link vĩnh viễn) và không lưu 'stream_url'
+        result = {'url': info.get('webpage_url', info.get('url')), 'title': info.get('title', 'Untitled')}
+        
+        song_cache.put(query, result)
+        return result
     except Exception as e:
         print(f"YouTube search failed for '{query}': {e}")
     return None
 
+def resolve_spotify_track(track):
+    """Tìm bài YouTube cho một track Spotify, ưu tiên link đã tìm được trước đó theo Spotify ID."""
+    if track['youtube_url']:
+        return {'url': track['youtube_url'], 'title': track['youtube_title'] or track['name']}
+    result = search_youtube(track_query(track))
+    if result: song_cache.set_youtube_mapping(track['id'], result)
+    return result
+
+def spotify_duration(track):
+    return track['duration_ms'] / 1000 if track.get('duration_ms') else None
+
+def parse_stream_expiry(stream_url: str):
+    """Đọc thời điểm hết hạn (epoch) từ tham số 'expire' của link googlevideo, hoặc None nếu không có."""
+    parsed = urlparse(stream_url)
+    expire = parse_qs(parsed.query).get('expire')
+    if expire is None:
+        # Một số link dạng manifest đặt tham số trong path: .../expire/1700000000/...
+        parts = parsed.path.split('/')
+        if 'expire' in parts and parts.index('expire') + 1 < len(parts):
+            expire = [parts[parts.index('expire') + 1]]
+    try:
+        return float(expire[0]) if expire else None
+    except ValueError:
+        return None
+
 def get_stream_data(youtube_url):
-    YDL_STREAM_OPTS = {'format': 'bestaudio/best', 'quiet': True, 'source_address': '0.0.0.0', 'cookiefile': 'cookies.txt'}
     try:
-        with yt_dlp.YoutubeDL(YDL_STREAM_OPTS) as ydl:
-            info = ydl.extract_info(youtube_url, download=False)
-            # Trả về link stream tạm thời ('source')
-            return {'source': info['url'], 'title': info.get('title', 'Untitled')}
+        with YTDL_SECONDS.labels('stream').time():
+            info = stream_pool.extract_info(youtube_url, download=False)
+        # Trả về link stream tạm thời ('source') kèm hạn dùng để có thể lấy trước an toàn
+        expires_at = parse_stream_expiry(info['url']) or time.time() + STREAM_URL_DEFAULT_TTL
+        return {'source': info['url'], 'title': info.get('title', 'Untitled'), 'webpage_url': youtube_url,
+                'duration': info.get('duration'), 'expires_at': expires_at, 'acodec': info.get('acodec')}
     except Exception as e:
         print(f"Failed to get stream for '{youtube_url}': {e}")
     return None
 
+def create_audio_source(stream_data, start_at: float = 0):
+    """Nguồn phát Opus cho discord.py, bắt đầu từ giây thứ `start_at`.
+
+    Nếu stream gốc đã là Opus thì FFmpeg chỉ tách luồng (codec='copy'), không giải mã và không mã hóa lại.
+    Các định dạng khác được FFmpeg mã hóa thẳng sang Opus, thay vì xuất PCM để discord.py mã hóa từng frame.
+    """
+    seek = f"-ss {start_at:.1f}" if start_at else None
+    if stream_data.get('local'):
+        # File trong cache audio luôn là Ogg Opus
+        return discord.FFmpegOpusAudio(stream_data['source'], codec='copy', before_options=seek)
+    codec = 'copy' if stream_data.get('acodec') == 'opus' else None
+    before_options = f"{seek} {FFMPEG_OPTIONS['before_options']}" if seek else FFMPEG_OPTIONS['before_options']
+    return discord.FFmpegOpusAudio(stream_data['source'], codec=codec, before_options=before_options,
+                                   options=FFMPEG_OPTIONS['options'])
+
+def snapshot_rows(tracks):
+    """Các dòng (url, title, duration, requester) của ảnh chụp; là generator nên được tạo ra trong executor lúc ghi."""
+    return ((track.url, track.title, track.duration, track.requester) for track in tracks)
+
+# --- TRÌNH PHÁT THEO GUILD ---
+# Các sự kiện gửi vào hàng đợi của GuildPlayer
+EVENT_ENQUEUE = 'enqueue' # Có bài mới trong hàng đợi
+EVENT_TRACK_END = 'track_end' # Nguồn phát kết thúc (hết bài, lỗi hoặc bị stop)
+EVENT_SKIP = 'skip'
+EVENT_STOP = 'stop' # Hàng đợi đã bị xóa, dừng bài đang phát
+EVENT_SHUTDOWN = 'shutdown' # Bot rời kênh thoại hoặc cog bị gỡ
+
+class GuildPlayer:
+    """Một task sống lâu cho mỗi guild, xử lý lần lượt các sự kiện phát nhạc.
+
+    Mọi thay đổi trạng thái phát (bắt đầu bài, hết bài, skip, stop, hết thời gian rảnh) đều đi qua
+    một hàng đợi sự kiện duy nhất nên không bao giờ có hai lượt "phát bài tiếp" chạy song song.
+    Mỗi nguồn phát mang một số `generation`: sự kiện kết thúc của nguồn cũ (ví dụ sau /stop) bị bỏ qua.
+    """
+    def __init__(self, cog, guild: discord.Guild, channel):
+        self.cog = cog
+        self.guild = guild
+        self.channel = channel # Kênh văn bản để thông báo, cập nhật theo lệnh /play gần nhất
+        self.events = asyncio.Queue()
+        self.current = None # Track đang phát, None khi rảnh
+        self.generation = 0
+        self.resume_at = 0 # Vị trí (giây) để phát tiếp bài đầu hàng đợi sau khi khôi phục
+        self.task = cog.bot.loop.create_task(self.run())
+
+    def notify(self, event, *args):
+        self.events.put_nowait((event, args))
+
+    async def run(self):
+        try:
+            while True:
+                # Chỉ đếm giờ rảnh khi không phát gì
+                timeout = IDLE_DISCONNECT_SECONDS if self.current is None else None
+                try:
+                    event, args = await asyncio.wait_for(self.events.get(), timeout)
+                except asyncio.TimeoutError:
+                    voice_client = self.guild.voice_client
+                    if voice_client and voice_client.is_connected() and not voice_client.is_playing():
+                        await voice_client.disconnect()
+                    return
+                if event == EVENT_SHUTDOWN: return
+                try:
+                    await self.handle(event, *args)
+                except Exception as e:
+                    print(f"Lỗi trình phát nhạc (guild {self.guild.id}): {e}")
+        finally:
+            if self.cog.players.get(self.guild.id) is self: del self.cog.players[self.guild.id]
+
+    async def handle(self, event, *args):
+        if event == EVENT_ENQUEUE:
+            if self.current is None: await self.play_next()
+        elif event == EVENT_TRACK_END:
+            generation, error = args
+            if generation != self.generation: return
+            if error: print(f'Player error: {error}')
+            self.advance()
+            await self.play_next()
+        elif event == EVENT_SKIP:
+            # stop() sẽ gọi after_playing -> EVENT_TRACK_END, bài tiếp theo được phát từ đó
+            if self.guild.voice_client and self.current is not None: self.guild.voice_client.stop()
+        elif event == EVENT_STOP:
+            self.generation += 1
+            self.current = None
+            self.cog.now_playing.pop(self.guild.id, None)
+            self.cog.cancel_prefetch(self.guild.id)
+            if self.guild.voice_client: self.guild.voice_client.stop()
+
+    def is_next(self, song):
+        """`song` vẫn đứng đầu hàng đợi, tức là không bị /stop hay /leave xóa trong lúc chờ."""
+        queue = self.cog.music_queues.get(self.guild.id)
+        return bool(queue) and queue[0] is song
+
+    def advance(self):
+        """Bỏ bài vừa phát khỏi đầu hàng đợi theo chế độ lặp."""
+        queue = self.cog.music_queues.get(self.guild.id)
+        if not queue: return
+        loop_state = self.cog.loop_states.get(self.guild.id)
+        if loop_state == 'queue':
+            queue.append(queue.popleft())
+        elif loop_state != 'song':
+            queue.popleft() # Chỉ xóa khỏi hàng đợi nếu không lặp bài hát
+
+    async def play_next(self):
+        guild_id = self.guild.id
+        # Xóa trạng thái bài cũ trước mọi await: nếu phần dưới lỗi (mất kết nối voice, thiếu FFmpeg...)
+        # trình phát vẫn được coi là rảnh, /play sau đó sẽ thử phát lại và bộ đếm giờ rảnh vẫn chạy
+        self.current = None
+        self.cog.now_playing.pop(guild_id, None)
+        while True:
+            voice_client = self.guild.voice_client
+            queue = self.cog.music_queues.get(guild_id)
+            if not voice_client or not queue:
+                self.cog.cancel_prefetch(guild_id)
+                return
+
+            current_song = queue[0]
+            should_cache = False
+            if audio_cache:
+                local_path, duration, should_cache = await run_in('files', audio_cache.on_play, current_song.url)
+                if not self.is_next(current_song): continue
+                if local_path:
+                    # Bài đã có trong cache audio: phát thẳng từ đĩa, không cần lấy link stream
+                    stream_data = {'source': local_path, 'duration': duration or current_song.duration, 'local': True}
+                    break
+
+            # Dùng link đã lấy trước nếu còn đúng bài và còn hạn, ngược lại lấy link mới ngay trước khi phát.
+            # current_song.url lúc này là link vĩnh viễn (webpage_url)
+            stream_data = self.cog.take_prefetched(guild_id, current_song)
+            if not stream_data:
+                stream_data = await run_in('media', get_stream_data, current_song.url)
+                # /stop (hoặc đổi hàng đợi) trong lúc yt-dlp đang lấy link: không phát bài đã bị bỏ
+                if not self.is_next(current_song): continue
+
+            if not stream_data:
+                await self.channel.send(f"❌ Lỗi khi lấy stream cho **{current_song.title}**. Bỏ qua.")
+                queue.popleft()
+                continue
+            break
+
+        # Sử dụng stream_data['source'] (link stream tạm thời hoặc file trong cache audio) trực tiếp
+        start_at, self.resume_at = self.resume_at, 0
+        source = create_audio_source(stream_data, start_at)
+        if voice_client.is_playing(): voice_client.stop()
+        self.generation += 1
+        generation = self.generation
+        loop = self.cog.bot.loop
+
+        def after_playing(error):
+            # Chạy trên thread của discord.py: chuyển sự kiện về event loop
+            loop.call_soon_threadsafe(self.notify, EVENT_TRACK_END, generation, error)
+
+        voice_client.play(source, after=after_playing)
+        self.current = current_song
+        self.cog.now_playing[guild_id] = {'started_at': time.monotonic() - start_at, 'duration': stream_data['duration']}
+        self.cog.schedule_prefetch(guild_id)
+        if should_cache: self.cog.bot.loop.create_task(self.cache_track(current_song.url, stream_data))
+        await self.channel.send(f"▶️ Đang phát: **{current_song.title}**")
+
+    async def cache_track(self, webpage_url, stream_data):
+        try:
+            await run_in('downloads', audio_cache.download, webpage_url, stream_data)
+        except Exception as e:
+            print(f"Lỗi khi lưu cache audio cho '{webpage_url}': {e}")
+
 # --- LỚP COG CHO MUSIC ---
 class MusicCog(commands.Cog):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
         self.music_queues = {}
         self.loop_states = {}
-
-    # --- ĐÃ XÓA HÀM prefetch_next_song ---
-    # Logic tải trước đã bị loại bỏ để tránh lưu link stream hết hạn.
-
-    # --- HÀM play_next_song VIẾT LẠI (GIỐNG SUISEI-BOT) ---
-    async def play_next_song(self, interaction: discord.Interaction):
-        guild_id = interaction.guild.id
-        voice_client = interaction.guild.voice_client
-        
-        if not voice_client: return
-
-        # Dừng nếu bot đang chạy (tránh lỗi)
-        if voice_client.is_playing():
-            voice_client.stop()
-
+        self.now_playing = {} # guild_id -> {'started_at': monotonic, 'duration': giây}
+        self.prefetched = {} # guild_id -> stream_data đã lấy trước cho bài tiếp theo
+        self.prefetch_tasks = {} # guild_id -> Task đang chờ/đang lấy trước
+        self.ingest_tasks = {} # guild_id -> [Task] các playlist đang thêm/chờ thêm vào hàng đợi, theo thứ tự /play
+        self.players = {} # guild_id -> GuildPlayer
+        self.snapshot_versions = {} # guild_id -> (id hàng đợi, version, rewrites, appended, popped lúc ghi toàn bộ) đã lưu lần gần nhất
+        self.pending_restores = {} # guild_id -> phiên đã lưu, khôi phục khi guild dùng lệnh nhạc lần tới
+
+    async def cog_load(self):
+        self.pending_restores = await run_in('files', song_cache.load_queue_sessions, MUSIC_SNAPSHOT_MAX_AGE)
+        if self.pending_restores: print(f"Có {len(self.pending_restores)} hàng đợi nhạc chờ khôi phục.")
+        self.snapshot_queues.start()
+        MUSIC_QUEUED_TRACKS.set_function(self.queued_tracks)
+        MUSIC_LONGEST_QUEUE.set_function(self.longest_queue)
+
+    def queued_tracks(self):
+        return sum(len(queue) for queue in self.music_queues.values())
+
+    def longest_queue(self):
+        return max((len(queue) for queue in self.music_queues.values()), default=0)
+
+    # --- ẢNH CHỤP HÀNG ĐỢI (KHỞI ĐỘNG LẠI KHÔNG MẤT HÀNG ĐỢI) ---
+    @tasks.loop(seconds=MUSIC_SNAPSHOT_INTERVAL)
+    async def snapshot_queues(self):
+        """Lưu trạng thái phát của các guild; danh sách bài chỉ được ghi lại khi hàng đợi đã đổi."""
+        for guild_id, queue in list(self.music_queues.items()):
+            try:
+                if not queue:
+                    if self.snapshot_versions.pop(guild_id, None) is not None:
+                        await run_in('files', song_cache.delete_queue_snapshot, guild_id)
+                    continue
+                guild = self.bot.get_guild(guild_id)
+                voice_client = guild.voice_client if guild else None
+                player = self.players.get(guild_id)
+                playing = self.now_playing.get(guild_id)
+                session = {
+                    'voice_channel_id': voice_client.channel.id if voice_client else None,
+                    'text_channel_id': player.channel.id if player and player.channel else None,
+                    'loop_state': self.loop_states.get(guild_id),
+                    'position': time.monotonic() - playing['started_at'] if playing else 0,
+                }
+                saved = self.snapshot_versions.get(guild_id)
+                if saved and saved[:2] == (id(queue), queue.version):
+                    await run_in('files', song_cache.save_queue_snapshot, guild_id, session)
+                    continue
+                if saved and saved[0] == id(queue) and saved[2] == queue.rewrites:
+                    # Chỉ có bài rời khỏi đầu (phát xong) và bài thêm vào cuối: xóa các dòng đầu, ghi thêm phần đuôi mới.
+                    # Bài ở vị trí i có seq = i + head, với head = số bài đã rời đầu kể từ lần ghi toàn bộ
+                    base = saved[4]
+                    head = queue.popped - base
+                    added = min(queue.appended - saved[3], len(queue))
+                    start = len(queue) - added
+                    args = (snapshot_rows(queue.page(start, added)), start + head, head)
+                else:
+                    # Thứ tự đã đổi (xáo trộn, chuyển, xóa...): ghi lại toàn bộ. Chỉ sao chép danh sách Track trên
+                    # event loop (treap bị sửa tại chỗ nên không duyệt được từ thread khác), phần còn lại chạy trong executor
+                    base = queue.popped
+                    args = (snapshot_rows(list(queue)),)
+                # Ghi nhận trạng thái trước khi await: thay đổi trong lúc đang ghi sẽ được lưu ở lần sau
+                version = (id(queue), queue.version, queue.rewrites, queue.appended, base)
+                await run_in('files', song_cache.save_queue_snapshot, guild_id, session, *args)
+                self.snapshot_versions[guild_id] = version
+            except Exception as e:
+                print(f"Lỗi khi lưu hàng đợi của guild {guild_id}: {e}")
+
+    async def cog_before_invoke(self, ctx: commands.Context):
+        session = self.pending_restores.pop(ctx.guild.id, None) if ctx.guild else None
+        if session is None: return
+        if ctx.command.name in ('stop', 'leave'):
+            # Người dùng muốn dừng: bỏ luôn hàng đợi cũ thay vì khôi phục
+            return await run_in('files', song_cache.delete_queue_snapshot, ctx.guild.id)
+        # Khôi phục (đọc DB + vào lại kênh thoại) có thể quá hạn 3 giây của interaction, nên defer trước.
+        # /play vốn defer ẩn nên giữ nguyên kiểu đó (và /play sẽ không defer lại).
+        if ctx.interaction and not ctx.interaction.response.is_done():
+            await ctx.defer(ephemeral=ctx.command.name == 'play')
+        await self.restore_guild(ctx.guild, session, ctx.channel)
+
+    async def restore_guild(self, guild: discord.Guild, session: dict, fallback_channel):
+        """Dựng lại hàng đợi từ ảnh chụp, vào lại kênh thoại cũ và phát tiếp từ vị trí đã lưu."""
+        if self.music_queues.get(guild.id): return
+        rows = await run_in('files', song_cache.load_queue_tracks, guild.id)
+        if not rows: return
+        self.music_queues[guild.id] = TrackQueue(Track(*row) for row in rows)
+        self.loop_states[guild.id] = session['loop_state']
+        text_channel = guild.get_channel(session['text_channel_id']) or fallback_channel
+        voice_channel = guild.get_channel(session['voice_channel_id']) if session['voice_channel_id'] else None
+        if voice_channel and not guild.voice_client:
+            try:
+                await voice_channel.connect()
+            except Exception as e:
+                print(f"Không thể vào lại kênh thoại khi khôi phục guild {guild.id}: {e}")
+        await text_channel.send(f"♻️ Đã khôi phục hàng đợi gồm **{len(rows)}** bài từ phiên trước.")
+        if guild.voice_client:
+            player = self.get_player(guild, text_channel)
+            player.resume_at = session['position']
+            player.notify(EVENT_ENQUEUE)
+
+    def get_player(self, guild: discord.Guild, channel=None):
+        """Trình phát của guild, tạo mới nếu chưa có (hoặc đã dừng vì rảnh)."""
+        player = self.players.get(guild.id)
+        if player is None:
+            player = self.players[guild.id] = GuildPlayer(self, guild, channel)
+        elif channel is not None:
+            player.channel = channel
+        return player
+
+    def shutdown_player(self, guild_id):
+        player = self.players.pop(guild_id, None)
+        if player: player.notify(EVENT_SHUTDOWN)
+
+    # --- LẤY TRƯỚC LINK STREAM (CÓ KIỂM TRA HẠN DÙNG) ---
+    def peek_next_song(self, guild_id):
+        """Bài sẽ được phát sau bài hiện tại, theo chế độ lặp."""
         queue = self.music_queues.get(guild_id)
-        if not queue:
-            # Logic rảnh rỗi và tự ngắt kết nối
-            await asyncio.sleep(120)
-            if voice_client.is_connected() and not voice_client.is_playing():
-                await voice_client.disconnect()
-            return
-        
-        current_song = queue[0]
-        
-        # --- THAY ĐỔI CHÍNH ---
-        # Không kiểm tra 'stream_url' nữa.
-        # LUÔN LUÔN lấy link stream mới ngay trước khi phát.
-        
-        # current_song['url'] lúc này là link vĩnh viễn (webpage_url)
-        stream_data = await self.bot.loop.run_in_executor(None, get_stream_data, current_song['url'])
-        
-        if not stream_data:
-            await interaction.channel.send(f"❌ Lỗi khi lấy stream cho **{current_song['title']}**. Bỏ qua.")
-            self.music_queues[guild_id].popleft()
-            # Đệ quy để thử phát bài tiếp theo
-            self.bot.loop.create_task(self.play_next_song(interaction))
-            return
-        
-        # Sử dụng stream_data['source'] (link stream tạm thời) trực tiếp
-        source = discord.FFmpegPCMAudio(stream_data['source'], **FFMPEG_OPTIONS)
-
-        def after_playing(error):
-            if error: print(f'Player error: {error}')
-            
-            q = self.music_queues.get(guild_id)
-            if not q: return
-
-            loop_state = self.loop_states.get(guild_id)
-            
-            # Logic lặp bài
-            if loop_state == 'queue':
-                played_song = q.popleft()
-                q.append(played_song)
-            elif loop_state != 'song':
-                q.popleft() # Chỉ xóa khỏi hàng đợi nếu không lặp bài hát
-            
-            # Không cần reset 'stream_url' vì nó không còn tồn tại
-            
-            # Gọi tác vụ để phát bài tiếp theo
-            self.bot.loop.create_task(self.play_next_song(interaction))
-
-        voice_client.play(source, after=after_playing)
-        await interaction.channel.send(f"▶️ Đang phát: **{current_song['title']}**")
-        
-        # Đã xóa dòng gọi hàm prefetch_next_song
-
-    # CẢI TIẾN: XỬ LÝ PLAYLIST SONG SONG
-    async def process_playlist_concurrently(self, ctx: commands.Context, track_queries: list):
+        if not queue: return None
+        loop_state = self.loop_states.get(guild_id)
+        if loop_state == 'song': return queue[0]
+        if len(queue) > 1: return queue[1]
+        return queue[0] if loop_state == 'queue' else None
+
+    def schedule_prefetch(self, guild_id):
+        """Hẹn giờ lấy trước bài tiếp theo PREFETCH_LEAD_SECONDS giây trước khi bài hiện tại kết thúc."""
+        self.cancel_prefetch(guild_id)
+        playing = self.now_playing.get(guild_id)
+        if not playing or not playing['duration']: return
+        elapsed = time.monotonic() - playing['started_at']
+        delay = max(0, playing['duration'] - elapsed - PREFETCH_LEAD_SECONDS)
+        self.prefetch_tasks[guild_id] = self.bot.loop.create_task(self.prefetch_after(guild_id, delay))
+
+    def reschedule_prefetch_if_changed(self, guild_id):
+        """Sau khi đổi chế độ lặp/thứ tự: giữ link đã lấy trước nếu bài tiếp theo vẫn là bài đó, ngược lại hẹn lại."""
+        stream_data = self.prefetched.get(guild_id)
+        song = self.peek_next_song(guild_id)
+        if stream_data and song and stream_data['webpage_url'] == song.url: return
+        self.schedule_prefetch(guild_id)
+
+    async def prefetch_after(self, guild_id, delay):
+        await asyncio.sleep(delay)
+        # Chọn bài tại thời điểm lấy, nên các thay đổi hàng đợi trước đó đã được tính đến
+        song = self.peek_next_song(guild_id)
+        if not song: return
+        stream_data = await run_in('media', get_stream_data, song.url)
+        if stream_data: self.prefetched[guild_id] = stream_data
+
+    def cancel_prefetch(self, guild_id):
+        self.prefetched.pop(guild_id, None)
+        task = self.prefetch_tasks.pop(guild_id, None)
+        if task and task is not asyncio.current_task(): task.cancel()
+
+    def take_prefetched(self, guild_id, song):
+        """Trả về stream đã lấy trước nếu đúng bài và còn hạn cho cả thời lượng bài, ngược lại None."""
+        stream_data = self.prefetched.pop(guild_id, None)
+        if not stream_data or stream_data['webpage_url'] != song.url: return None
+        remaining = stream_data['expires_at'] - time.time()
+        if remaining < (stream_data['duration'] or 0) + STREAM_URL_SAFETY_MARGIN:
+            print(f"Link stream lấy trước cho '{song.title}' sắp hết hạn, lấy lại.")
+            return None
+        return stream_data
+
+    # CẢI TIẾN: XỬ LÝ PLAYLIST THEO DÒNG (GIỚI HẠN SỐ BÀI TÌM ĐỒNG THỜI, GIỮ THỨ TỰ)
+    def start_playlist_ingest(self, ctx: commands.Context, tracks: list):
+        """Chạy việc thêm playlist trong nền; mỗi guild xử lý lần lượt từng playlist theo thứ tự /play.
+
+        Playlist đến sau chờ playlist trước thêm xong; chỉ /stop, /leave hoặc mất kết nối mới hủy chúng.
+        """
+        pending = self.ingest_tasks.setdefault(ctx.guild.id, [])
+        previous = pending[-1] if pending else None
+        pending.append(self.bot.loop.create_task(self.process_playlist_concurrently(ctx, tracks, previous)))
+
+    def cancel_ingest(self, guild_id):
+        for task in self.ingest_tasks.pop(guild_id, []):
+            if task is not asyncio.current_task(): task.cancel()
+
+    async def process_playlist_concurrently(self, ctx: commands.Context, tracks: list, previous=None):
         guild_id = ctx.guild.id
-        
-        async def search_task(query):
-            return await self.bot.loop.run_in_executor(None, search_youtube, query)
-
-        tasks = [search_task(query) for query in track_queries]
-        results = await asyncio.gather(*tasks)
-        
-        added_songs = [song for song in results if song]
-        if added_songs:
-            self.music_queues[guild_id].extend(added_songs)
-            await ctx.send(f"✅ Đã xử lý xong playlist và thêm được **{len(added_songs)}** bài hát nữa vào hàng đợi.")
+        total = len(tracks)
+        remaining = iter(tracks)
+        # Cửa sổ trượt: tối đa PLAYLIST_MAX_IN_FLIGHT bài đang được tìm, kết quả được lấy theo đúng thứ tự
+        window = deque()
+        added = failed = 0
+
+        def fill_window():
+            while len(window) < PLAYLIST_MAX_IN_FLIGHT:
+                track = next(remaining, None)
+                if track is None: return
+                window.append((track, asyncio.ensure_future(run_in('media', resolve_spotify_track, track))))
+
+        progress_message = None
+        try:
+            # Giữ đúng thứ tự các lệnh /play: chờ playlist trước của guild (kể cả khi nó lỗi)
+            if previous: await asyncio.wait([previous])
+            progress_message = await ctx.channel.send(f"⏳ Đang thêm playlist: 0/{total} bài...")
+            last_progress = time.monotonic()
+            fill_window()
+            while window:
+                track, future = window.popleft()
+                result = await future
+                fill_window()
+                if not result:
+                    failed += 1
+                    continue
+                queue = self.music_queues.setdefault(guild_id, TrackQueue())
+                queue.append(Track.from_result(result, ctx.author.id, spotify_duration(track)))
+                added += 1
+                # Hàng đợi đã phát hết trong lúc chờ: trình phát sẽ phát tiếp ngay bài vừa thêm
+                if len(queue) == 1 and ctx.guild.voice_client:
+                    self.get_player(ctx.guild, ctx.channel).notify(EVENT_ENQUEUE)
+                elif len(queue) == 2:
+                    # Bài vừa thêm là bài kế tiếp: hẹn lấy trước link stream của nó
+                    self.schedule_prefetch(guild_id)
+                if time.monotonic() - last_progress >= PLAYLIST_PROGRESS_INTERVAL:
+                    last_progress = time.monotonic()
+                    await progress_message.edit(content=f"⏳ Đang thêm playlist: {added + failed}/{total} bài...")
+        except asyncio.CancelledError:
+            for _, future in window: future.cancel()
+            if progress_message: await progress_message.edit(content=f"⏹️ Đã hủy thêm playlist sau **{added}** bài.")
+            raise
+        finally:
+            pending = self.ingest_tasks.get(guild_id)
+            if pending and asyncio.current_task() in pending:
+                pending.remove(asyncio.current_task())
+                if not pending: del self.ingest_tasks[guild_id]
+
+        summary = f"✅ Đã xử lý xong playlist và thêm được **{added}** bài hát nữa vào hàng đợi."
+        if failed: summary += f" ({failed} bài không tìm thấy)"
+        await progress_message.edit(content=summary)
 
     @commands.hybrid_command(name="play", description="Phát nhạc hoặc playlist từ YouTube/Spotify.")
     async def play(self, ctx: commands.Context, *, query: str):
-        await ctx.defer(ephemeral=True)
+        # cog_before_invoke có thể đã defer (khi khôi phục hàng đợi); defer lần hai sẽ ném InteractionResponded
+        if not (ctx.interaction and ctx.interaction.response.is_done()):
+            await ctx.defer(ephemeral=True)
         guild_id = ctx.guild.id
 
         if not ctx.author.voice:
@@ -171,7 +543,7 @@ class MusicCog(commands.Cog):
             await voice_client.move_to(ctx.author.voice.channel)
 
         if guild_id not in self.music_queues:
-            self.music_queues[guild_id] = deque() # Sử dụng deque để tối ưu pop(0)
+            self.music_queues[guild_id] = TrackQueue()
         
         spotify_url_pattern = re.compile(r'https://open\.spotify\.com/(playlist|album|artist|track)/([a-zA-Z0-9]+)')
         match = spotify_url_pattern.match(query)
@@ -181,49 +553,33 @@ class MusicCog(commands.Cog):
             await ctx.channel.send(f"🔎 Nhận diện {spotify_type} từ Spotify. Bắt đầu xử lý...")
 
             try:
-                def fetch_spotify_data():
-                    if spotify_type == 'playlist': return spotify.playlist_tracks(spotify_id).get('items', [])
-                    if spotify_type == 'album': return spotify.album_tracks(spotify_id).get('items', [])
-                    if spotify_type == 'artist': return spotify.artist_top_tracks(spotify_id).get('tracks', [])
-                    if spotify_type == 'track': return [spotify.track(spotify_id)]
-                    return None
-                
-                results = await self.bot.loop.run_in_executor(None, fetch_spotify_data)
-                if not results: return await ctx.channel.send(f"❌ Không tìm thấy bài hát nào cho {spotify_type} này.")
-
-                track_queries = []
-                for item in results:
-                    track_data = item.get('track', item)
-                    if track_data and track_data.get('name') and track_data.get('artists'):
-                        track_queries.append(f"{track_data['name']} {track_data['artists'][0]['name']}")
-                
-                if not track_queries: return await ctx.channel.send("❌ Không thể trích xuất thông tin bài hát hợp lệ.")
-
-                first_track_query = track_queries.pop(0)
-                first_song_info = await self.bot.loop.run_in_executor(None, search_youtube, first_track_query)
+                # Lấy đủ mọi trang (playlist > 100 bài, album > 50 bài), ưu tiên dữ liệu đã cache
+                tracks = await spotify_ingest.fetch(spotify_type, spotify_id)
+                if not tracks: return await ctx.channel.send(f"❌ Không tìm thấy bài hát nào cho {spotify_type} này.")
+
+                first_track = tracks.pop(0)
+                first_song_info = await run_in('media', resolve_spotify_track, first_track)
 
                 if first_song_info:
-                    self.music_queues[guild_id].append(first_song_info)
+                    self.music_queues[guild_id].append(Track.from_result(first_song_info, ctx.author.id, spotify_duration(first_track)))
                     await ctx.channel.send(f"☑️ Đã thêm bài hát đầu tiên: **{first_song_info['title']}**. Phần còn lại sẽ được xử lý trong nền...")
                     
-                    if not voice_client.is_playing():
-                        self.bot.loop.create_task(self.play_next_song(ctx))
+                    self.get_player(ctx.guild, ctx.channel).notify(EVENT_ENQUEUE)
                     
-                    if track_queries:
-                        self.bot.loop.create_task(self.process_playlist_concurrently(ctx, track_queries))
+                    if tracks:
+                        self.start_playlist_ingest(ctx, tracks)
                 else:
-                    await ctx.channel.send(f"❌ Không tìm thấy bài hát đầu tiên '{first_track_query}'.")
+                    await ctx.channel.send(f"❌ Không tìm thấy bài hát đầu tiên '{track_query(first_track)}'.")
 
             except Exception as e:
                 await ctx.channel.send(f"❌ Lỗi khi xử lý link Spotify: `{e}`")
         
         else:
-            search_result = await self.bot.loop.run_in_executor(None, search_youtube, query)
+            search_result = await run_in('media', search_youtube, query)
             if search_result:
-                self.music_queues[guild_id].append(search_result)
+                self.music_queues[guild_id].append(Track.from_result(search_result, ctx.author.id))
                 await ctx.channel.send(f"👍 Đã thêm vào hàng đợi: **{search_result['title']}**")
-                if not voice_client.is_playing():
-                    self.bot.loop.create_task(self.play_next_song(ctx))
+                self.get_player(ctx.guild, ctx.channel).notify(EVENT_ENQUEUE)
             else:
                 await ctx.channel.send("❌ Không tìm thấy bài hát nào với truy vấn đó.")
 
@@ -234,7 +590,9 @@ class MusicCog(commands.Cog):
         embed.add_field(name="`/chat [message]`", value="Trò chuyện với trợ lý AI.", inline=False)
         embed.add_field(name="`/play [query]`", value="Phát nhạc hoặc thêm playlist từ YouTube/Spotify.", inline=False)
         embed.add_field(name="`/skip`", value="Bỏ qua bài hát hiện tại.", inline=False)
-        embed.add_field(name="`/queue`", value="Hiển thị hàng đợi bài hát.", inline=False)
+        embed.add_field(name="`/queue [page]`", value="Hiển thị hàng đợi bài hát.", inline=False)
+        embed.add_field(name="`/remove [position]`", value="Xóa một bài khỏi hàng đợi.", inline=False)
+        embed.add_field(name="`/move [from] [to]`", value="Chuyển một bài sang vị trí khác trong hàng đợi.", inline=False)
         embed.add_field(name="`/shuffle`", value="Xáo trộn hàng đợi.", inline=False)
         embed.add_field(name="`/loop`", value="Chuyển chế độ lặp (Tắt -> Hàng đợi -> Bài hát).", inline=False)
         embed.add_field(name="`/stop`", value="Dừng phát nhạc và xóa hàng đợi.", inline=False)
@@ -243,14 +601,15 @@ class MusicCog(commands.Cog):
 
     @commands.hybrid_command(name="skip", description="Bỏ qua bài hát hiện tại.")
     async def skip(self, ctx: commands.Context):
-        if ctx.guild.voice_client and ctx.guild.voice_client.is_playing():
-            ctx.guild.voice_client.stop()
+        player = self.players.get(ctx.guild.id)
+        if ctx.guild.voice_client and player and player.current is not None:
+            player.notify(EVENT_SKIP)
             await ctx.send("⏭️ Đã bỏ qua bài hát.")
         else:
             await ctx.send("Không có gì đang phát.", ephemeral=True)
 
     @commands.hybrid_command(name="queue", description="Hiển thị hàng đợi bài hát.")
-    async def queue(self, ctx: commands.Context):
+    async def queue(self, ctx: commands.Context, page: int = 1):
         queue = self.music_queues.get(ctx.guild.id)
         if not queue: return await ctx.send("Hàng đợi đang trống.")
         
@@ -261,21 +620,41 @@ class MusicCog(commands.Cog):
         elif loop_mode == 'song': status = "Bài hát 🔂"
         embed.set_author(name=f"Chế độ lặp: {status}")
 
-        queue_list = "\n".join([f"`{i+1}.` {song['title']}" for i, song in enumerate(list(queue)[:10])])
+        # Chỉ lấy đúng các bài của trang cần xem, không sao chép cả hàng đợi
+        total_pages = (len(queue) + QUEUE_PAGE_SIZE - 1) // QUEUE_PAGE_SIZE
+        page = max(1, min(page, total_pages))
+        start = (page - 1) * QUEUE_PAGE_SIZE
+        queue_list = "\n".join([f"`{start + i + 1}.` {song.title}" for i, song in enumerate(queue.page(start, QUEUE_PAGE_SIZE))])
         embed.description = queue_list
-        if len(queue) > 10:
-            embed.set_footer(text=f"và {len(queue) - 10} bài hát khác...")
+        embed.set_footer(text=f"Trang {page}/{total_pages} • {len(queue)} bài hát")
         await ctx.send(embed=embed)
 
+    @commands.hybrid_command(name="remove", description="Xóa một bài khỏi hàng đợi theo vị trí.")
+    async def remove(self, ctx: commands.Context, position: int):
+        queue = self.music_queues.get(ctx.guild.id)
+        # Vị trí 1 là bài đang phát: dùng /skip thay vì xóa
+        if not queue or not 2 <= position <= len(queue):
+            return await ctx.send("Vị trí không hợp lệ.", ephemeral=True)
+        removed = queue.pop(position - 1)
+        if position == 2: self.schedule_prefetch(ctx.guild.id)
+        await ctx.send(f"🗑️ Đã xóa **{removed.title}** khỏi hàng đợi.")
+
+    @commands.hybrid_command(name="move", description="Chuyển một bài trong hàng đợi sang vị trí khác.")
+    async def move(self, ctx: commands.Context, source: int, destination: int):
+        queue = self.music_queues.get(ctx.guild.id)
+        if not queue or not 2 <= source <= len(queue) or not 2 <= destination <= len(queue):
+            return await ctx.send("Vị trí không hợp lệ.", ephemeral=True)
+        queue.move(source - 1, destination - 1)
+        if 2 in (source, destination): self.schedule_prefetch(ctx.guild.id)
+        await ctx.send(f"↕️ Đã chuyển **{queue[destination - 1].title}** tới vị trí {destination}.")
+
     @commands.hybrid_command(name="shuffle", description="Xáo trộn hàng đợi.")
     async def shuffle(self, ctx: commands.Context):
         queue = self.music_queues.get(ctx.guild.id)
         if queue and len(queue) > 1:
-            now_playing = queue.popleft()
-            temp_list = list(queue)
-            random.shuffle(temp_list)
-            self.music_queues[ctx.guild.id] = deque(temp_list)
-            self.music_queues[ctx.guild.id].appendleft(now_playing)
+            queue.shuffle(keep_first=True) # Giữ bài đang phát ở đầu hàng đợi
+            # Bài tiếp theo có thể đã đổi: khi đó bỏ link đã lấy trước và hẹn lại
+            self.reschedule_prefetch_if_changed(ctx.guild.id)
             await ctx.send("🔀 Hàng đợi đã được xáo trộn!")
         else:
             await ctx.send("Không có đủ bài hát để xáo trộn.", ephemeral=True)
@@ -293,12 +672,16 @@ class MusicCog(commands.Cog):
         else:
             self.loop_states[guild_id] = None
             await ctx.send("🔁 Chế độ lặp đã **Tắt**.")
+        # Chế độ lặp quyết định bài tiếp theo: chỉ hẹn lại việc lấy trước khi bài đó thực sự đổi
+        self.reschedule_prefetch_if_changed(guild_id)
 
     @commands.hybrid_command(name="stop", description="Dừng phát nhạc và xóa hàng đợi.")
     async def stop(self, ctx: commands.Context):
         guild_id = ctx.guild.id
-        if ctx.guild.voice_client: ctx.guild.voice_client.stop()
+        self.cancel_ingest(guild_id)
         if guild_id in self.music_queues: self.music_queues[guild_id].clear()
+        self.cancel_prefetch(guild_id)
+        if guild_id in self.players: self.players[guild_id].notify(EVENT_STOP)
         self.loop_states[guild_id] = None
         await ctx.send("⏹️ Đã dừng phát nhạc và xóa hàng đợi.")
 
@@ -306,12 +689,33 @@ class MusicCog(commands.Cog):
     async def leave(self, ctx: commands.Context):
         guild_id = ctx.guild.id
         if ctx.guild.voice_client:
+            self.cancel_ingest(guild_id)
             if guild_id in self.music_queues: self.music_queues[guild_id].clear()
             self.loop_states[guild_id] = None
+            self.cancel_prefetch(guild_id)
+            self.shutdown_player(guild_id)
+            self.now_playing.pop(guild_id, None)
             await ctx.guild.voice_client.disconnect()
             await ctx.send("👋 Tạm biệt!")
         else:
             await ctx.send("Tôi không có trong kênh thoại nào.", ephemeral=True)
 
+    @commands.Cog.listener()
+    async def on_voice_state_update(self, member: discord.Member, before: discord.VoiceState, after: discord.VoiceState):
+        # Bot rời kênh (tự ngắt khi rảnh, bị kick...): dừng trình phát và việc thêm playlist đang chạy nền
+        if member.id == self.bot.user.id and before.channel and not after.channel:
+            self.cancel_ingest(member.guild.id)
+            self.cancel_prefetch(member.guild.id)
+            self.shutdown_player(member.guild.id)
+            self.now_playing.pop(member.guild.id, None)
+
+    async def cog_unload(self):
+        # Lưu lần cuối trước khi tắt để lần khởi động sau khôi phục được
+        self.snapshot_queues.cancel()
+        await self.snapshot_queues()
+        for guild_id in list(self.ingest_tasks): self.cancel_ingest(guild_id)
+        for guild_id in list(self.prefetch_tasks): self.cancel_prefetch(guild_id)
+        for player in list(self.players.values()): player.task.cancel()
+
 async def setup(bot: commands.Bot):
     await bot.add_cog(MusicCog(bot))
\ No newline at end of file
@@ -1,9 +1,18 @@
 # main.py
+import os
+import time
+# STARTUP_PROFILE=1: đo thời gian import/khởi tạo từng module. Phải bật trước khi import discord
+from utils.startup_profile import StartupProfiler
+profiler = StartupProfiler.install() if os.getenv('STARTUP_PROFILE', '0') != '0' else None
+
 import discord
 from discord.ext import commands
-import os
 from dotenv import load_dotenv
 import asyncio
+from utils.http_client import create_http_session
+from utils.executors import shutdown_executors
+from utils.metrics import MetricsReporter, VOICE_CLIENTS
+from utils.command_sync import command_tree_hash, load_synced_hash, save_synced_hash
 
 # --- CẢI TIẾN: TỰ ĐỘNG XÓA FILE CACHE KHI KHỞI ĐỘNG ---
 # Điều này đảm bảo bot luôn nhận được một token xác thực mới từ Spotify.
@@ -19,13 +28,52 @@ if os.path.exists(CACHE_FILE_PATH):
 # Tải các biến môi trường từ file .env
 load_dotenv()
 DISCORD_TOKEN = os.getenv('DISCORD_TOKEN')
+COMMAND_HASH_FILE = 'command_tree.json' # Hash của cây lệnh ở lần đồng bộ gần nhất
 
 # Cài đặt quyền (Intents) mà bot của bạn cần
 intents = discord.Intents.default()
 intents.message_content = True
 
+class AIOBot(commands.Bot):
+    """Bot kèm một aiohttp session dùng chung (connection pool) cho mọi request HTTP ra ngoài."""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.http_session = None
+        self.metrics = MetricsReporter()
+        VOICE_CLIENTS.set_function(self.count_voice_clients)
+
+    def count_voice_clients(self):
+        return len(self.voice_clients)
+
+    async def setup_hook(self):
+        # Chạy đúng một lần mỗi tiến trình, sau khi đăng nhập và trước khi nối gateway
+        # (on_ready thì chạy lại sau mỗi lần reconnect)
+        try:
+            await self.sync_commands()
+        except Exception as e:
+            print(f"Lỗi khi đồng bộ lệnh ứng dụng: {e}")
+
+    async def sync_commands(self, force: bool = False):
+        """Đồng bộ lệnh slash chỉ khi cây lệnh đã đổi so với lần đồng bộ trước (hoặc khi `force`)."""
+        tree_hash = command_tree_hash(self.tree)
+        if not force and load_synced_hash(COMMAND_HASH_FILE, self.application_id) == tree_hash:
+            print('Lệnh ứng dụng không thay đổi, bỏ qua đồng bộ.')
+            return None
+        synced = await self.tree.sync()
+        save_synced_hash(COMMAND_HASH_FILE, self.application_id, tree_hash)
+        print(f'Đã đồng bộ hóa {len(synced)} lệnh ứng dụng.')
+        return synced
+
+    async def close(self):
+        # Gỡ các cog trước để chúng không còn dùng session khi session bị đóng
+        await super().close()
+        await self.metrics.stop()
+        if self.http_session and not self.http_session.closed:
+            await self.http_session.close()
+        shutdown_executors(wait=False)
+
 # Khởi tạo bot, đồng thời tắt lệnh help mặc định để tránh xung đột
-bot = commands.Bot(command_prefix='!', intents=intents, help_command=None)
+bot = AIOBot(command_prefix='!', intents=intents, help_command=None)
 
 # Danh sách các "cogs" (module logic) mà bot sẽ tải
 initial_extensions = [
@@ -37,20 +85,40 @@ initial_extensions = [
 # Sự kiện này được kích hoạt khi bot đã kết nối thành công với Discord
 @bot.event
 async def on_ready():
-    # Đồng bộ hóa các lệnh slash (/) với Discord để chúng xuất hiện
-    await bot.tree.sync()
+    # Lệnh slash được đồng bộ trong setup_hook, ở đây không gọi API nào để reconnect luôn nhẹ
     print(f'Đã đăng nhập với tên {bot.user}')
-    print(f'Đã đồng bộ hóa {len(await bot.tree.fetch_commands())} lệnh ứng dụng.')
     print('------')
 
+# Lệnh dành cho chủ bot: ép đồng bộ lại lệnh slash (ví dụ khi lệnh trên Discord bị lệch)
+@bot.command(name='sync', hidden=True)
+@commands.is_owner()
+async def force_sync(ctx: commands.Context):
+    try:
+        synced = await bot.sync_commands(force=True)
+    except discord.HTTPException as e:
+        return await ctx.send(f"❌ Đồng bộ thất bại: `{e}`")
+    await ctx.send(f"✅ Đã đồng bộ lại {len(synced)} lệnh ứng dụng.")
+
 # Hàm để tải các cogs
+async def load_extension_timed(extension: str):
+    started = time.perf_counter()
+    try:
+        await bot.load_extension(extension)
+    except Exception as e:
+        return print(f'Lỗi khi tải extension {extension}: {e}')
+    elapsed = time.perf_counter() - started
+    if profiler: profiler.record_init(extension, elapsed)
+    print(f'Tải thành công extension: {extension} ({elapsed * 1000:.0f} ms)')
+
 async def load_cogs():
-    for extension in initial_extensions:
-        try:
-            await bot.load_extension(extension)
-            print(f'Tải thành công extension: {extension}')
-        except Exception as e:
-            print(f'Lỗi khi tải extension {extension}: {e}')
+    # Các cog được tải đồng thời: phần import vẫn tuần tự, nhưng phần I/O của cog_load
+    # (mở DB, đọc persona, đọc ảnh chụp hàng đợi) của các cog chạy chồng lên nhau
+    started = time.perf_counter()
+    await asyncio.gather(*(load_extension_timed(extension) for extension in initial_extensions))
+    print(f'Đã tải {len(bot.extensions)}/{len(initial_extensions)} extension trong {(time.perf_counter() - started) * 1000:.0f} ms')
+    if profiler:
+        profiler.report()
+        profiler.uninstall()
 
 # Hàm chính để chạy bot
 async def main():
@@ -59,6 +127,9 @@ async def main():
         return
         
     async with bot:
+        # Session phải được tạo trước khi tải cogs vì các cog dùng nó ngay khi nhận lệnh
+        bot.http_session = create_http_session()
+        await bot.metrics.start()
         await load_cogs()
         await bot.start(DISCORD_TOKEN)
 
@@ -0,0 +1,34 @@
+# tests/test_llm_scheduler.py
+import asyncio
+import unittest
+from utils.llm_scheduler import LLMScheduler
+
+
+class CancelledWaiterTest(unittest.IsolatedAsyncioTestCase):
+    async def test_cancelled_waiter_does_not_leak_slot(self):
+        scheduler = LLMScheduler(max_concurrency=1, max_queue=10, max_queue_per_user=2)
+        holder = scheduler.slot(1, 100)
+        await holder.__aenter__()
+
+        async def wait_for_slot():
+            async with scheduler.slot(2, 200): pass
+
+        waiter = asyncio.create_task(wait_for_slot())
+        await asyncio.sleep(0)
+        self.assertEqual(scheduler.queue_depth, 1)
+
+        # Slot được trả ngay sau khi hủy, trước khi task chờ kịp chạy phần dọn dẹp của nó
+        waiter.cancel()
+        await holder.__aexit__(None, None, None)
+        with self.assertRaises(asyncio.CancelledError):
+            await waiter
+
+        self.assertEqual(scheduler.in_flight, 0)
+        self.assertEqual(scheduler.queue_depth, 0)
+        # User bị hủy vẫn chat lại được
+        async with scheduler.slot(2, 200):
+            self.assertEqual(scheduler.in_flight, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+# utils/audio_cache.py
+import hashlib
+import os
+import subprocess
+import tempfile
+import threading
+
+CACHE_EXTENSION = '.opus'
+# Stream gốc đã là Opus thì chỉ đóng gói lại (copy), ngược lại mã hóa sang Opus 48kHz stereo
+FFMPEG_COPY_ARGS = ['-vn', '-map_metadata', '-1', '-c:a', 'copy', '-f', 'ogg']
+FFMPEG_ENCODE_ARGS = ['-vn', '-map_metadata', '-1', '-c:a', 'libopus', '-b:a', '128k', '-ar', '48000', '-ac', '2', '-f', 'ogg']
+FFMPEG_INPUT_ARGS = ['-reconnect', '1', '-reconnect_streamed', '1', '-reconnect_delay_max', '5']
+
+
+def file_checksum(path: str):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class AudioCache:
+    """Cache audio Opus trên đĩa cho các bài được phát nhiều, dùng chung cho mọi guild.
+
+    Chỉ mục (số lần phát, file, kích thước, checksum) nằm trong `SongStore` (song_cache.db), khóa theo
+    webpage_url. Một bài được tải về nền khi số lần phát đạt `play_threshold`. File được ghi ra file tạm
+    rồi `os.replace`, kiểm tra kích thước ở mỗi lần phát và kiểm tra checksum ở lần phát đầu tiên sau
+    khi khởi động; file hỏng bị xóa và bài quay về phát từ YouTube. Khi vượt `max_bytes`, các bài lâu
+    không phát nhất bị xóa trước (mỗi lần phát được cộng thêm "độ mới", xem `SongStore`).
+    """
+    def __init__(self, folder: str, store, max_bytes: int, play_threshold: int, max_duration: float):
+        self.folder = folder
+        self.store = store
+        self.max_bytes = max_bytes
+        self.play_threshold = play_threshold
+        self.max_duration = max_duration
+        self._lock = threading.Lock()
+        self._verified = set() # file đã kiểm tra checksum trong tiến trình này
+        self._downloading = set() # webpage_url đang được tải
+
+    def path_for(self, file_name: str):
+        return os.path.join(self.folder, file_name)
+
+    def on_play(self, webpage_url: str):
+        """Ghi nhận một lần phát. Chạy trong executor.
+
+        Trả về (đường dẫn file nếu đã cache và còn nguyên vẹn, thời lượng, có nên tải bài này về không).
+        """
+        play_count, file_name, size, checksum, duration = self.store.record_play(webpage_url)
+        if file_name:
+            path = self.path_for(file_name)
+            if self._is_intact(path, size, checksum): return path, duration, False
+            print(f"File cache audio hỏng hoặc bị mất, xóa khỏi chỉ mục: {file_name}")
+            self._remove(webpage_url, path)
+        return None, duration, play_count >= self.play_threshold
+
+    def _is_intact(self, path, size, checksum):
+        try:
+            if os.path.getsize(path) != size: return False
+        except OSError:
+            return False
+        if path in self._verified: return True
+        if file_checksum(path) != checksum: return False
+        self._verified.add(path)
+        return True
+
+    def download(self, webpage_url: str, stream_data: dict):
+        """Tải và lưu một bài từ link stream đã lấy được. Chạy trong executor."""
+        duration = stream_data.get('duration')
+        if duration and duration > self.max_duration: return
+        with self._lock:
+            if webpage_url in self._downloading: return
+            self._downloading.add(webpage_url)
+        try:
+            os.makedirs(self.folder, exist_ok=True)
+            file_name = hashlib.sha256(webpage_url.encode('utf-8')).hexdigest() + CACHE_EXTENSION
+            fd, tmp_path = tempfile.mkstemp(suffix=CACHE_EXTENSION + '.tmp', dir=self.folder)
+            os.close(fd)
+            codec_args = FFMPEG_COPY_ARGS if stream_data.get('acodec') == 'opus' else FFMPEG_ENCODE_ARGS
+            try:
+                subprocess.run(['ffmpeg', '-y', '-loglevel', 'error', *FFMPEG_INPUT_ARGS, '-i', stream_data['source'],
+                                *codec_args, tmp_path], check=True, timeout=600, capture_output=True)
+                size = os.path.getsize(tmp_path)
+                checksum = file_checksum(tmp_path)
+                path = self.path_for(file_name)
+                os.replace(tmp_path, path)
+            except BaseException:
+                try: os.remove(tmp_path)
+                except OSError: pass
+                raise
+            self._verified.add(path)
+            self.store.set_audio_file(webpage_url, file_name, size, checksum, duration)
+            print(f"Đã lưu cache audio: {stream_data.get('title', webpage_url)}")
+            self._evict()
+        finally:
+            with self._lock:
+                self._downloading.discard(webpage_url)
+
+    def _remove(self, webpage_url, path):
+        self.store.clear_audio_file(webpage_url)
+        self._verified.discard(path)
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def _evict(self):
+        """Xóa bớt file cho tới khi còn dưới 90% dung lượng cho phép."""
+        total = self.store.audio_total_bytes()
+        if total <= self.max_bytes: return
+        target = self.max_bytes * 0.9
+        while total > target:
+            candidates = self.store.audio_eviction_candidates()
+            if not candidates: break
+            for webpage_url, file_name, size in candidates:
+                self._remove(webpage_url, self.path_for(file_name))
+                total -= size or 0
+                if total <= target: break
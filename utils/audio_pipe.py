@@ -0,0 +1,59 @@
+# utils/audio_pipe.py
+import queue
+import threading
+
+# Chu kỳ (giây) các thao tác chờ kiểm tra lại cờ hủy
+POLL_INTERVAL = 0.25
+
+
+class AudioChunkPipe:
+    """Ống dẫn bytes có giới hạn giữa thread tải audio (producer) và FFmpeg (consumer).
+
+    Dùng làm `source` cho `discord.FFmpegOpusAudio(..., pipe=True)`: thread ghi stdin của FFmpeg
+    gọi `read()` và nhận dữ liệu ngay khi từng chunk về tới. Hàng đợi có giới hạn nên producer
+    bị chặn lại thay vì đệm toàn bộ file khi FFmpeg đọc chậm. `cancel()` làm cả hai phía
+    dừng lại trong vòng POLL_INTERVAL giây.
+    """
+    def __init__(self, max_chunks: int = 64):
+        self._queue = queue.Queue(max_chunks)
+        self._buffer = b""
+        self._eof = False
+        self._cancelled = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def write(self, chunk: bytes) -> bool:
+        """Đưa một chunk vào ống; trả về False nếu ống đã bị hủy (producer nên dừng)."""
+        while not self._cancelled.is_set():
+            try:
+                self._queue.put(chunk, timeout=POLL_INTERVAL)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def finish(self):
+        """Báo hết dữ liệu; FFmpeg sẽ nhận EOF sau khi đọc hết phần còn lại."""
+        self.write(None)
+
+    def read(self, size: int = -1) -> bytes:
+        while not self._buffer:
+            if self._eof or self._cancelled.is_set(): return b""
+            try:
+                chunk = self._queue.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                continue
+            if chunk is None:
+                self._eof = True
+                return b""
+            self._buffer = chunk
+        if size is None or size < 0:
+            data, self._buffer = self._buffer, b""
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
@@ -0,0 +1,44 @@
+# utils/command_sync.py
+import hashlib
+import json
+import os
+
+
+def _command_payload(command, tree):
+    # discord.py >= 2.4 nhận tree làm tham số, các bản cũ hơn thì không
+    try:
+        return command.to_dict(tree)
+    except TypeError:
+        return command.to_dict()
+
+
+def command_tree_hash(tree):
+    """SHA-256 của mọi lệnh ứng dụng toàn cục (slash + context menu) đúng như sẽ gửi lên Discord.
+
+    Lệnh được sắp theo (type, name) và JSON được chuẩn hóa, nên thứ tự tải cog không làm đổi hash.
+    """
+    payloads = [_command_payload(command, tree) for command in tree.get_commands()]
+    payloads.sort(key=lambda payload: (payload.get('type', 1), payload['name']))
+    blob = json.dumps(payloads, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(blob.encode('utf-8')).hexdigest()
+
+
+def load_synced_hash(path: str, application_id: int):
+    """Hash của lần đồng bộ trước cho đúng application này, hoặc None."""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"Không thể đọc {path}: {e}")
+        return None
+    if data.get('application_id') != application_id: return None
+    return data.get('hash')
+
+
+def save_synced_hash(path: str, application_id: int, tree_hash: str):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({'application_id': application_id, 'hash': tree_hash}, f)
+    os.replace(tmp_path, path)
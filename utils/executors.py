@@ -0,0 +1,118 @@
+# utils/executors.py
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# --- KÍCH THƯỚC CÁC EXECUTOR THEO TỪNG PHÂN HỆ ---
+# Mỗi phân hệ có pool riêng để một tác vụ nặng (ví dụ playlist 100 bài) không chiếm hết
+# thread của phân hệ khác. 'db' bắt buộc chỉ có 1 thread: ChatStorage dựa vào thứ tự FIFO.
+EXECUTOR_SIZES = {
+    'db': 1, # SQLite bộ nhớ chat
+    'media': int(os.getenv('EXECUTOR_MEDIA_WORKERS', 4)), # yt-dlp tìm kiếm/lấy stream
+    'tts': int(os.getenv('EXECUTOR_TTS_WORKERS', 8)), # Stream ElevenLabs: mỗi thread bị giữ suốt thời gian đọc câu trả lời
+    'spotify': int(os.getenv('EXECUTOR_SPOTIFY_WORKERS', 2)), # Gọi API Spotify
+    'files': 2, # Đọc/ghi file persona, tra cứu cache audio và cache TTS (chỉ tác vụ ngắn)
+    'tts_cache': int(os.getenv('EXECUTOR_TTS_CACHE_WORKERS', 1)), # Mã hóa lại audio TTS bằng FFmpeg để lưu cache
+    'downloads': int(os.getenv('EXECUTOR_DOWNLOAD_WORKERS', 1)), # Tải bài hát vào cache audio
+}
+
+
+class InstrumentedExecutor(ThreadPoolExecutor):
+    """ThreadPoolExecutor có đo độ sâu hàng đợi và thời gian chờ trước khi tác vụ được chạy."""
+    def __init__(self, name: str, max_workers: int):
+        super().__init__(max_workers=max_workers, thread_name_prefix=name)
+        self.name = name
+        self.max_workers = max_workers
+        self._stats_lock = threading.Lock()
+        self.queued = 0 # Đã gửi nhưng chưa có thread nhận
+        self.running = 0
+        self.completed = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.wait_observers = [] # Hàm nhận (tên executor, số giây chờ) mỗi khi một tác vụ bắt đầu
+
+    def submit(self, fn, /, *args, **kwargs):
+        submitted_at = time.perf_counter()
+        with self._stats_lock:
+            self.queued += 1
+
+        def run():
+            waited = time.perf_counter() - submitted_at
+            with self._stats_lock:
+                self.queued -= 1
+                self.running += 1
+                self.wait_total += waited
+                self.wait_max = max(self.wait_max, waited)
+            for observer in self.wait_observers:
+                observer(self.name, waited)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self._stats_lock:
+                    self.running -= 1
+                    self.completed += 1
+
+        try:
+            return super().submit(run)
+        except BaseException:
+            with self._stats_lock:
+                self.queued -= 1
+            raise
+
+    def stats(self):
+        with self._stats_lock:
+            started = self.completed + self.running
+            return {
+                'workers': self.max_workers,
+                'queued': self.queued,
+                'running': self.running,
+                'completed': self.completed,
+                'wait_avg_ms': (self.wait_total / started * 1000) if started else 0.0,
+                'wait_max_ms': self.wait_max * 1000,
+            }
+
+
+_executors = {}
+_executors_lock = threading.Lock()
+_wait_observers = [] # Áp dụng cho mọi executor, kể cả executor được tạo sau này
+
+
+def get_executor(name: str) -> InstrumentedExecutor:
+    """Trả về executor của phân hệ `name`, tạo mới ở lần dùng đầu tiên."""
+    executor = _executors.get(name)
+    if executor is None:
+        with _executors_lock:
+            executor = _executors.get(name)
+            if executor is None:
+                executor = InstrumentedExecutor(name, EXECUTOR_SIZES[name])
+                executor.wait_observers.extend(_wait_observers)
+                _executors[name] = executor
+    return executor
+
+
+def add_wait_observer(observer):
+    """Đăng ký `observer(tên executor, số giây chờ)` cho mọi executor."""
+    with _executors_lock:
+        _wait_observers.append(observer)
+        for executor in _executors.values():
+            executor.wait_observers.append(observer)
+
+
+async def run_in(name: str, func, *args):
+    """Tương đương `loop.run_in_executor(None, func, *args)` nhưng chạy trên executor của phân hệ `name`."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_executor(name), func, *args)
+
+
+def executor_stats():
+    return {name: executor.stats() for name, executor in _executors.items()}
+
+
+def shutdown_executors(wait: bool = True):
+    with _executors_lock:
+        executors = list(_executors.values())
+        _executors.clear()
+    for executor in executors:
+        executor.shutdown(wait=wait, cancel_futures=True)
@@ -0,0 +1,106 @@
+# utils/history_cache.py
+from collections import OrderedDict, deque
+
+# Chi phí ước lượng (byte) cho mỗi lượt hội thoại ngoài phần nội dung: dict, deque slot, chuỗi role...
+TURN_OVERHEAD = 200
+
+
+def _turn_size(turn):
+    return len(turn["content"]) * 2 + TURN_OVERHEAD
+
+
+class HistoryCache:
+    """Cache trong bộ nhớ cho lịch sử gần nhất của từng cặp (user_id, persona_name).
+
+    Mỗi mục là một vòng đệm (ring buffer) cố định `ring_size` lượt kèm bản tóm tắt các lượt cũ hơn.
+    Toàn bộ cache bị giới hạn theo cả số mục lẫn dung lượng ước lượng; mục ít dùng nhất (LRU)
+    sẽ bị loại trước.
+    """
+    def __init__(self, ring_size: int, max_entries: int, max_bytes: int):
+        self.ring_size = ring_size
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> deque các lượt hội thoại
+        self._summaries = {}  # key -> bản tóm tắt, chỉ tồn tại cùng mục trong _entries
+        self._sizes = {}  # key -> dung lượng ước lượng của mục
+        self._total_bytes = 0
+        # key -> [số lượt tải đang chạy, có ghi/xóa xen vào trong lúc tải hay không]
+        self._loading = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def total_bytes(self):
+        return self._total_bytes
+
+    def get(self, key):
+        """Trả về bản sao lịch sử đã cache, hoặc None nếu chưa có."""
+        ring = self._entries.get(key)
+        if ring is None: return None
+        self._entries.move_to_end(key)
+        return list(ring)
+
+    def get_summary(self, key):
+        return self._summaries.get(key, "")
+
+    def set_summary(self, key, summary: str):
+        self._mark_dirty(key)
+        if key not in self._entries: return
+        self._resize(key, len(summary) * 2 - len(self._summaries.get(key, "")) * 2)
+        self._summaries[key] = summary
+        self._evict()
+
+    def append(self, key, turn):
+        """Write-through: chỉ cập nhật mục đã có trong cache, mục chưa có sẽ được tải lại từ DB khi cần."""
+        self._mark_dirty(key)
+        ring = self._entries.get(key)
+        if ring is None: return
+        if len(ring) == ring.maxlen:
+            self._resize(key, -_turn_size(ring[0]))
+        ring.append(turn)
+        self._resize(key, _turn_size(turn))
+        self._entries.move_to_end(key)
+        self._evict()
+
+    def invalidate(self, key):
+        self._mark_dirty(key)
+        if key in self._entries:
+            self._drop(key)
+
+    # --- TẢI TỪ DB (tránh ghi đè dữ liệu cũ nếu có tin nhắn mới trong lúc đang tải) ---
+    def begin_load(self, key):
+        state = self._loading.setdefault(key, [0, False])
+        state[0] += 1
+
+    def end_load(self, key, history, summary: str = ""):
+        state = self._loading[key]
+        state[0] -= 1
+        stale = state[1]
+        if state[0] == 0:
+            del self._loading[key]
+        if stale or history is None or key in self._entries: return
+        ring = deque(history[-self.ring_size:], maxlen=self.ring_size)
+        self._entries[key] = ring
+        self._summaries[key] = summary
+        self._sizes[key] = 0
+        self._resize(key, sum(_turn_size(turn) for turn in ring) + len(summary) * 2)
+        self._evict()
+
+    def _mark_dirty(self, key):
+        state = self._loading.get(key)
+        if state is not None:
+            state[1] = True
+
+    def _resize(self, key, delta):
+        self._sizes[key] += delta
+        self._total_bytes += delta
+
+    def _evict(self):
+        while self._entries and (len(self._entries) > self.max_entries or self._total_bytes > self.max_bytes):
+            self._drop(next(iter(self._entries)))
+
+    def _drop(self, key):
+        del self._entries[key]
+        self._summaries.pop(key, None)
+        self._total_bytes -= self._sizes.pop(key)
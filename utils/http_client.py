@@ -0,0 +1,29 @@
+# utils/http_client.py
+import os
+import aiohttp
+
+# --- CẤU HÌNH CONNECTION POOL (có thể ghi đè qua biến môi trường) ---
+HTTP_POOL_LIMIT = int(os.getenv('HTTP_POOL_LIMIT', 100)) # Tổng số kết nối tối đa
+HTTP_POOL_LIMIT_PER_HOST = int(os.getenv('HTTP_POOL_LIMIT_PER_HOST', 20)) # Số kết nối tối đa tới một host
+HTTP_KEEPALIVE_TIMEOUT = float(os.getenv('HTTP_KEEPALIVE_TIMEOUT', 60)) # Giây giữ kết nối rảnh để tái sử dụng
+HTTP_DNS_CACHE_TTL = int(os.getenv('HTTP_DNS_CACHE_TTL', 300)) # Giây cache kết quả DNS
+HTTP_TOTAL_TIMEOUT = float(os.getenv('HTTP_TOTAL_TIMEOUT', 60))
+HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', 10))
+HTTP_READ_TIMEOUT = float(os.getenv('HTTP_READ_TIMEOUT', 30)) # Thời gian chờ tối đa giữa hai lần nhận dữ liệu
+
+
+def create_http_session() -> aiohttp.ClientSession:
+    """Tạo ClientSession dùng chung: giữ kết nối keep-alive, cache DNS và giới hạn kết nối theo host.
+
+    Phải được gọi bên trong event loop đang chạy và đóng bằng `await session.close()` khi bot tắt.
+    """
+    connector = aiohttp.TCPConnector(
+        limit=HTTP_POOL_LIMIT,
+        limit_per_host=HTTP_POOL_LIMIT_PER_HOST,
+        keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT,
+        ttl_dns_cache=HTTP_DNS_CACHE_TTL,
+        use_dns_cache=True,
+        enable_cleanup_closed=True,
+    )
+    timeout = aiohttp.ClientTimeout(total=HTTP_TOTAL_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT, sock_read=HTTP_READ_TIMEOUT)
+    return aiohttp.ClientSession(connector=connector, timeout=timeout)
@@ -0,0 +1,143 @@
+# utils/llm_scheduler.py
+import asyncio
+import random
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+
+# Các mã lỗi tạm thời nên thử lại
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+
+class SchedulerBusy(Exception):
+    """Request bị từ chối vì hàng đợi đã đầy. Nội dung lỗi là thông báo thân thiện cho người dùng."""
+
+
+def retry_delay(attempt: int, retry_after=None, base: float = 1.0, cap: float = 20.0):
+    """Số giây cần chờ trước lần thử lại thứ `attempt` (bắt đầu từ 0), hoặc None nếu không nên thử lại.
+
+    Tôn trọng header Retry-After (dạng số giây hoặc HTTP-date) nếu có, ngược lại dùng
+    exponential backoff với full jitter để các request không dồn lại cùng một thời điểm.
+    """
+    if retry_after:
+        try:
+            seconds = float(retry_after)
+        except ValueError:
+            try:
+                seconds = (parsedate_to_datetime(retry_after) - datetime.now(timezone.utc)).total_seconds()
+            except (TypeError, ValueError):
+                seconds = None
+        if seconds is not None:
+            # Server yêu cầu chờ quá lâu thì trả lỗi luôn thay vì giữ người dùng chờ
+            if seconds > cap: return None
+            return max(0.0, seconds) + random.uniform(0, base)
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class LLMScheduler:
+    """Điều phối các request tới LLM: giới hạn số request đồng thời và chia lượt công bằng.
+
+    - Tối đa `max_concurrency` request chạy cùng lúc trên toàn bot.
+    - Mỗi user chỉ có một request đang chạy; các request tiếp theo của họ phải xếp hàng.
+    - Khi có slot trống, lượt được chia xoay vòng giữa các guild, rồi giữa các user trong guild,
+      nên một kênh đông người không chiếm hết slot của các guild khác.
+    - Hàng đợi quá dài thì từ chối ngay bằng SchedulerBusy thay vì để mọi request cùng timeout.
+    """
+    def __init__(self, max_concurrency: int, max_queue: int, max_queue_per_user: int):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_queue_per_user = max_queue_per_user
+        self._guilds = OrderedDict()  # guild_id -> OrderedDict(user_id -> deque các Future đang chờ)
+        self._active_users = set()
+        self._in_flight = 0
+        self._waiting = 0
+
+    @property
+    def in_flight(self):
+        return self._in_flight
+
+    @property
+    def queue_depth(self):
+        return self._waiting
+
+    @asynccontextmanager
+    async def slot(self, user_id: int, guild_id):
+        await self._acquire(user_id, guild_id)
+        try:
+            yield
+        finally:
+            self._release(user_id)
+
+    async def _acquire(self, user_id, guild_id):
+        users = self._guilds.get(guild_id)
+        pending = users.get(user_id) if users else None
+        if self._can_start(user_id) and not pending:
+            self._start(user_id)
+            return
+
+        if self._waiting >= self.max_queue:
+            raise SchedulerBusy("Bot đang quá tải, vui lòng thử lại sau ít phút.")
+        if pending and len(pending) >= self.max_queue_per_user:
+            raise SchedulerBusy("Bạn đang có quá nhiều tin nhắn chờ xử lý, hãy đợi câu trả lời trước đã.")
+
+        future = asyncio.get_running_loop().create_future()
+        users = self._guilds.setdefault(guild_id, OrderedDict())
+        users.setdefault(user_id, deque()).append(future)
+        self._waiting += 1
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Đã được cấp slot đúng lúc bị hủy: trả slot lại
+                self._release(user_id)
+            else:
+                self._remove_waiter(guild_id, user_id, future)
+            raise
+
+    def _can_start(self, user_id):
+        return self._in_flight < self.max_concurrency and user_id not in self._active_users
+
+    def _start(self, user_id):
+        self._in_flight += 1
+        self._active_users.add(user_id)
+
+    def _release(self, user_id):
+        self._in_flight -= 1
+        self._active_users.discard(user_id)
+        self._dispatch()
+
+    def _remove_waiter(self, guild_id, user_id, future):
+        users = self._guilds.get(guild_id)
+        if not users or user_id not in users: return
+        waiters = users[user_id]
+        try: waiters.remove(future)
+        except ValueError: return
+        self._waiting -= 1
+        if not waiters: del users[user_id]
+        if not users: del self._guilds[guild_id]
+
+    def _dispatch(self):
+        """Cấp slot trống theo vòng xoay guild -> user."""
+        while self._in_flight < self.max_concurrency and self._waiting:
+            granted = False
+            for guild_id in list(self._guilds):
+                users = self._guilds[guild_id]
+                user_id = next((uid for uid in users if uid not in self._active_users), None)
+                if user_id is None: continue
+                waiters = users[user_id]
+                future = waiters.popleft()
+                self._waiting -= 1
+                # Đưa user và guild vừa được phục vụ xuống cuối vòng
+                if waiters: users.move_to_end(user_id)
+                else: del users[user_id]
+                if users: self._guilds.move_to_end(guild_id)
+                else: del self._guilds[guild_id]
+                granted = True
+                # Task chờ đã bị hủy nhưng chưa kịp tự gỡ khỏi hàng đợi: bỏ qua, không cấp slot
+                if future.cancelled(): break
+                self._start(user_id)
+                future.set_result(None)
+                break
+            # Mọi user đang chờ đều đã có request chạy
+            if not granted: return
@@ -0,0 +1,289 @@
+# utils/metrics.py
+import asyncio
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from aiohttp import web
+from utils.executors import add_wait_observer
+
+# --- CẤU HÌNH (có thể ghi đè qua biến môi trường) ---
+METRICS_PORT = int(os.getenv('METRICS_PORT', 0)) # Cổng của endpoint /metrics (định dạng Prometheus), 0 = không mở
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1') # Mặc định chỉ nghe trên máy local
+METRICS_DUMP_INTERVAL = float(os.getenv('METRICS_DUMP_INTERVAL', 600)) # Giây giữa hai lần in tóm tắt khi không mở endpoint, 0 = tắt
+LOOP_LAG_INTERVAL = 0.5 # Giây giữa hai lần đo độ trễ event loop
+
+# Bucket (giây) cho các thao tác mạng và cho các thao tác cục bộ rất nhanh (SQLite, chờ executor)
+NETWORK_BUCKETS = (0.025, 0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60)
+FAST_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 2)
+
+_registry = []
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(pairs):
+    if not pairs: return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+class _Metric:
+    """Một họ metric; mỗi bộ giá trị nhãn có một "child" riêng, được tạo ở lần dùng đầu tiên."""
+    kind = None
+
+    def __init__(self, name: str, description: str, labelnames=()):
+        self.name = name
+        self.description = description
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _samples(self):
+        """(hậu tố tên, các cặp nhãn, giá trị) cho endpoint Prometheus."""
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, pairs, value in self._samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(pairs)} {value}")
+        return lines
+
+
+class _CounterChild:
+    __slots__ = ('value', '_lock')
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def _samples(self):
+        for values, child in list(self._children.items()):
+            yield '_total', list(zip(self.labelnames, values)), child.value
+
+
+class _HistogramChild:
+    __slots__ = ('bounds', 'counts', 'sum', 'count', '_lock')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1) # phần tử cuối: lớn hơn mọi bound (+Inf)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    @contextmanager
+    def time(self):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started)
+
+    def quantile(self, fraction: float):
+        """Ước lượng phân vị bằng cận trên của bucket chứa nó (đủ để đọc log, không dùng để tính toán)."""
+        with self._lock:
+            counts, total = list(self.counts), self.count
+        if not total: return 0.0
+        target, seen = fraction * total, 0
+        for bound, count in zip(self.bounds, counts):
+            seen += count
+            if seen >= target: return bound
+        return float('inf')
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, description: str, labelnames=(), buckets=NETWORK_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, description, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def time(self):
+        return self.labels().time()
+
+    def _samples(self):
+        for values, child in list(self._children.items()):
+            pairs = list(zip(self.labelnames, values))
+            with child._lock:
+                counts, total, count = list(child.counts), child.sum, child.count
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                yield '_bucket', pairs + [('le', bound)], cumulative
+            yield '_bucket', pairs + [('le', '+Inf')], count
+            yield '_sum', pairs, total
+            yield '_count', pairs, count
+
+
+class Gauge(_Metric):
+    """Gauge không nhãn. Giá trị được gán trực tiếp hoặc đọc từ một hàm lúc xuất metric."""
+    kind = 'gauge'
+
+    def __init__(self, name: str, description: str):
+        super().__init__(name, description)
+        self.value = 0.0
+        self._function = None
+
+    def set(self, value: float):
+        self.value = value
+
+    def set_function(self, function):
+        """`function()` được gọi trên event loop mỗi lần xuất metric, nên phải rẻ và không chặn."""
+        self._function = function
+
+    def get(self):
+        if self._function is None: return self.value
+        try:
+            return self._function()
+        except Exception as e:
+            print(f"Lỗi khi đọc gauge {self.name}: {e}")
+            return float('nan')
+
+    def _samples(self):
+        yield '', [], self.get()
+
+
+# --- CÁC METRIC CỦA BOT ---
+OPENROUTER_SECONDS = Histogram('bot_openrouter_response_seconds', 'Thời gian tới khi OpenRouter trả về header (kể cả thử lại).', ('mode',))
+YTDL_SECONDS = Histogram('bot_ytdl_seconds', 'Thời gian một lần gọi yt-dlp.', ('operation',))
+SQLITE_SECONDS = Histogram('bot_sqlite_call_seconds', 'Thời gian một lời gọi vào SQLite.', ('db',), FAST_BUCKETS)
+TTS_FIRST_BYTE_SECONDS = Histogram('bot_tts_first_byte_seconds', 'Thời gian tới chunk audio đầu tiên từ ElevenLabs.')
+EXECUTOR_WAIT_SECONDS = Histogram('bot_executor_wait_seconds', 'Thời gian tác vụ nằm chờ trong hàng đợi executor.', ('executor',), FAST_BUCKETS)
+SONG_CACHE_LOOKUPS = Counter('bot_song_cache_lookups', 'Số lần tra cache tìm kiếm YouTube.', ('result',))
+VOICE_CLIENTS = Gauge('bot_voice_clients', 'Số kết nối voice đang mở.')
+MUSIC_QUEUED_TRACKS = Gauge('bot_music_queued_tracks', 'Tổng số bài trong hàng đợi của mọi guild.')
+MUSIC_LONGEST_QUEUE = Gauge('bot_music_longest_queue', 'Độ dài hàng đợi dài nhất.')
+BLACKJACK_ACTIVE_GAMES = Gauge('bot_blackjack_active_games', 'Số ván Blackjack đang diễn ra.')
+EVENT_LOOP_LAG_SECONDS = Gauge('bot_event_loop_lag_seconds', 'Độ trễ event loop ở lần đo gần nhất.')
+
+
+def _observe_executor_wait(name: str, waited: float):
+    EXECUTOR_WAIT_SECONDS.labels(name).observe(waited)
+
+add_wait_observer(_observe_executor_wait)
+
+
+def timed(histogram_child):
+    """Decorator ghi thời gian chạy của hàm vào một histogram (đã chọn nhãn)."""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                histogram_child.observe(time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+
+def render():
+    """Toàn bộ metric ở định dạng text của Prometheus."""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+def summary():
+    """Một dòng tóm tắt ngắn cho mỗi metric đã có dữ liệu, dùng khi in ra log."""
+    lines = []
+    for metric in _registry:
+        if isinstance(metric, Histogram):
+            for values, child in list(metric._children.items()):
+                if not child.count: continue
+                label = f"{metric.name}{{{','.join(values)}}}" if values else metric.name
+                lines.append(f"{label}: n={child.count} avg={child.sum / child.count * 1000:.1f}ms "
+                             f"p50<={child.quantile(0.5) * 1000:g}ms p95<={child.quantile(0.95) * 1000:g}ms")
+        elif isinstance(metric, Counter):
+            counts = ' '.join(f"{','.join(values) or 'total'}={child.value}" for values, child in list(metric._children.items()))
+            if counts: lines.append(f"{metric.name}: {counts}")
+        else:
+            lines.append(f"{metric.name}: {metric.get():g}")
+    return lines
+
+
+class MetricsReporter:
+    """Đo độ trễ event loop và xuất metric: qua endpoint /metrics nếu có METRICS_PORT, ngược lại in định kỳ."""
+    def __init__(self, port: int = METRICS_PORT, host: str = METRICS_HOST, dump_interval: float = METRICS_DUMP_INTERVAL):
+        self.port = port
+        self.host = host
+        self.dump_interval = dump_interval
+        self._tasks = []
+        self._runner = None
+
+    async def start(self):
+        self._tasks.append(asyncio.create_task(self._measure_loop_lag()))
+        if self.port:
+            app = web.Application()
+            app.router.add_get('/metrics', self._handle_metrics)
+            self._runner = web.AppRunner(app, access_log=None)
+            await self._runner.setup()
+            await web.TCPSite(self._runner, self.host, self.port).start()
+            print(f"Metrics: http://{self.host}:{self.port}/metrics")
+        elif self.dump_interval > 0:
+            self._tasks.append(asyncio.create_task(self._dump_loop()))
+
+    async def stop(self):
+        for task in self._tasks: task.cancel()
+        self._tasks.clear()
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def _handle_metrics(self, request):
+        return web.Response(text=render(), content_type='text/plain', charset='utf-8')
+
+    async def _measure_loop_lag(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + LOOP_LAG_INTERVAL
+            await asyncio.sleep(LOOP_LAG_INTERVAL)
+            EVENT_LOOP_LAG_SECONDS.set(max(0.0, loop.time() - expected))
+
+    async def _dump_loop(self):
+        while True:
+            await asyncio.sleep(self.dump_interval)
+            print("--- METRICS ---\n" + '\n'.join(summary()))
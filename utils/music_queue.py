@@ -0,0 +1,214 @@
+# utils/music_queue.py
+import random
+
+
+class Track:
+    """Một bài trong hàng đợi. Dùng __slots__ để mỗi bài chỉ tốn vài chục byte thay vì một dict."""
+    __slots__ = ('url', 'title', 'duration', 'requester')
+
+    def __init__(self, url: str, title: str, duration: float = None, requester: int = None):
+        self.url = url # webpage_url (link vĩnh viễn)
+        self.title = title
+        self.duration = duration # giây, None nếu chưa biết
+        self.requester = requester # id người yêu cầu
+
+    @classmethod
+    def from_result(cls, result: dict, requester: int = None, duration: float = None):
+        """Tạo Track từ kết quả {'url', 'title'} của search_youtube."""
+        return cls(result['url'], result['title'], duration, requester)
+
+    def __repr__(self):
+        return f"Track({self.title!r})"
+
+
+class _Node:
+    __slots__ = ('track', 'priority', 'size', 'left', 'right')
+
+    def __init__(self, track, priority):
+        self.track = track
+        self.priority = priority
+        self.size = 1
+        self.left = None
+        self.right = None
+
+
+def _size(node):
+    return node.size if node else 0
+
+def _update(node):
+    node.size = 1 + _size(node.left) + _size(node.right)
+
+def _split(node, count):
+    """Tách cây thành (count phần tử đầu, phần còn lại)."""
+    if node is None: return None, None
+    if _size(node.left) >= count:
+        left, node.left = _split(node.left, count)
+        _update(node)
+        return left, node
+    node.right, right = _split(node.right, count - _size(node.left) - 1)
+    _update(node)
+    return node, right
+
+def _merge(left, right):
+    """Nối hai cây (mọi phần tử của `left` đứng trước `right`)."""
+    if left is None: return right
+    if right is None: return left
+    if left.priority > right.priority:
+        left.right = _merge(left.right, right)
+        _update(left)
+        return left
+    right.left = _merge(left, right.left)
+    _update(right)
+    return right
+
+def _build(tracks):
+    """Dựng cây từ danh sách trong O(n): cây cân bằng, priority gán giảm dần theo từng tầng."""
+    if not tracks: return None
+    priorities = sorted((random.random() for _ in tracks), reverse=True)
+
+    def build(lo, hi):
+        if lo >= hi: return None
+        mid = (lo + hi) // 2
+        node = _Node(tracks[mid], 0.0)
+        node.left = build(lo, mid)
+        node.right = build(mid + 1, hi)
+        _update(node)
+        return node
+
+    root = build(0, len(tracks))
+    # Duyệt theo tầng: cha luôn nhận priority lớn hơn con nên tính chất heap của treap được giữ
+    level, index = [root], 0
+    while level:
+        next_level = []
+        for node in level:
+            node.priority = priorities[index]
+            index += 1
+            if node.left: next_level.append(node.left)
+            if node.right: next_level.append(node.right)
+        level = next_level
+    return root
+
+
+class TrackQueue:
+    """Hàng đợi bài hát dạng implicit treap (cây theo vị trí).
+
+    Có các thao tác kiểu deque đang được dùng (append, appendleft, popleft, extend, clear, [i]) và thêm
+    insert/pop/move theo vị trí trong O(log n), xem theo trang mà không phải sao chép cả hàng đợi, và
+    xáo trộn tại chỗ giữ nguyên bài đang phát ở vị trí 0.
+    `version` tăng sau mỗi thay đổi nội dung, dùng để biết hàng đợi có cần lưu lại hay không.
+    `popped`/`appended` đếm số bài lấy khỏi đầu và thêm vào cuối, `rewrites` đếm mọi thay đổi khác:
+    khi `rewrites` không đổi, ảnh chụp chỉ cần xóa các bài đầu và ghi thêm phần đuôi mới.
+    """
+    def __init__(self, tracks=()):
+        self._root = _build(list(tracks))
+        self.version = 0
+        self.popped = 0
+        self.appended = 0
+        self.rewrites = 0
+
+    def __len__(self):
+        return _size(self._root)
+
+    def __bool__(self):
+        return self._root is not None
+
+    def __iter__(self):
+        stack, node = [], self._root
+        while stack or node:
+            while node:
+                stack.append(node)
+                node = node.left
+            node = stack.pop()
+            yield node.track
+            node = node.right
+
+    def _index(self, index: int):
+        length = len(self)
+        if index < 0: index += length
+        if not 0 <= index < length: raise IndexError('TrackQueue index out of range')
+        return index
+
+    def __getitem__(self, index: int):
+        index = self._index(index)
+        node = self._root
+        while True:
+            left_size = _size(node.left)
+            if index < left_size:
+                node = node.left
+            elif index == left_size:
+                return node.track
+            else:
+                index -= left_size + 1
+                node = node.right
+
+    # --- THAO TÁC KIỂU DEQUE ---
+    def append(self, track: Track):
+        self._root = _merge(self._root, _Node(track, random.random()))
+        self.version += 1
+        self.appended += 1
+
+    def appendleft(self, track: Track):
+        self._root = _merge(_Node(track, random.random()), self._root)
+        self.version += 1
+        self.rewrites += 1
+
+    def extend(self, tracks):
+        tracks = list(tracks)
+        self._root = _merge(self._root, _build(tracks))
+        self.version += 1
+        self.appended += len(tracks)
+
+    def popleft(self):
+        return self.pop(0)
+
+    def clear(self):
+        self._root = None
+        self.version += 1
+        self.rewrites += 1
+
+    # --- THAO TÁC THEO VỊ TRÍ ---
+    def insert(self, index: int, track: Track):
+        index = max(0, min(index, len(self)))
+        left, right = _split(self._root, index)
+        self._root = _merge(_merge(left, _Node(track, random.random())), right)
+        self.version += 1
+        self.rewrites += 1
+
+    def pop(self, index: int = -1):
+        index = self._index(index)
+        left, rest = _split(self._root, index)
+        node, right = _split(rest, 1)
+        self._root = _merge(left, right)
+        self.version += 1
+        if index == 0: self.popped += 1
+        else: self.rewrites += 1
+        return node.track
+
+    def move(self, source: int, destination: int):
+        """Chuyển bài ở vị trí `source` sang vị trí `destination` (tính sau khi đã lấy bài ra)."""
+        self.insert(destination, self.pop(source))
+
+    def page(self, start: int, count: int):
+        """Các bài từ vị trí `start`, tối đa `count` bài, trong O(log n + count)."""
+        left, rest = _split(self._root, max(0, start))
+        middle, right = _split(rest, count)
+        tracks = list(TrackQueue._from_root(middle))
+        self._root = _merge(_merge(left, middle), right)
+        return tracks
+
+    def shuffle(self, keep_first: bool = True):
+        """Xáo trộn tại chỗ; `keep_first` giữ bài đang phát ở vị trí 0."""
+        tracks = list(self)
+        head = tracks[:1] if keep_first else []
+        tail = tracks[len(head):]
+        random.shuffle(tail)
+        self._root = _build(head + tail)
+        self.version += 1
+        self.rewrites += 1
+
+    @classmethod
+    def _from_root(cls, root):
+        queue = cls.__new__(cls)
+        queue._root = root
+        queue.version = queue.popped = queue.appended = queue.rewrites = 0
+        return queue
@@ -0,0 +1,136 @@
+# utils/persona_registry.py
+import os
+from bisect import bisect_left
+from utils.executors import run_in
+
+FALLBACK_PROMPT = "You are a helpful assistant."
+
+# --- CÁC HÀM QUẢN LÝ FILE PERSONA ---
+def persona_path(folder: str, persona_name: str):
+    safe_persona_name = os.path.basename(persona_name)
+    return os.path.join(folder, f"{safe_persona_name}.txt")
+
+def load_persona(folder: str, persona_name: str):
+    try:
+        with open(persona_path(folder, persona_name), 'r', encoding='utf-8') as f: return f.read()
+    except FileNotFoundError: return None
+
+def save_persona(folder: str, persona_name: str, content: str):
+    if not os.path.exists(folder): os.makedirs(folder)
+    filepath = persona_path(folder, persona_name)
+    with open(filepath, 'w', encoding='utf-8') as f: f.write(content)
+    return os.stat(filepath).st_mtime_ns
+
+def delete_persona_file(folder: str, persona_name: str):
+    filepath = persona_path(folder, persona_name)
+    if os.path.exists(filepath):
+        os.remove(filepath)
+        return True
+    return False
+
+def scan_personas(folder: str):
+    """Trả về {tên persona: mtime_ns} của mọi file .txt trong thư mục."""
+    if not os.path.exists(folder): return {}
+    with os.scandir(folder) as entries:
+        return {entry.name[:-len('.txt')]: entry.stat().st_mtime_ns
+                for entry in entries if entry.name.endswith('.txt') and entry.is_file()}
+
+def read_personas(folder: str, names):
+    return {name: load_persona(folder, name) for name in names}
+
+
+class PersonaRegistry:
+    """Giữ toàn bộ template persona và bảng kênh -> persona trong bộ nhớ.
+
+    Dữ liệu được nạp một lần khi cog load; các thao tác ghi đi qua registry để cập nhật ngay,
+    còn thay đổi từ bên ngoài (sửa file trực tiếp) được phát hiện bằng `refresh()` theo mtime.
+    """
+    def __init__(self, folder: str, storage, default_persona: str):
+        self.folder = folder
+        self.storage = storage
+        self.default_persona = default_persona
+        self._templates = {}  # tên -> nội dung
+        self._mtimes = {}  # tên -> mtime_ns lúc nạp
+        self._channels = {}  # channel_id -> tên persona
+        self._index = []  # danh sách (tên viết thường, tên) đã sắp xếp cho autocomplete
+
+    async def load(self):
+        mtimes = await run_in('files', scan_personas, self.folder)
+        templates = await run_in('files', read_personas, self.folder, list(mtimes))
+        self._templates = {name: content for name, content in templates.items() if content is not None}
+        self._mtimes = {name: mtimes[name] for name in self._templates}
+        self._channels = await self.storage.get_all_channel_personas()
+        self._rebuild_index()
+
+    async def refresh(self):
+        """Nạp lại các file persona đã bị thêm, sửa hoặc xóa từ bên ngoài bot."""
+        mtimes = await run_in('files', scan_personas, self.folder)
+        changed = [name for name, mtime in mtimes.items() if self._mtimes.get(name) != mtime]
+        removed = [name for name in self._templates if name not in mtimes]
+        if not changed and not removed: return
+        templates = await run_in('files', read_personas, self.folder, changed)
+        for name in removed:
+            self._forget(name)
+        for name, content in templates.items():
+            if content is None:
+                self._forget(name)
+            else:
+                self._templates[name] = content
+                self._mtimes[name] = mtimes[name]
+        self._rebuild_index()
+        print(f"Đã nạp lại persona: {len(changed)} thay đổi, {len(removed)} bị xóa.")
+
+    # --- TRA CỨU (không đọc file hay DB) ---
+    def names(self):
+        return [name for _, name in self._index]
+
+    def exists(self, persona_name: str):
+        return persona_name in self._templates
+
+    def get_prompt(self, persona_name: str):
+        return self._templates.get(persona_name)
+
+    def resolve_prompt(self, persona_name: str):
+        """Prompt của persona, rơi về persona mặc định rồi prompt chung nếu không tìm thấy."""
+        return self._templates.get(persona_name) or self._templates.get(self.default_persona) or FALLBACK_PROMPT
+
+    def channel_persona(self, channel_id: int):
+        return self._channels.get(channel_id, self.default_persona)
+
+    def autocomplete(self, prefix: str, limit: int = 25):
+        """Các tên persona bắt đầu bằng `prefix` (không phân biệt hoa thường)."""
+        prefix = prefix.lower()
+        start = bisect_left(self._index, (prefix,))
+        matches = []
+        for key, name in self._index[start:start + limit]:
+            if not key.startswith(prefix): break
+            matches.append(name)
+        return matches
+
+    # --- GHI (cập nhật bộ nhớ ngay sau khi ghi xuống đĩa) ---
+    async def set_channel_persona(self, channel_id: int, persona_name: str):
+        await self.storage.set_channel_persona(channel_id, persona_name)
+        self._channels[channel_id] = persona_name
+
+    async def save(self, persona_name: str, content: str):
+        mtime = await run_in('files', save_persona, self.folder, persona_name, content)
+        name = os.path.basename(persona_name)
+        is_new = name not in self._templates
+        self._templates[name] = content
+        self._mtimes[name] = mtime
+        if is_new: self._rebuild_index()
+
+    async def delete(self, persona_name: str):
+        was_deleted = await run_in('files', delete_persona_file, self.folder, persona_name)
+        name = os.path.basename(persona_name)
+        if name in self._templates:
+            self._forget(name)
+            self._rebuild_index()
+        return was_deleted
+
+    def _forget(self, name):
+        self._templates.pop(name, None)
+        self._mtimes.pop(name, None)
+
+    def _rebuild_index(self):
+        self._index = sorted((name.lower(), name) for name in self._templates)
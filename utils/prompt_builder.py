@@ -0,0 +1,91 @@
+# utils/prompt_builder.py
+import os
+import threading
+
+# tiktoken là tùy chọn và phải bật rõ ràng: lần đầu get_encoding có thể tải file BPE qua mạng (không có timeout).
+# Khi chưa bật hoặc chưa nạp xong thì ước lượng theo số ký tự.
+TIKTOKEN_ENABLED = os.getenv('PROMPT_TIKTOKEN', '0') != '0'
+_encoding = None
+_encoding_lock = threading.Lock()
+
+# Ước lượng thận trọng: tiếng Việt/tiếng Nhật tốn nhiều token hơn tiếng Anh trên mỗi ký tự
+CHARS_PER_TOKEN = 3
+# Token phụ cho mỗi message (role, dấu phân cách) theo định dạng chat
+MESSAGE_OVERHEAD_TOKENS = 4
+
+SUMMARY_INSTRUCTIONS = (
+    "You maintain a running memory of a roleplay chat between a user and the assistant character. "
+    "Merge the previous summary with the new messages into one concise summary written in the third person. "
+    "Keep facts about the user (name, preferences, plans), promises made, ongoing topics and the relationship tone. "
+    "Drop small talk. Answer with the summary only, at most {max_words} words, in the language the user writes in."
+)
+
+
+def load_encoding():
+    """Nạp bộ mã hóa tiktoken nếu được bật. Chạy trong executor, không bao giờ trên event loop."""
+    global _encoding
+    if not TIKTOKEN_ENABLED or _encoding is not None: return
+    with _encoding_lock:
+        if _encoding is not None: return
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception as e:
+            print(f"Không nạp được tiktoken, tiếp tục ước lượng token theo số ký tự: {e}")
+
+
+def count_tokens(text: str) -> int:
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def count_message_tokens(message: dict) -> int:
+    return count_tokens(message["content"]) + MESSAGE_OVERHEAD_TOKENS
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Giữ phần cuối của văn bản (phần mới nhất) vừa trong `max_tokens`."""
+    if max_tokens <= 0: return ""
+    if _encoding is not None:
+        tokens = _encoding.encode(text, disallowed_special=())
+        if len(tokens) <= max_tokens: return text
+        return "…" + _encoding.decode(tokens[-max_tokens:])
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    return text if len(text) <= max_chars else "…" + text[-max_chars:]
+
+
+def summary_message(summary: str) -> dict:
+    return {"role": "system", "content": f"Summary of your earlier conversation with this user:\n{summary}"}
+
+
+def build_messages(system_prompt: str, summary: str, history: list, budget: int) -> list:
+    """Ghép system prompt, bản tóm tắt và các lượt gần nhất sao cho tổng số token <= budget.
+
+    System prompt và bản tóm tắt luôn được giữ; các lượt hội thoại được lấy từ mới nhất trở về trước
+    cho đến khi hết ngân sách. Lượt mới nhất luôn có mặt (bị cắt bớt nếu quá dài).
+    """
+    head = [{"role": "system", "content": system_prompt}]
+    if summary: head.append(summary_message(summary))
+    used = sum(count_message_tokens(m) for m in head)
+
+    selected = []
+    for turn in reversed(history):
+        cost = count_message_tokens(turn)
+        if used + cost > budget:
+            if not selected:
+                content = truncate_to_tokens(turn["content"], budget - used - MESSAGE_OVERHEAD_TOKENS)
+                if content: selected.append({"role": turn["role"], "content": content})
+            break
+        selected.append(turn)
+        used += cost
+    return head + selected[::-1]
+
+
+def build_summary_request(previous_summary: str, turns: list, max_words: int) -> list:
+    """Messages gửi cho LLM để gộp các lượt cũ vào bản tóm tắt hiện có (cập nhật tăng dần)."""
+    transcript = "\n".join(f"{turn['role']}: {turn['content']}" for turn in turns)
+    return [
+        {"role": "system", "content": SUMMARY_INSTRUCTIONS.format(max_words=max_words)},
+        {"role": "user", "content": f"Previous summary:\n{previous_summary or '(none)'}\n\nNew messages:\n{transcript}"},
+    ]
@@ -0,0 +1,370 @@
+# utils/song_store.py
+import json
+import os
+import sqlite3
+import threading
+import time
+from utils.metrics import SQLITE_SECONDS, timed
+
+# Giá trị trả về của `get()` khi truy vấn chưa có trong cache (khác với None = đã tìm mà không thấy)
+MISS = object()
+
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA busy_timeout = 5000",
+)
+
+# Migration theo PRAGMA user_version, giống utils/storage.py
+MIGRATIONS = [
+    # v1: bảng kết quả tìm kiếm, khóa là truy vấn đã chuẩn hóa
+    [
+        '''CREATE TABLE IF NOT EXISTS songs (
+                query_key TEXT PRIMARY KEY,
+                url TEXT,
+                title TEXT,
+                found INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            ) WITHOUT ROWID''',
+        "CREATE INDEX IF NOT EXISTS idx_songs_last_used ON songs (last_used)",
+    ],
+    # v2: metadata bài hát Spotify (kèm link YouTube đã tìm được) và danh sách bài của playlist/album
+    [
+        '''CREATE TABLE IF NOT EXISTS spotify_tracks (
+                track_id TEXT PRIMARY KEY,
+                name TEXT NOT NULL,
+                artist TEXT,
+                duration_ms INTEGER,
+                youtube_url TEXT,
+                youtube_title TEXT,
+                updated_at REAL NOT NULL
+            ) WITHOUT ROWID''',
+        '''CREATE TABLE IF NOT EXISTS spotify_collections (
+                collection_key TEXT PRIMARY KEY,
+                snapshot_id TEXT,
+                track_ids TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            ) WITHOUT ROWID''',
+    ],
+    # v3: số lần phát và file audio đã tải về của từng bài (dùng chung cho mọi guild)
+    [
+        '''CREATE TABLE IF NOT EXISTS audio_files (
+                webpage_url TEXT PRIMARY KEY,
+                play_count INTEGER NOT NULL DEFAULT 0,
+                last_played REAL NOT NULL,
+                file_name TEXT,
+                size INTEGER,
+                checksum TEXT,
+                duration REAL
+            ) WITHOUT ROWID''',
+        "CREATE INDEX IF NOT EXISTS idx_audio_files_cached ON audio_files (file_name) WHERE file_name IS NOT NULL",
+    ],
+    # v4: ảnh chụp hàng đợi của từng guild để khôi phục sau khi khởi động lại
+    [
+        '''CREATE TABLE IF NOT EXISTS queue_sessions (
+                guild_id INTEGER PRIMARY KEY,
+                voice_channel_id INTEGER,
+                text_channel_id INTEGER,
+                loop_state TEXT,
+                position REAL NOT NULL DEFAULT 0,
+                updated_at REAL NOT NULL
+            )''',
+        '''CREATE TABLE IF NOT EXISTS queue_tracks (
+                guild_id INTEGER NOT NULL,
+                seq INTEGER NOT NULL,
+                url TEXT NOT NULL,
+                title TEXT,
+                duration REAL,
+                requester INTEGER,
+                PRIMARY KEY (guild_id, seq)
+            ) WITHOUT ROWID''',
+    ],
+]
+
+SQL_SELECT = "SELECT url, title, found, created_at, last_used FROM songs WHERE query_key = ?"
+SQL_UPSERT = ("INSERT OR REPLACE INTO songs (query_key, url, title, found, created_at, last_used) "
+              "VALUES (?, ?, ?, ?, ?, ?)")
+SQL_TOUCH = "UPDATE songs SET last_used = ? WHERE query_key = ?"
+SQL_DELETE = "DELETE FROM songs WHERE query_key = ?"
+SQL_COUNT = "SELECT count(*) FROM songs"
+SQL_EVICT = "DELETE FROM songs WHERE query_key IN (SELECT query_key FROM songs ORDER BY last_used LIMIT ?)"
+SQL_EXPIRE = "DELETE FROM songs WHERE (found = 1 AND created_at < ?) OR (found = 0 AND created_at < ?)"
+
+SQL_SELECT_TRACKS = ("SELECT track_id, name, artist, duration_ms, youtube_url, youtube_title "
+                     "FROM spotify_tracks WHERE track_id IN ({})")
+# Cập nhật metadata nhưng giữ nguyên link YouTube đã tìm được trước đó
+SQL_UPSERT_TRACK = ("INSERT INTO spotify_tracks (track_id, name, artist, duration_ms, updated_at) VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT (track_id) DO UPDATE SET name = excluded.name, artist = excluded.artist, "
+                    "duration_ms = excluded.duration_ms, updated_at = excluded.updated_at")
+SQL_SET_YOUTUBE = "UPDATE spotify_tracks SET youtube_url = ?, youtube_title = ? WHERE track_id = ?"
+SQL_SELECT_COLLECTION = "SELECT snapshot_id, track_ids, updated_at FROM spotify_collections WHERE collection_key = ?"
+SQL_UPSERT_COLLECTION = ("INSERT OR REPLACE INTO spotify_collections (collection_key, snapshot_id, track_ids, updated_at) "
+                         "VALUES (?, ?, ?, ?)")
+SQL_RECORD_PLAY = ("INSERT INTO audio_files (webpage_url, play_count, last_played) VALUES (?, 1, ?) "
+                   "ON CONFLICT (webpage_url) DO UPDATE SET play_count = play_count + 1, last_played = excluded.last_played")
+SQL_SELECT_AUDIO = "SELECT play_count, file_name, size, checksum, duration FROM audio_files WHERE webpage_url = ?"
+SQL_SET_AUDIO = "UPDATE audio_files SET file_name = ?, size = ?, checksum = ?, duration = ? WHERE webpage_url = ?"
+SQL_CLEAR_AUDIO = "UPDATE audio_files SET file_name = NULL, size = NULL, checksum = NULL WHERE webpage_url = ?"
+SQL_AUDIO_TOTAL = "SELECT coalesce(sum(size), 0) FROM audio_files WHERE file_name IS NOT NULL"
+# Thứ tự xóa: lâu không phát nhất trước, mỗi lần phát được cộng thêm AUDIO_PLAY_BONUS giây "độ mới" (tối đa 50 lần)
+SQL_AUDIO_EVICTION_ORDER = ("SELECT webpage_url, file_name, size FROM audio_files WHERE file_name IS NOT NULL "
+                            "ORDER BY last_played + min(play_count, 50) * ? LIMIT ?")
+AUDIO_PLAY_BONUS = 3600
+
+SQL_UPSERT_SESSION = ("INSERT OR REPLACE INTO queue_sessions (guild_id, voice_channel_id, text_channel_id, loop_state, position, updated_at) "
+                      "VALUES (?, ?, ?, ?, ?, ?)")
+SQL_INSERT_QUEUE_TRACK = "INSERT INTO queue_tracks (guild_id, seq, url, title, duration, requester) VALUES (?, ?, ?, ?, ?, ?)"
+SQL_DELETE_QUEUE_TRACKS = "DELETE FROM queue_tracks WHERE guild_id = ?"
+SQL_DELETE_QUEUE_HEAD = "DELETE FROM queue_tracks WHERE guild_id = ? AND seq < ?"
+SQL_DELETE_SESSION = "DELETE FROM queue_sessions WHERE guild_id = ?"
+SQL_SELECT_SESSIONS = "SELECT guild_id, voice_channel_id, text_channel_id, loop_state, position, updated_at FROM queue_sessions"
+SQL_SELECT_QUEUE_TRACKS = "SELECT url, title, duration, requester FROM queue_tracks WHERE guild_id = ? ORDER BY seq"
+# Giới hạn số tham số trong một câu IN (...) để không vượt SQLITE_MAX_VARIABLE_NUMBER
+SQL_IN_CHUNK = 500
+
+
+# Mỗi lời gọi public vào SongStore được tính vào histogram thời gian SQLite
+sqlite_timed = timed(SQLITE_SECONDS.labels('song_cache'))
+
+
+def normalize_query(query: str) -> str:
+    """Chuẩn hóa truy vấn để các biến thể hoa/thường và khoảng trắng dùng chung một mục cache."""
+    return ' '.join(query.casefold().split())
+
+
+class SongStore:
+    """Cache kết quả tìm kiếm YouTube trên SQLite, thay cho cache.json.
+
+    - Mỗi lần cache miss chỉ ghi đúng một dòng thay vì ghi lại cả file.
+    - Mỗi thread có kết nối riêng ở chế độ WAL nên việc đọc không cần khóa Python và
+      không bị chặn bởi thao tác ghi.
+    - Mục hết hạn sau `ttl` giây (kết quả rỗng: `negative_ttl`), và khi vượt `max_entries`
+      thì các mục lâu không dùng nhất bị xóa (LRU).
+    """
+    # last_used chỉ được cập nhật khi đã cũ hơn ngưỡng này, để cache hit gần như không phải ghi
+    TOUCH_INTERVAL = 3600
+    # Kiểm tra giới hạn số mục sau mỗi bấy nhiêu lần ghi
+    EVICT_EVERY = 256
+
+    def __init__(self, db_file: str, max_entries: int, ttl: float, negative_ttl: float, legacy_json: str = None):
+        self.db_file = db_file
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.legacy_json = legacy_json
+        self._local = threading.local()
+        self._init_lock = threading.Lock()
+        self._initialized = False
+        self._writes = 0
+
+    # --- KẾT NỐI THEO THREAD ---
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            if not self._initialized: self._initialize()
+            conn = self._connect()
+            self._local.conn = conn
+        return conn
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_file, isolation_level=None, cached_statements=64)
+        for pragma in SQLITE_PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def _initialize(self):
+        with self._init_lock:
+            if self._initialized: return
+            conn = self._connect()
+            try:
+                current_version = conn.execute("PRAGMA user_version").fetchone()[0]
+                for version, statements in enumerate(MIGRATIONS, start=1):
+                    if version <= current_version: continue
+                    conn.execute("BEGIN IMMEDIATE")
+                    for statement in statements:
+                        conn.execute(statement)
+                    conn.execute(f"PRAGMA user_version = {version}")
+                    conn.execute("COMMIT")
+                self._import_legacy_json(conn)
+            finally:
+                conn.close()
+            self._initialized = True
+
+    def _import_legacy_json(self, conn):
+        """Chuyển dữ liệu từ cache.json cũ sang SQLite một lần duy nhất rồi đổi tên file cũ."""
+        if not self.legacy_json or not os.path.exists(self.legacy_json): return
+        try:
+            with open(self.legacy_json, 'r', encoding='utf-8') as f: legacy = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            return print(f"Không thể đọc {self.legacy_json} để chuyển đổi: {e}")
+        now = time.time()
+        rows = [(normalize_query(query), entry.get('url'), entry.get('title', 'Untitled'), 1, now, now)
+                for query, entry in legacy.items() if isinstance(entry, dict) and entry.get('url')]
+        conn.execute("BEGIN IMMEDIATE")
+        conn.executemany(SQL_UPSERT, rows)
+        conn.execute("COMMIT")
+        os.replace(self.legacy_json, self.legacy_json + '.migrated')
+        print(f"Đã chuyển {len(rows)} mục từ {self.legacy_json} sang {self.db_file}.")
+
+    # --- ĐỌC / GHI ---
+    @sqlite_timed
+    def get(self, query: str):
+        """Trả về kết quả đã cache, None nếu đã biết là không tìm thấy, hoặc MISS nếu chưa có/hết hạn."""
+        key = normalize_query(query)
+        conn = self._conn()
+        row = conn.execute(SQL_SELECT, (key,)).fetchone()
+        if row is None: return MISS
+        url, title, found, created_at, last_used = row
+        now = time.time()
+        if now - created_at > (self.ttl if found else self.negative_ttl):
+            conn.execute(SQL_DELETE, (key,))
+            return MISS
+        if now - last_used > self.TOUCH_INTERVAL:
+            conn.execute(SQL_TOUCH, (now, key))
+        return {'url': url, 'title': title} if found else None
+
+    @sqlite_timed
+    def put(self, query: str, result):
+        """Lưu kết quả tìm kiếm; `result=None` lưu vào negative cache."""
+        now = time.time()
+        found = result is not None
+        url = result['url'] if found else None
+        title = result['title'] if found else None
+        conn = self._conn()
+        conn.execute(SQL_UPSERT, (normalize_query(query), url, title, int(found), now, now))
+        self._writes += 1
+        if self._writes % self.EVICT_EVERY == 0:
+            self.evict()
+
+    def evict(self):
+        """Xóa mục hết hạn, sau đó xóa mục lâu không dùng nhất nếu vẫn vượt `max_entries`."""
+        conn = self._conn()
+        now = time.time()
+        conn.execute(SQL_EXPIRE, (now - self.ttl, now - self.negative_ttl))
+        overflow = conn.execute(SQL_COUNT).fetchone()[0] - self.max_entries
+        if overflow > 0:
+            conn.execute(SQL_EVICT, (overflow,))
+
+    # --- METADATA SPOTIFY ---
+    @sqlite_timed
+    def get_spotify_tracks(self, track_ids):
+        """Trả về {track_id: track} cho các bài đã có trong cache (track có dạng như `put_spotify_tracks`)."""
+        conn = self._conn()
+        tracks = {}
+        ids = [track_id for track_id in dict.fromkeys(track_ids) if track_id]
+        for start in range(0, len(ids), SQL_IN_CHUNK):
+            chunk = ids[start:start + SQL_IN_CHUNK]
+            sql = SQL_SELECT_TRACKS.format(', '.join('?' * len(chunk)))
+            for track_id, name, artist, duration_ms, youtube_url, youtube_title in conn.execute(sql, chunk):
+                tracks[track_id] = {'id': track_id, 'name': name, 'artist': artist, 'duration_ms': duration_ms,
+                                    'youtube_url': youtube_url, 'youtube_title': youtube_title}
+        return tracks
+
+    @sqlite_timed
+    def put_spotify_tracks(self, tracks):
+        """Lưu metadata của các track {'id', 'name', 'artist', 'duration_ms'} trong một transaction."""
+        now = time.time()
+        rows = [(track['id'], track['name'], track['artist'], track['duration_ms'], now) for track in tracks if track['id']]
+        if not rows: return
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(SQL_UPSERT_TRACK, rows)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    @sqlite_timed
+    def set_youtube_mapping(self, track_id: str, result: dict):
+        """Ghi nhớ link YouTube đã tìm được cho một bài Spotify."""
+        if not track_id: return
+        self._conn().execute(SQL_SET_YOUTUBE, (result['url'], result['title'], track_id))
+
+    @sqlite_timed
+    def get_spotify_collection(self, key: str):
+        """Trả về (snapshot_id, [track_id], updated_at) của playlist/album đã cache, hoặc None."""
+        row = self._conn().execute(SQL_SELECT_COLLECTION, (key,)).fetchone()
+        if row is None: return None
+        snapshot_id, track_ids, updated_at = row
+        return snapshot_id, track_ids.split(',') if track_ids else [], updated_at
+
+    @sqlite_timed
+    def put_spotify_collection(self, key: str, snapshot_id, track_ids):
+        self._conn().execute(SQL_UPSERT_COLLECTION, (key, snapshot_id, ','.join(track_ids), time.time()))
+
+    # --- CHỈ MỤC CACHE AUDIO ---
+    @sqlite_timed
+    def record_play(self, webpage_url: str):
+        """Tăng số lần phát và trả về (play_count, file_name, size, checksum, duration) sau khi cập nhật."""
+        conn = self._conn()
+        conn.execute(SQL_RECORD_PLAY, (webpage_url, time.time()))
+        return conn.execute(SQL_SELECT_AUDIO, (webpage_url,)).fetchone()
+
+    @sqlite_timed
+    def set_audio_file(self, webpage_url: str, file_name: str, size: int, checksum: str, duration):
+        self._conn().execute(SQL_SET_AUDIO, (file_name, size, checksum, duration, webpage_url))
+
+    @sqlite_timed
+    def clear_audio_file(self, webpage_url: str):
+        self._conn().execute(SQL_CLEAR_AUDIO, (webpage_url,))
+
+    @sqlite_timed
+    def audio_total_bytes(self):
+        return self._conn().execute(SQL_AUDIO_TOTAL).fetchone()[0]
+
+    @sqlite_timed
+    def audio_eviction_candidates(self, limit: int = 32):
+        """Các file nên bị xóa trước: [(webpage_url, file_name, size)]."""
+        return self._conn().execute(SQL_AUDIO_EVICTION_ORDER, (AUDIO_PLAY_BONUS, limit)).fetchall()
+
+    # --- ẢNH CHỤP HÀNG ĐỢI ---
+    @sqlite_timed
+    def save_queue_snapshot(self, guild_id: int, session: dict, tracks=None, first_seq: int = 0, drop_before: int = None):
+        """Lưu trạng thái phát của guild; `tracks=None` nghĩa là không có bài mới cần ghi.
+
+        Không có `drop_before`: `tracks` thay thế toàn bộ danh sách bài. Có `drop_before`: cập nhật tăng dần,
+        xóa các bài có seq nhỏ hơn (đã rời đầu hàng đợi) rồi ghi thêm `tracks` với seq bắt đầu từ `first_seq`.
+        """
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(SQL_UPSERT_SESSION, (guild_id, session['voice_channel_id'], session['text_channel_id'],
+                                              session['loop_state'], session['position'], time.time()))
+            if drop_before is not None:
+                conn.execute(SQL_DELETE_QUEUE_HEAD, (guild_id, drop_before))
+            elif tracks is not None:
+                conn.execute(SQL_DELETE_QUEUE_TRACKS, (guild_id,))
+            if tracks is not None:
+                conn.executemany(SQL_INSERT_QUEUE_TRACK, ((guild_id, first_seq + index, *track) for index, track in enumerate(tracks)))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    @sqlite_timed
+    def delete_queue_snapshot(self, guild_id: int):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute(SQL_DELETE_QUEUE_TRACKS, (guild_id,))
+        conn.execute(SQL_DELETE_SESSION, (guild_id,))
+        conn.execute("COMMIT")
+
+    @sqlite_timed
+    def load_queue_sessions(self, max_age: float):
+        """Trả về {guild_id: phiên} của các ảnh chụp còn mới; ảnh chụp quá cũ bị xóa."""
+        sessions = {}
+        now = time.time()
+        for guild_id, voice_channel_id, text_channel_id, loop_state, position, updated_at in self._conn().execute(SQL_SELECT_SESSIONS).fetchall():
+            if now - updated_at > max_age:
+                self.delete_queue_snapshot(guild_id)
+                continue
+            sessions[guild_id] = {'voice_channel_id': voice_channel_id, 'text_channel_id': text_channel_id,
+                                  'loop_state': loop_state, 'position': position}
+        return sessions
+
+    @sqlite_timed
+    def load_queue_tracks(self, guild_id: int):
+        """[(url, title, duration, requester)] theo đúng thứ tự hàng đợi."""
+        return self._conn().execute(SQL_SELECT_QUEUE_TRACKS, (guild_id,)).fetchall()
@@ -0,0 +1,125 @@
+# utils/spotify_ingest.py
+import asyncio
+import threading
+import time
+from functools import partial
+from utils.executors import run_in
+
+PLAYLIST_PAGE_SIZE = 100 # Tối đa của API playlist items
+ALBUM_PAGE_SIZE = 50 # Tối đa của API album tracks
+# Chỉ lấy các trường cần dùng để giảm kích thước response
+TRACK_FIELDS = 'track(id,name,duration_ms,artists(name))'
+PLAYLIST_FIELDS = f'snapshot_id,tracks(total,items({TRACK_FIELDS}))'
+PLAYLIST_PAGE_FIELDS = f'items({TRACK_FIELDS})'
+
+
+def track_record(item):
+    """Rút gọn một item của API Spotify thành {'id', 'name', 'artist', 'duration_ms'}; None nếu thiếu dữ liệu."""
+    track = item.get('track', item) if item else None
+    if not track or not track.get('name') or not track.get('artists'): return None
+    return {'id': track.get('id'), 'name': track['name'], 'artist': track['artists'][0]['name'],
+            'duration_ms': track.get('duration_ms'), 'youtube_url': None, 'youtube_title': None}
+
+def track_query(track):
+    """Chuỗi tìm kiếm YouTube cho một track."""
+    return f"{track['name']} {track['artist']}"
+
+
+class SpotifyIngest:
+    """Lấy danh sách bài của link Spotify đầy đủ (không bị cắt ở trang đầu) và cache lại.
+
+    - Trang đầu được lấy trước để biết tổng số bài, các trang còn lại được lấy song song trên
+      executor 'spotify' (số thread của executor chính là giới hạn request đồng thời; spotipy tự
+      thử lại khi gặp 429 theo Retry-After).
+    - Playlist được so khớp theo `snapshot_id`: nếu không đổi thì chỉ tốn một request nhỏ.
+      Album (không đổi sau khi phát hành) và từng bài lẻ được đọc thẳng từ cache.
+    - Metadata bài hát được lưu trong `SongStore`, cùng chỗ với link YouTube đã tìm cho bài đó.
+    """
+    def __init__(self, client_factory, store, collection_ttl: float):
+        self.client_factory = client_factory
+        self.client = None # Tạo bằng client_factory ở lần dùng đầu tiên, trong executor
+        self.store = store
+        self.collection_ttl = collection_ttl
+        self._client_lock = threading.Lock()
+
+    def get_client(self):
+        if self.client is None:
+            with self._client_lock:
+                if self.client is None: self.client = self.client_factory()
+        return self.client
+
+    async def fetch(self, spotify_type: str, spotify_id: str):
+        """Trả về danh sách track theo đúng thứ tự của playlist/album/artist/track."""
+        if self.client is None: await run_in('spotify', self.get_client)
+        if spotify_type == 'playlist': return await self._fetch_playlist(spotify_id)
+        if spotify_type == 'album': return await self._fetch_album(spotify_id)
+        if spotify_type == 'artist':
+            result = await run_in('spotify', self.client.artist_top_tracks, spotify_id)
+            return await self._remember(result.get('tracks', []))
+        if spotify_type == 'track':
+            cached = await run_in('spotify', self.store.get_spotify_tracks, [spotify_id])
+            if spotify_id in cached: return [cached[spotify_id]]
+            return await self._remember([await run_in('spotify', self.client.track, spotify_id)])
+        return []
+
+    async def _fetch_playlist(self, playlist_id):
+        key = f'playlist:{playlist_id}'
+        first = await run_in('spotify', partial(self.client.playlist, playlist_id, fields=PLAYLIST_FIELDS,
+                                                additional_types=('track',)))
+        snapshot_id = first.get('snapshot_id')
+        cached = await self._cached_collection(key, snapshot_id)
+        if cached is not None: return cached
+
+        page = first.get('tracks') or {}
+        def fetch_page(offset):
+            return self.client.playlist_items(playlist_id, fields=PLAYLIST_PAGE_FIELDS, limit=PLAYLIST_PAGE_SIZE,
+                                              offset=offset, additional_types=('track',))
+        items = await self._all_items(page, fetch_page, PLAYLIST_PAGE_SIZE)
+        return await self._remember(items, key, snapshot_id)
+
+    async def _fetch_album(self, album_id):
+        key = f'album:{album_id}'
+        cached = await self._cached_collection(key, None)
+        if cached is not None: return cached
+
+        def fetch_page(offset):
+            return self.client.album_tracks(album_id, limit=ALBUM_PAGE_SIZE, offset=offset)
+        page = await run_in('spotify', fetch_page, 0)
+        items = await self._all_items(page, fetch_page, ALBUM_PAGE_SIZE)
+        return await self._remember(items, key, None)
+
+    async def _all_items(self, first_page, fetch_page, page_size):
+        """Ghép trang đầu với các trang còn lại (lấy song song, giữ nguyên thứ tự)."""
+        items = list(first_page.get('items') or [])
+        offsets = range(len(items), first_page.get('total') or 0, page_size) if items else ()
+        pages = await asyncio.gather(*(run_in('spotify', fetch_page, offset) for offset in offsets))
+        for page in pages:
+            items.extend(page.get('items') or [])
+        return items
+
+    async def _cached_collection(self, key, snapshot_id):
+        """Danh sách track đã cache của playlist/album nếu còn hợp lệ và đủ metadata, ngược lại None."""
+        entry = await run_in('spotify', self.store.get_spotify_collection, key)
+        if entry is None: return None
+        cached_snapshot, track_ids, updated_at = entry
+        if snapshot_id is not None:
+            if cached_snapshot != snapshot_id: return None
+        elif time.time() - updated_at > self.collection_ttl:
+            return None
+        tracks = await run_in('spotify', self.store.get_spotify_tracks, track_ids)
+        if len(tracks) < len(set(track_ids)): return None
+        return [tracks[track_id] for track_id in track_ids]
+
+    async def _remember(self, items, key=None, snapshot_id=None):
+        tracks = [track for track in map(track_record, items) if track]
+        # Giữ lại link YouTube đã tìm được cho các bài đã biết từ trước
+        known = await run_in('spotify', self.store.get_spotify_tracks, [track['id'] for track in tracks])
+        for track in tracks:
+            if track['id'] in known:
+                track['youtube_url'] = known[track['id']]['youtube_url']
+                track['youtube_title'] = known[track['id']]['youtube_title']
+        await run_in('spotify', self.store.put_spotify_tracks, tracks)
+        # Bài local (không có id) không thể đọc lại từ cache nên không cache cả danh sách
+        if key and all(track['id'] for track in tracks):
+            await run_in('spotify', self.store.put_spotify_collection, key, snapshot_id, [track['id'] for track in tracks])
+        return tracks
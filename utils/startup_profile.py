@@ -0,0 +1,100 @@
+# utils/startup_profile.py
+import sys
+import time
+
+# Chỉ dùng thư viện chuẩn: module này phải được import trước discord và mọi thư viện nặng khác
+STARTUP_PROFILE_TOP = 15 # Số module tốn thời gian nhất được in ra
+
+
+class _TimedLoader:
+    """Bọc loader gốc để đo thời gian chạy code cấp module; mọi thứ khác chuyển thẳng cho loader gốc."""
+    def __init__(self, loader, profiler):
+        self._loader = loader
+        self._profiler = profiler
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module):
+        # Trả lại loader gốc để code của module (và các thư viện đọc __loader__) không thấy lớp bọc
+        module.__loader__ = self._loader
+        if module.__spec__ is not None: module.__spec__.loader = self._loader
+        self._profiler.enter(module.__name__)
+        try:
+            self._loader.exec_module(module)
+        finally:
+            self._profiler.exit()
+
+    def __getattr__(self, name):
+        return getattr(self._loader, name)
+
+
+class StartupProfiler:
+    """Đo thời gian import từng module (riêng phần của nó và cả các module con) và thời gian khởi tạo từng cog.
+
+    Bật bằng biến môi trường STARTUP_PROFILE=1. Chỉ dùng khi chẩn đoán: mọi lần import đều đi qua finder này.
+    """
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.imports = {} # tên module -> (thời gian riêng, thời gian kể cả module con)
+        self.init_times = {} # tên extension -> giây khởi tạo (setup + cog_load)
+        self._stack = [] # [tên, lúc bắt đầu, thời gian của các module con]
+
+    @classmethod
+    def install(cls):
+        profiler = cls()
+        sys.meta_path.insert(0, _ProfilingFinder(profiler))
+        return profiler
+
+    def uninstall(self):
+        sys.meta_path[:] = [finder for finder in sys.meta_path
+                            if not (isinstance(finder, _ProfilingFinder) and finder.profiler is self)]
+
+    def enter(self, name):
+        self._stack.append([name, time.perf_counter(), 0.0])
+
+    def exit(self):
+        name, started, children = self._stack.pop()
+        total = time.perf_counter() - started
+        self.imports[name] = (total - children, total)
+        if self._stack: self._stack[-1][2] += total
+
+    def record_init(self, extension: str, seconds: float):
+        self.init_times[extension] = seconds
+
+    def report(self):
+        lines = [f"--- STARTUP PROFILE ({(time.perf_counter() - self.started_at) * 1000:.0f} ms từ lúc bật) ---"]
+        packages = {}
+        for name, (own, _) in self.imports.items():
+            package = name.split('.')[0]
+            packages[package] = packages.get(package, 0.0) + own
+        lines.append("Import theo package:")
+        for package, seconds in sorted(packages.items(), key=lambda item: item[1], reverse=True)[:STARTUP_PROFILE_TOP]:
+            lines.append(f"  {package:<28} {seconds * 1000:8.1f} ms")
+        lines.append("Module tốn nhiều nhất (riêng / kể cả module con):")
+        top = sorted(self.imports.items(), key=lambda item: item[1][0], reverse=True)[:STARTUP_PROFILE_TOP]
+        for name, (own, total) in top:
+            lines.append(f"  {name:<40} {own * 1000:8.1f} / {total * 1000:8.1f} ms")
+        if self.init_times:
+            lines.append("Khởi tạo extension (import cog + setup + cog_load):")
+            for extension, seconds in self.init_times.items():
+                lines.append(f"  {extension:<28} {seconds * 1000:8.1f} ms")
+        print('\n'.join(lines))
+
+
+class _ProfilingFinder:
+    def __init__(self, profiler):
+        self.profiler = profiler
+
+    def find_spec(self, name, path=None, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, 'find_spec'): continue
+            spec = finder.find_spec(name, path, target)
+            if spec is None: continue
+            if spec.loader is not None and hasattr(spec.loader, 'exec_module'):
+                spec.loader = _TimedLoader(spec.loader, self.profiler)
+            return spec
+        return None
+
+    def invalidate_caches(self):
+        pass
@@ -0,0 +1,282 @@
+# utils/storage.py
+import asyncio
+import sqlite3
+from utils.executors import get_executor
+from utils.metrics import SQLITE_SECONDS, timed
+from contextlib import contextmanager
+
+# --- CÁC PRAGMA CHO KẾT NỐI LÂU DÀI ---
+# WAL cho phép đọc song song với ghi, synchronous=NORMAL chỉ fsync khi checkpoint.
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -16000",
+    "PRAGMA mmap_size = 268435456",
+    "PRAGMA busy_timeout = 5000",
+)
+
+# --- SCHEMA MIGRATION THEO PHIÊN BẢN (PRAGMA user_version) ---
+# Mỗi phần tử là danh sách câu lệnh để nâng schema lên phiên bản tương ứng (index + 1).
+# Chỉ được thêm phiên bản mới vào cuối, không sửa các phiên bản đã phát hành.
+MIGRATIONS = [
+    # v1: các bảng gốc (giữ nguyên cấu trúc của memory.db cũ)
+    [
+        '''CREATE TABLE IF NOT EXISTS conversations (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                persona_name TEXT NOT NULL,
+                role TEXT NOT NULL,
+                content TEXT NOT NULL,
+                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+            )''',
+        '''CREATE TABLE IF NOT EXISTS channel_personalities (
+                channel_id INTEGER PRIMARY KEY,
+                persona_name TEXT NOT NULL
+            )''',
+    ],
+    # v2: index cho truy vấn lịch sử/prune. rowid (id) luôn nằm trong index nên
+    # các truy vấn lấy id, đếm và sắp xếp theo (timestamp, id) được phục vụ hoàn toàn từ index.
+    [
+        '''CREATE INDEX IF NOT EXISTS idx_conversations_user_persona_ts
+                ON conversations (user_id, persona_name, timestamp)''',
+        "ANALYZE",
+    ],
+    # v3: bản tóm tắt tăng dần của các lượt cũ đã bị cắt khỏi cửa sổ lịch sử
+    [
+        '''CREATE TABLE IF NOT EXISTS conversation_summaries (
+                user_id INTEGER NOT NULL,
+                persona_name TEXT NOT NULL,
+                summary TEXT NOT NULL,
+                updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (user_id, persona_name)
+            ) WITHOUT ROWID''',
+    ],
+]
+
+# --- CÁC CÂU LỆNH SQL (được sqlite3 cache sẵn dạng prepared statement) ---
+SQL_INSERT_MESSAGE = "INSERT INTO conversations (user_id, persona_name, role, content) VALUES (?, ?, ?, ?)"
+SQL_PRUNE_BOUNDARY = ("SELECT id FROM conversations WHERE user_id = ? AND persona_name = ? "
+                      "ORDER BY timestamp DESC, id DESC LIMIT 1 OFFSET ?")
+SQL_PRUNE_DELETE = "DELETE FROM conversations WHERE user_id = ? AND persona_name = ? AND id <= ?"
+SQL_SELECT_HISTORY = ("SELECT role, content FROM conversations WHERE user_id = ? AND persona_name = ? "
+                      "ORDER BY timestamp DESC, id DESC LIMIT ?")
+SQL_SELECT_OVERFLOW = ("SELECT id, role, content FROM conversations WHERE user_id = ? AND persona_name = ? AND id <= ? "
+                       "ORDER BY timestamp, id")
+SQL_ROW_EXISTS = "SELECT 1 FROM conversations WHERE id = ?"
+SQL_DELETE_HISTORY = "DELETE FROM conversations WHERE user_id = ? AND persona_name = ?"
+SQL_SELECT_SUMMARY = "SELECT summary FROM conversation_summaries WHERE user_id = ? AND persona_name = ?"
+SQL_UPSERT_SUMMARY = ("INSERT OR REPLACE INTO conversation_summaries (user_id, persona_name, summary, updated_at) "
+                      "VALUES (?, ?, ?, CURRENT_TIMESTAMP)")
+SQL_DELETE_SUMMARY = "DELETE FROM conversation_summaries WHERE user_id = ? AND persona_name = ?"
+SQL_SELECT_CHANNEL_PERSONA = "SELECT persona_name FROM channel_personalities WHERE channel_id = ?"
+SQL_SELECT_ALL_CHANNEL_PERSONAS = "SELECT channel_id, persona_name FROM channel_personalities"
+SQL_UPSERT_CHANNEL_PERSONA = "INSERT OR REPLACE INTO channel_personalities (channel_id, persona_name) VALUES (?, ?)"
+
+
+class ChatStorage:
+    """Lớp lưu trữ bộ nhớ chat, giữ một kết nối SQLite lâu dài thay vì mở/đóng mỗi lần gọi.
+
+    Mọi truy cập đều chạy trên một thread riêng nên kết nối không bao giờ bị dùng song song,
+    và các lệnh được thực thi đúng thứ tự đã gửi (FIFO) - hàng đợi ghi trễ dựa vào điều này.
+
+    Tin nhắn mới không được ghi ngay mà được gom lại (write-behind) và ghi trong một transaction
+    mỗi `flush_interval` giây hoặc khi đủ `max_batch` dòng.
+    """
+    def __init__(self, db_file: str, memory_limit: int, flush_interval: float = 0.05, max_batch: int = 200):
+        self.db_file = db_file
+        self.memory_limit = memory_limit
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self._conn = None
+        # Executor 'db' chỉ có một thread: kết nối không bị dùng song song và lệnh chạy theo FIFO
+        self._executor = get_executor('db')
+        # Các dòng (user_id, persona_name, role, content) chưa được gửi xuống thread DB
+        self._pending = []
+        self._has_pending = asyncio.Event()
+        self._batch_full = asyncio.Event()
+        self._flusher = None
+        self._closing = False
+
+    # --- VÒNG ĐỜI KẾT NỐI ---
+    async def open(self):
+        await self._run(self._open)
+        self._closing = False
+        self._flusher = asyncio.create_task(self._flush_loop())
+
+    async def close(self):
+        if self._flusher is not None:
+            # Không hủy flusher: hủy future của một lô đang xếp hàng trên executor 'db' cũng hủy luôn
+            # tác vụ ghi, và lô đó (đã rời khỏi _pending) sẽ bị mất. Báo dừng rồi chờ lô đang ghi xong.
+            self._closing = True
+            self._has_pending.set()
+            self._batch_full.set()
+            await self._flusher
+            self._flusher = None
+        if self._conn is not None:
+            # Ghi nốt các tin nhắn còn trong hàng đợi trước khi đóng kết nối
+            await self.flush()
+            await self._run(self._close)
+
+    def _open(self):
+        if self._conn is not None: return
+        # isolation_level=None: tự quản lý transaction bằng BEGIN/COMMIT
+        conn = sqlite3.connect(self.db_file, check_same_thread=False, isolation_level=None, cached_statements=256)
+        for pragma in SQLITE_PRAGMAS:
+            conn.execute(pragma)
+        self._migrate(conn)
+        self._conn = conn
+
+    def _close(self):
+        try: self._conn.execute("PRAGMA optimize")
+        except sqlite3.Error: pass
+        self._conn.close()
+        self._conn = None
+
+    def _migrate(self, conn: sqlite3.Connection):
+        current_version = conn.execute("PRAGMA user_version").fetchone()[0]
+        for version, statements in enumerate(MIGRATIONS, start=1):
+            if version <= current_version: continue
+            with self._transaction(conn):
+                for statement in statements:
+                    conn.execute(statement)
+                # PRAGMA không nhận tham số, version là số nguyên nên format trực tiếp là an toàn
+                conn.execute(f"PRAGMA user_version = {version}")
+            print(f"Đã nâng cấp schema {self.db_file} lên phiên bản {version}.")
+
+    @staticmethod
+    @contextmanager
+    def _transaction(conn: sqlite3.Connection):
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        else:
+            conn.execute("COMMIT")
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, timed(SQLITE_SECONDS.labels('chat'))(func), *args)
+
+    # --- HÀNG ĐỢI GHI TRỄ (GROUP COMMIT) ---
+    async def _flush_loop(self):
+        while not self._closing:
+            await self._has_pending.wait()
+            if len(self._pending) < self.max_batch:
+                try: await asyncio.wait_for(self._batch_full.wait(), timeout=self.flush_interval)
+                except asyncio.TimeoutError: pass
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"Lỗi khi ghi lịch sử trò chuyện xuống {self.db_file}: {e}")
+
+    async def flush(self):
+        """Ghi toàn bộ tin nhắn đang chờ trong một transaction."""
+        self._has_pending.clear()
+        self._batch_full.clear()
+        if not self._pending: return
+        batch, self._pending = self._pending, []
+        await self._run(self._write_batch, batch)
+
+    def _write_batch(self, batch):
+        with self._transaction(self._conn) as conn:
+            conn.executemany(SQL_INSERT_MESSAGE, batch)
+            # Mỗi cặp (user, persona) chỉ cần prune một lần cho cả lô
+            for user_id, persona_name in dict.fromkeys((row[0], row[1]) for row in batch):
+                self._prune(conn, user_id, persona_name)
+
+    def _pending_for(self, user_id, persona_name):
+        return [{"role": row[2], "content": row[3]} for row in self._pending
+                if row[0] == user_id and row[1] == persona_name]
+
+    # --- LỊCH SỬ TRÒ CHUYỆN ---
+    def _prune(self, conn, user_id, persona_name):
+        """Chỉ giữ lại MEMORY_LIMIT tin nhắn mới nhất cho mỗi cặp (user, persona)."""
+        limit_id = conn.execute(SQL_PRUNE_BOUNDARY, (user_id, persona_name, self.memory_limit)).fetchone()
+        if limit_id:
+            conn.execute(SQL_PRUNE_DELETE, (user_id, persona_name, limit_id[0]))
+
+    def _get_summary(self, user_id, persona_name):
+        result = self._conn.execute(SQL_SELECT_SUMMARY, (user_id, persona_name)).fetchone()
+        return result[0] if result else ""
+
+    def _get_context(self, user_id, persona_name, limit):
+        rows = self._conn.execute(SQL_SELECT_HISTORY, (user_id, persona_name, limit)).fetchall()
+        history = [{"role": role, "content": content} for role, content in reversed(rows)]
+        return self._get_summary(user_id, persona_name), history
+
+    def _get_overflow(self, user_id, persona_name, keep):
+        limit_id = self._conn.execute(SQL_PRUNE_BOUNDARY, (user_id, persona_name, keep)).fetchone()
+        if not limit_id: return self._get_summary(user_id, persona_name), []
+        rows = self._conn.execute(SQL_SELECT_OVERFLOW, (user_id, persona_name, limit_id[0])).fetchall()
+        overflow = [{"id": row_id, "role": role, "content": content} for row_id, role, content in rows]
+        return self._get_summary(user_id, persona_name), overflow
+
+    def _save_summary(self, user_id, persona_name, summary, upto_id):
+        with self._transaction(self._conn) as conn:
+            # Lịch sử đã bị xóa trong lúc đang tóm tắt: bỏ qua để không làm sống lại dữ liệu cũ
+            if not conn.execute(SQL_ROW_EXISTS, (upto_id,)).fetchone(): return False
+            conn.execute(SQL_UPSERT_SUMMARY, (user_id, persona_name, summary))
+            conn.execute(SQL_PRUNE_DELETE, (user_id, persona_name, upto_id))
+            return True
+
+    def _delete_history(self, user_id, persona_name):
+        with self._transaction(self._conn) as conn:
+            conn.execute(SQL_DELETE_SUMMARY, (user_id, persona_name))
+            return conn.execute(SQL_DELETE_HISTORY, (user_id, persona_name)).rowcount
+
+    async def add_message(self, user_id: int, persona_name: str, role: str, content: str):
+        """Đưa tin nhắn vào hàng đợi ghi trễ; không chờ đến khi dữ liệu được commit."""
+        self._pending.append((user_id, persona_name, role, content))
+        self._has_pending.set()
+        if len(self._pending) >= self.max_batch:
+            self._batch_full.set()
+
+    async def get_context(self, user_id: int, persona_name: str, limit: int):
+        """Trả về (bản tóm tắt, `limit` lượt gần nhất) của một cuộc trò chuyện."""
+        # Các lô đã gửi xuống thread DB trước lệnh đọc này chắc chắn đã được commit khi nó chạy (FIFO),
+        # nên chỉ cần ghép thêm những dòng còn nằm trong hàng đợi để đảm bảo read-your-writes.
+        unflushed = self._pending_for(user_id, persona_name)
+        summary, history = await self._run(self._get_context, user_id, persona_name, limit)
+        return summary, (history + unflushed)[-limit:]
+
+    async def get_overflow(self, user_id: int, persona_name: str, keep: int):
+        """Trả về (bản tóm tắt hiện tại, các dòng cũ hơn `keep` lượt gần nhất) theo thứ tự thời gian."""
+        await self.flush()
+        return await self._run(self._get_overflow, user_id, persona_name, keep)
+
+    async def save_summary(self, user_id: int, persona_name: str, summary: str, upto_id: int) -> bool:
+        """Lưu bản tóm tắt mới và xóa các dòng đã được tóm tắt (id <= upto_id) trong cùng một transaction."""
+        return await self._run(self._save_summary, user_id, persona_name, summary, upto_id)
+
+    async def delete_history(self, user_id: int, persona_name: str) -> int:
+        """Xóa toàn bộ lịch sử trò chuyện (kể cả bản tóm tắt) của một user với một persona cụ thể."""
+        before = len(self._pending)
+        self._pending = [row for row in self._pending if row[0] != user_id or row[1] != persona_name]
+        dropped = before - len(self._pending)
+        return dropped + await self._run(self._delete_history, user_id, persona_name)
+
+    # --- PERSONA THEO KÊNH ---
+    def _get_channel_persona(self, channel_id):
+        result = self._conn.execute(SQL_SELECT_CHANNEL_PERSONA, (channel_id,)).fetchone()
+        return result[0] if result else None
+
+    def _get_all_channel_personas(self):
+        return dict(self._conn.execute(SQL_SELECT_ALL_CHANNEL_PERSONAS).fetchall())
+
+    def _set_channel_persona(self, channel_id, persona_name):
+        with self._transaction(self._conn) as conn:
+            conn.execute(SQL_UPSERT_CHANNEL_PERSONA, (channel_id, persona_name))
+
+    async def get_channel_persona(self, channel_id: int):
+        """Trả về persona đã đặt cho kênh, hoặc None nếu kênh chưa được cấu hình."""
+        return await self._run(self._get_channel_persona, channel_id)
+
+    async def get_all_channel_personas(self):
+        """Trả về toàn bộ bảng {channel_id: persona_name}."""
+        return await self._run(self._get_all_channel_personas)
+
+    async def set_channel_persona(self, channel_id: int, persona_name: str):
+        await self._run(self._set_channel_persona, channel_id, persona_name)
@@ -0,0 +1,91 @@
+# utils/streaming_reply.py
+import asyncio
+
+DISCORD_MESSAGE_LIMIT = 2000
+STREAM_CURSOR = " ▌"
+
+
+def paginate(text: str, limit: int = DISCORD_MESSAGE_LIMIT):
+    """Chia văn bản thành các trang <= limit ký tự, ưu tiên cắt ở xuống dòng hoặc khoảng trắng.
+
+    Điểm cắt của một trang chỉ phụ thuộc vào phần văn bản trước nó, nên khi văn bản dài thêm
+    thì các trang đã đầy không bị thay đổi.
+    """
+    pages = []
+    while len(text) > limit:
+        cut = text.rfind('\n', 0, limit + 1)
+        if cut <= 0: cut = text.rfind(' ', 0, limit + 1)
+        if cut <= 0: cut = limit
+        pages.append(text[:cut])
+        text = text[cut:].lstrip()
+    if text: pages.append(text)
+    return pages
+
+
+class StreamingReply:
+    """Hiển thị câu trả lời đang được sinh: gửi tin nhắn ngay khi có token đầu tiên rồi sửa dần.
+
+    Việc đọc stream và việc sửa tin nhắn chạy tách rời, nên một lần sửa bị Discord giới hạn
+    tốc độ không làm chậm việc nhận token. Khoảng cách giữa hai lần sửa tự giãn ra khi
+    các request sửa bắt đầu chậm (dấu hiệu đang bị rate limit).
+    """
+    def __init__(self, send, edit_interval: float = 1.2, max_edit_interval: float = 5.0):
+        self._send = send
+        self.edit_interval = edit_interval
+        self.max_edit_interval = max_edit_interval
+        self.text = ""
+        self._messages = []  # các tin nhắn đã gửi, mỗi tin nhắn là một trang
+        self._shown = []  # nội dung đang hiển thị của từng tin nhắn
+        self._changed = asyncio.Event()
+        self._finished = asyncio.Event()
+        self._done = False
+
+    async def consume(self, chunks):
+        """Đọc hết async iterator `chunks` và trả về toàn bộ văn bản."""
+        renderer = asyncio.create_task(self._render_loop())
+        try:
+            async for delta in chunks:
+                self.text += delta
+                self._changed.set()
+        finally:
+            self._done = True
+            self._changed.set()
+            self._finished.set()
+            await renderer
+        return self.text
+
+    async def _render_loop(self):
+        interval = self.edit_interval
+        while True:
+            await self._changed.wait()
+            self._changed.clear()
+            final = self._done
+            loop = asyncio.get_running_loop()
+            started = loop.time()
+            await self._sync(final)
+            if final: return
+            elapsed = loop.time() - started
+            interval = min(self.max_edit_interval, max(self.edit_interval, elapsed * 2))
+            # Trong lúc chờ vẫn kết thúc sớm nếu stream đã xong để gửi bản cuối
+            if not self._done:
+                try: await asyncio.wait_for(self._finished.wait(), timeout=interval)
+                except asyncio.TimeoutError: pass
+
+    async def _sync(self, final: bool):
+        pages = paginate(self.text)
+        for i, page in enumerate(pages):
+            is_last = i == len(pages) - 1
+            content = page
+            if not final and is_last and len(page) + len(STREAM_CURSOR) <= DISCORD_MESSAGE_LIMIT:
+                content = page + STREAM_CURSOR
+            try:
+                if i < len(self._messages):
+                    if self._shown[i] != content:
+                        await self._messages[i].edit(content=content)
+                        self._shown[i] = content
+                else:
+                    self._messages.append(await self._send(content))
+                    self._shown.append(content)
+            except Exception as e:
+                print(f"Lỗi khi cập nhật tin nhắn stream: {e}")
+                return
@@ -0,0 +1,91 @@
+# utils/tts_cache.py
+import hashlib
+import os
+import subprocess
+import tempfile
+import threading
+
+CACHE_EXTENSION = '.ogg'
+# Opus 48kHz stereo để FFmpegOpusAudio có thể phát thẳng (codec='copy') không cần mã hóa lại
+FFMPEG_ENCODE_ARGS = ['-c:a', 'libopus', '-b:a', '64k', '-ar', '48000', '-ac', '2', '-f', 'ogg']
+
+
+class TTSCache:
+    """Cache audio TTS trên đĩa, khóa theo hash của (voice id, model id, văn bản đã chuẩn hóa).
+
+    File được ghi ra file tạm rồi `os.replace` sang tên cuối, nên nhiều guild (hoặc nhiều tiến trình)
+    dùng chung thư mục không bao giờ đọc phải file ghi dở. mtime của file được dùng làm mốc LRU:
+    mỗi lần cache hit sẽ cập nhật mtime, khi vượt `max_bytes` file cũ nhất bị xóa trước.
+    """
+    def __init__(self, folder: str, max_bytes: int):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._total_bytes = None  # tính lười ở lần ghi đầu tiên
+
+    @staticmethod
+    def make_key(voice_id: str, model_id: str, text: str):
+        return hashlib.sha256(f"{voice_id}\0{model_id}\0{text}".encode('utf-8')).hexdigest()
+
+    def path_for(self, key: str):
+        return os.path.join(self.folder, key + CACHE_EXTENSION)
+
+    def lookup(self, key: str):
+        """Trả về đường dẫn file nếu có trong cache (và đánh dấu vừa được dùng), ngược lại None."""
+        path = self.path_for(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def store(self, key: str, audio: bytes):
+        """Mã hóa audio (mp3 từ ElevenLabs) sang Opus và lưu vào cache. Chạy trong executor."""
+        os.makedirs(self.folder, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(suffix=CACHE_EXTENSION + '.tmp', dir=self.folder)
+        os.close(fd)
+        try:
+            subprocess.run(['ffmpeg', '-y', '-loglevel', 'error', '-i', 'pipe:0', *FFMPEG_ENCODE_ARGS, tmp_path],
+                           input=audio, check=True, timeout=120, capture_output=True)
+            size = os.path.getsize(tmp_path)
+            os.replace(tmp_path, self.path_for(key))
+        except BaseException:
+            try: os.remove(tmp_path)
+            except OSError: pass
+            raise
+        with self._lock:
+            if self._total_bytes is None:
+                self._total_bytes = self._scan_size()
+            else:
+                self._total_bytes += size
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _entries(self):
+        entries = []
+        with os.scandir(self.folder) as it:
+            for entry in it:
+                if not entry.name.endswith(CACHE_EXTENSION): continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def _scan_size(self):
+        return sum(size for _, size, _ in self._entries())
+
+    def _evict(self):
+        """Xóa các file ít được dùng gần đây nhất cho tới khi còn dưới 90% dung lượng cho phép."""
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        target = self.max_bytes * 0.9
+        for _, size, path in entries:
+            if total <= target: break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        self._total_bytes = total
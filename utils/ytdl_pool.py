@@ -0,0 +1,96 @@
+# utils/ytdl_pool.py
+import os
+import threading
+import time
+
+
+class SharedCookieJar:
+    """Nạp cookies.txt một lần và dùng chung cho mọi instance YoutubeDL.
+
+    `http.cookiejar.CookieJar` tự khóa nội bộ nên nhiều thread dùng chung được. File chỉ được
+    đọc lại khi mtime thay đổi, và không bao giờ bị ghi ngược lại (tránh nhiều thread cùng ghi file).
+    """
+    def __init__(self, cookie_file: str):
+        self.cookie_file = cookie_file
+        self._lock = threading.Lock()
+        self._jar = None
+        self._mtime = None
+
+    def get(self):
+        try:
+            mtime = os.stat(self.cookie_file).st_mtime_ns if self.cookie_file else None
+        except FileNotFoundError:
+            mtime = None
+        with self._lock:
+            if self._jar is None or mtime != self._mtime:
+                from yt_dlp.cookies import YoutubeDLCookieJar
+                jar = YoutubeDLCookieJar(self.cookie_file)
+                if mtime is not None:
+                    try:
+                        jar.load(ignore_discard=True, ignore_expires=True)
+                    except Exception as e:
+                        print(f"Không thể đọc {self.cookie_file}: {e}")
+                self._jar = jar
+                self._mtime = mtime
+            return self._jar
+
+
+class YTDLPool:
+    """Mỗi thread giữ một instance YoutubeDL sống lâu cho một bộ tùy chọn.
+
+    Tạo YoutubeDL mới cho mỗi lần gọi phải nạp lại bộ extractor, đọc lại cookies và mở kết nối HTTP
+    mới. Ở đây instance được dùng lại (giữ luôn kết nối keep-alive) và chỉ được tạo lại sau
+    `max_uses` lần dùng hoặc `max_age` giây để giới hạn bộ nhớ tích lũy bên trong yt-dlp.
+    """
+    def __init__(self, options: dict, cookies: SharedCookieJar = None, max_uses: int = 200, max_age: float = 1800):
+        self.options = {key: value for key, value in options.items() if key != 'cookiefile'}
+        self.cookies = cookies
+        self.max_uses = max_uses
+        self.max_age = max_age
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+        self.created = 0
+        self.recycled = 0
+
+    def _create(self):
+        # yt_dlp nạp hàng nghìn extractor khi import: chỉ import khi thật sự cần (lần tìm/phát đầu tiên, trong executor)
+        import yt_dlp
+        ydl = yt_dlp.YoutubeDL(self.options)
+        if self.cookies:
+            # cookiejar là cached_property: gán trước lần request đầu để yt-dlp dùng jar chung
+            ydl.cookiejar = self.cookies.get()
+        self._local.ydl = ydl
+        self._local.uses = 0
+        self._local.created_at = time.monotonic()
+        with self._stats_lock:
+            self.created += 1
+        return ydl
+
+    def _acquire(self):
+        ydl = getattr(self._local, 'ydl', None)
+        if ydl is None: return self._create()
+        expired = time.monotonic() - self._local.created_at > self.max_age
+        cookies_changed = self.cookies and ydl.cookiejar is not self.cookies.get()
+        if self._local.uses >= self.max_uses or expired or cookies_changed:
+            self._close(ydl)
+            with self._stats_lock:
+                self.recycled += 1
+            return self._create()
+        return ydl
+
+    def _close(self, ydl):
+        self._local.ydl = None
+        try:
+            ydl.close()
+        except Exception as e:
+            print(f"Lỗi khi đóng YoutubeDL: {e}")
+
+    def extract_info(self, url: str, **kwargs):
+        """Giống `YoutubeDL.extract_info` nhưng dùng instance của thread hiện tại. Chạy trong executor."""
+        ydl = self._acquire()
+        self._local.uses += 1
+        return ydl.extract_info(url, **kwargs)
+
+    def stats(self):
+        with self._stats_lock:
+            return {'created': self.created, 'recycled': self.recycled}